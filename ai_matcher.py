@@ -4,38 +4,203 @@ AI-based job matching using Google Gemini
 
 import os
 import json
+import hashlib
+import heapq
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from typing import Optional
 import google.generativeai as genai
 from dotenv import load_dotenv
+from matching import PREFERENCE_FIELDS, JobFilter, hourly_rate, parse_work_types
 
 load_dotenv()
 
+# Job fields that go into the prompt; changing any of them makes a new version of the job
+PROMPT_JOB_FIELDS = ('farm_name', 'work_type', 'payment_type', 'payment_amount', 'pay_rate', 'effective_hourly_rate',
+                     'location', 'hours', 'workers_needed', 'description', 'transportation')
+
+
+# Rough size of a token in English text, for budgeting the prompt
+CHARS_PER_TOKEN = 4
+
+
+def truncate(text: str, tokens: int) -> str:
+    # Cut text to about `tokens` tokens, at a word boundary
+    limit = max(tokens, 0) * CHARS_PER_TOKEN
+    if len(text) <= limit:
+        return text
+    cut = text[:limit]
+    if ' ' in cut:
+        cut = cut.rsplit(' ', 1)[0]
+    return cut.rstrip() + '…'
+
+
+def _digest(value) -> str:
+    return hashlib.sha256(json.dumps(value, sort_keys=True, default=str).encode()).hexdigest()
+
+
+def _normalize(value):
+    # "$15" and 15, or " Full-Time" and "full-time", ask Gemini the same thing
+    if isinstance(value, str):
+        text = ' '.join(value.lower().split())
+        try:
+            return float(text.lstrip('$'))
+        except ValueError:
+            return text
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return float(value)
+    return value
+
+
+def cache_key(jobs: list, farmer_profile: dict) -> Optional[str]:
+    # The farmer's normalized preferences plus each job's ID and version,
+    # hashed; None when jobs can't be told apart by ID
+    job_ids = [job.get('job_id') for job in jobs]
+    if None in job_ids or len(set(job_ids)) != len(job_ids):
+        return None
+
+    prefs = {field: _normalize(farmer_profile.get(field)) for field in PREFERENCE_FIELDS}
+    work_types = parse_work_types(farmer_profile.get('work_types'))
+    prefs['work_types'] = sorted(work_types) if work_types is not None else None
+    catalog = sorted((job['job_id'], _digest({field: job.get(field) for field in PROMPT_JOB_FIELDS}))
+                     for job in jobs)
+    return _digest([prefs, catalog])
+
+
+class ResponseCache:
+    """Parsed Gemini results by cache_key(), with LRU and TTL eviction.
+
+    With a path, entries are also saved to that JSON file and loaded again on
+    start, so a restart doesn't pay for the same prompts twice.
+    """
+
+    def __init__(self, max_entries: int = 1024, ttl: float = 3600.0, path: Optional[str] = None):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.path = path
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        if path:
+            self._load()
+
+    def get(self, key: str) -> Optional[list]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if time.time() - entry[0] > self.ttl:
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return entry[1]
+
+    def put(self, key: str, matches: list):
+        with self._lock:
+            self._entries[key] = (time.time(), matches)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+            if self.path:
+                self._save()
+
+    def _load(self):
+        try:
+            with open(self.path) as f:
+                entries = json.load(f)
+        except (FileNotFoundError, ValueError):
+            return
+        now = time.time()
+        for key, (stored_at, matches) in entries:
+            if now - stored_at <= self.ttl:
+                self._entries[key] = (stored_at, matches)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def _save(self):
+        directory = os.path.dirname(self.path) or '.'
+        fd, tmp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'w') as f:
+                json.dump([[key, list(entry)] for key, entry in self._entries.items()], f)
+            os.replace(tmp_path, self.path)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+
+
 class AIJobMatcher:
-    def __init__(self):
+    """Ranks jobs for a farmer with Gemini.
+
+    Jobs are first narrowed locally: those that pass the farmer's pay floor,
+    work type, hours and distance (matching.JobFilter), best paid first, up to
+    max_candidates. Only those go in the prompt, with their descriptions
+    sharing description_tokens between them.
+    """
+
+    def __init__(self, cache: Optional[ResponseCache] = None, max_candidates: int = 20,
+                 description_tokens: int = 1000):
         api_key = os.getenv('GEMINI_API_KEY')
         if not api_key or api_key == 'your_gemini_api_key_here':
             raise ValueError("GEMINI_API_KEY not configured in .env file")
 
         genai.configure(api_key=api_key)
         self.model = genai.GenerativeModel('gemini-2.5-flash')
+        if cache is None:
+            cache = ResponseCache(ttl=float(os.getenv('AI_CACHE_TTL', 3600)), path=os.getenv('AI_CACHE_FILE'))
+        self.cache = cache
+        self.max_candidates = max_candidates
+        self.description_tokens = description_tokens
 
     def match_jobs(self, jobs: list, farmer_profile: dict) -> list:
+        # job_index in the response refers to the candidates, so they are
+        # what the response is parsed and cached against
+        jobs = self._candidates(jobs, farmer_profile)
         if not jobs:
             return []
 
+        key = cache_key(jobs, farmer_profile)
+        cached = self.cache.get(key) if key else None
+        if cached is not None:
+            return self._remap(cached, jobs)
+
         prompt = self._build_matching_prompt(jobs, farmer_profile)
 
         try:
             response = self.model.generate_content(prompt)
             result = self._parse_response(response.text, jobs)
+            if result is not None and key:
+                self.cache.put(key, [[job['job_id'], job['_ai_score'], job['_ai_reason']] for job in result])
             return result
         except Exception as e:
             print(f"AI matching error: {e}")
             return None
 
+    def _candidates(self, jobs: list, farmer_profile: dict) -> list:
+        # A job paid some other way (e.g. per task) has no hourly rate to hold
+        # against the farmer's minimum, so it skips that check and the model
+        # weighs its pay instead
+        job_filter = JobFilter(farmer_profile)
+        any_pay = JobFilter(dict(farmer_profile, min_pay_rate=None))
+        candidates = (job for job in jobs if job_filter(job) or (not hourly_rate(job) and any_pay(job)))
+        return heapq.nlargest(self.max_candidates, candidates, key=hourly_rate)
+
+    def _remap(self, cached: list, jobs: list) -> list:
+        # A cached result as copies of the current job dicts, in cached order
+        by_id = {job['job_id']: job for job in jobs}
+        matched_jobs = []
+        for job_id, score, reason in cached:
+            job = by_id[job_id].copy()
+            job['_ai_score'] = score
+            job['_ai_reason'] = reason
+            matched_jobs.append(job)
+        return matched_jobs
+
     def _build_matching_prompt(self, jobs: list, farmer_profile: dict) -> str:
+        # No name: results are cached and shared by farmers with the same preferences
         farmer_info = f"""
                         FARMER PROFILE:
-                        - Name: {farmer_profile.get('name', 'Unknown')}
                         - Location: {farmer_profile.get('location', 'Unknown')}
                         - Preferred work types: {farmer_profile.get('work_types', 'Any')}
                         - Minimum pay rate: ${farmer_profile.get('min_pay_rate', 0)}/hour
@@ -43,30 +208,26 @@ class AIJobMatcher:
                         - Hours preference: {farmer_profile.get('hours_preference', 'Any')}
                         """
         jobs_info = "AVAILABLE JOBS:\n"
+        description_tokens = self.description_tokens // max(len(jobs), 1)
 
         for i, job in enumerate(jobs):
+            effective_rate = hourly_rate(job)
             if job.get('payment_type') == 'per day':
-                effective_rate = job.get('payment_amount', 0) / 8
                 pay_display = f"${job.get('payment_amount', 0)}/day (${effective_rate:.2f}/hr effective)"
-            elif job.get('payment_type') == 'per hour':
-                effective_rate = job.get('payment_amount', 0)
-                pay_display = f"${effective_rate}/hour"
             elif job.get('payment_type') == 'per task':
-                effective_rate = job.get('payment_amount', 0)
-                pay_display = f"${effective_rate}/task (piece rate)"
+                pay_display = f"${job.get('payment_amount', 0)}/task (piece rate)"
             else:
-                effective_rate = job.get('pay_rate', 0)
                 pay_display = f"${effective_rate}/hour"
 
             jobs_info += f"""
-                        Job {i + 1} (ID: {job.get('job_id', i)}):
+                        Job {i + 1} (job_index: {i}, ID: {job.get('job_id', i)}):
                         - Farm: {job.get('farm_name', 'Unknown')}
                         - Work Type: {job.get('work_type', 'General')}
                         - Pay: {pay_display}
                         - Location: {job.get('location', 'Unknown')}
                         - Schedule: {job.get('hours', 'Not specified')}
                         - Workers Needed: {job.get('workers_needed', 1)}
-                        - Description: {job.get('description', 'No description')}
+                        - Description: {truncate(str(job.get('description') or 'No description'), description_tokens)}
                         - Transportation: {job.get('transportation', 'Not specified')}
                         """
 
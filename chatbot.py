@@ -1,6 +1,11 @@
 from data_store import DataStore
-from typing import Optional, Tuple
+from matching import JobFilter, RecommendationCache, hourly_rate
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from typing import List, Optional, Tuple
+import heapq
 import os
+import threading
 from twilio.rest import Client
 from dotenv import load_dotenv
 from ai_matcher import get_ai_matcher
@@ -8,14 +13,20 @@ from ai_matcher import get_ai_matcher
 load_dotenv()
 
 class FarmConnectBot:
-    def __init__(self):
-        self.store = DataStore()
+    def __init__(self, store=None):
+        self.store = store if store is not None else DataStore()
         account_sid = os.environ.get("TWILIO_ACCOUNT_SID")
         auth_token = os.environ.get("TWILIO_AUTH_TOKEN")
         self.twilio_client = Client(account_sid, auth_token) if account_sid and auth_token else None
         self.twilio_number = "whatsapp:+14155238886"  # Twilio sandbox number
         self.ai_matcher = None  # get_ai_matcher()
 
+        # Bulk notifications go out from here so the caller doesn't wait on Twilio
+        self.sender = ThreadPoolExecutor(max_workers=8, thread_name_prefix='send-message')
+        self._outbox = threading.local()
+        self.recommendations = RecommendationCache()
+        self.store.add_job_listener(self.notify_new_job)
+
         self.state_handlers = {
             'awaiting_role_selection': self._handle_role_selection,
 
@@ -59,19 +70,21 @@ class FarmConnectBot:
         }
 
     def handle_message(self, from_number: str, message_body: str, media_url: Optional[str] = None) -> str:
-        user = self.store.get_user(from_number)        
-        if not user:
+        # One transaction per message: each data file is written at most once
+        with self.sending_after_commit(), self.store.transaction():
+            user = self.store.get_user(from_number)
+            if not user:
+                return self.show_welcome_menu(from_number)
+
+            if user.get('registered'):
+                if message_body.lower() == 'menu':
+                    return self.show_main_menu(from_number, user)
+                elif message_body.lower() == 'help':
+                    return self.show_help()
+                else:
+                    return self.handle_menu_selection(from_number, user, message_body)
+
             return self.show_welcome_menu(from_number)
-        
-        if user.get('registered'):
-            if message_body.lower() == 'menu':
-                return self.show_main_menu(from_number, user)
-            elif message_body.lower() == 'help':
-                return self.show_help()
-            else:
-                return self.handle_menu_selection(from_number, user, message_body)
-            
-        return self.show_welcome_menu(from_number)
 
     def show_welcome_menu(self, from_number: str) -> str:
         msg = """🌾 *Welcome to FarmConnect!* 🌾
@@ -279,18 +292,27 @@ class FarmConnectBot:
             '3': 'flexible'
         }
         if choice in hours_map:
-            self.store.update_user_profile(from_number, {'hours_preference': hours_map[choice]})
+            updates = {'hours_preference': hours_map[choice]}
+            matched_jobs = self.match_before_saving(from_number, updates)
+            self.store.update_user_profile(from_number, updates)
             self.store.clear_conversation_state(from_number)
 
-            return self.show_job_recommendations(from_number)
+            return self.show_job_recommendations(from_number, matched_jobs)
         else:
             return "Please reply with 1, 2, or 3"
 
-    def show_job_recommendations(self, from_number: str) -> str:
-        user = self.store.get_user(from_number)
-        prefs = user.get('profile', {})
-        open_jobs = self.store.get_open_jobs()
-        matched_jobs = self.match_jobs(open_jobs, prefs, from_number)
+    def match_before_saving(self, from_number: str, profile_updates: dict) -> list:
+        # Match against the profile as it will be once updated, before the
+        # update is written: a store that locks on its first write (see
+        # SQLiteStore) would otherwise hold the lock while Gemini answers
+        prefs = {**self.store.get_user(from_number).get('profile', {}), **profile_updates}
+        return self.match_jobs(None, prefs, from_number)
+
+    def show_job_recommendations(self, from_number: str, matched_jobs: Optional[list] = None) -> str:
+        if matched_jobs is None:
+            user = self.store.get_user(from_number)
+            prefs = user.get('profile', {})
+            matched_jobs = self.match_jobs(None, prefs, from_number)
 
         if not matched_jobs:
             return f"""✅ *Profile Complete!*
@@ -492,12 +514,12 @@ class FarmConnectBot:
         else:
             return "Please reply with 1 (Apply) or 2 (Show next job), or type 'menu' for main menu."
 
-    def match_jobs(self, jobs: list, prefs: dict, from_number: str = None) -> list:
+    def match_jobs(self, jobs: Optional[list], prefs: dict, from_number: str = None) -> list:
                 # Try AI matching first if available
         if self.ai_matcher:
             try:
                 print("AI matching in progress...")
-                ai_results = self.ai_matcher.match_jobs(jobs, prefs)
+                ai_results = self.ai_matcher.match_jobs(jobs if jobs is not None else self.store.get_open_jobs(), prefs)
                 if ai_results is not None:
                     print(f"AI matching returned {len(ai_results)} jobs")
                     return ai_results
@@ -506,40 +528,25 @@ class FarmConnectBot:
             except Exception as e:
                 print(f"AI matching failed: {e}, falling back to rule-based")
 
+        if jobs is None and from_number is not None:
+            return self.recommendations.top(self.store, from_number, prefs,
+                                            lambda prefs: self._rule_based_match(None, prefs))
         return self._rule_based_match(jobs, prefs)
 
-    def _rule_based_match(self, jobs: list, prefs: dict) -> list:
-        matched = []
-        for job in jobs:
-            pref_types = prefs.get('work_types', '').lower()
-            job_type = job.get('work_type', '').lower()
-            if 'all types of work' in pref_types:
-                matched.append(job)
-                continue
-            if pref_types:
-                type_match = False
-                for pref_type in pref_types.split(','):
-                    pref_type = pref_type.strip()
-                    if pref_type in job_type or job_type in pref_type:
-                        type_match = True
-                        break
-
-                if not type_match:
-                    continue
-
-            matched.append(job)
-
-        def get_sort_key(job):
-            if job.get('payment_type') == 'per day':
-                return job.get('payment_amount', 0) / 8
-            elif job.get('payment_type') == 'per hour':
-                return job.get('payment_amount', 0)
-            else:
-                return job.get('pay_rate', 0)
-
-        matched.sort(key=get_sort_key, reverse=True)
+    def _rule_based_match(self, jobs: Optional[list], prefs: dict) -> list:
+        # jobs=None matches all open jobs, scored together in the store's job
+        # matrix when it keeps one (see job_matrix()), otherwise through its indexes
+        job_filter = JobFilter(prefs)
+        if jobs is None:
+            matrix = self.store.job_matrix()
+            if matrix is not None:
+                return matrix.top(job_filter, 5)
+            matched = self.store.iter_open_jobs(work_type=job_filter.work_type, min_rate=job_filter.min_rate,
+                                                hours=job_filter.hours, within=job_filter.within)
+        else:
+            matched = filter(job_filter, jobs)
 
-        return matched[:5]
+        return heapq.nlargest(5, matched, key=hourly_rate)
 
     def handle_job_selection_from_list(self, from_number: str, message: str, data: dict) -> str:
         message = message.strip()
@@ -801,7 +808,30 @@ class FarmConnectBot:
 
         return "✅ Message sent!"
 
+    @contextmanager
+    def sending_after_commit(self):
+        # Hold messages sent inside the block until it exits. handle_message
+        # wraps its transaction in this so Twilio isn't called while the
+        # store may hold its write lock; if the block raises, the messages
+        # are dropped along with the writes they announced.
+        if getattr(self._outbox, 'messages', None) is not None:
+            yield
+            return
+
+        self._outbox.messages = []
+        try:
+            yield
+        finally:
+            messages, self._outbox.messages = self._outbox.messages, None
+        for to_phone, message in messages:
+            self.send_message(to_phone, message)
+
     def send_message(self, to_phone: str, message: str):
+        messages = getattr(self._outbox, 'messages', None)
+        if messages is not None:
+            messages.append((to_phone, message))
+            return
+
         if not self.twilio_client:
             print(f"Would send to {to_phone}: {message}")
             return
@@ -815,6 +845,36 @@ class FarmConnectBot:
         except Exception as e:
             print(f"Error sending message: {e}")
 
+    def send_messages(self, messages: List[Tuple[str, str]]) -> list:
+        # Queue (to_phone, message) pairs for sending; returns their futures
+        return [self.sender.submit(self.send_message, to_phone, message) for to_phone, message in messages]
+
+    def notify_new_job(self, job: dict) -> list:
+        # Tell every farmer whose preferences match a newly posted job
+        if job.get('status', 'open') != 'open':
+            return []
+        phones = self.store.find_matching_farmers(job)
+        return self.send_messages([(phone, self.job_alert(phone, job)) for phone in phones])
+
+    def job_alert(self, to_phone: str, job: dict) -> str:
+        if job.get('payment_type') == 'per day':
+            pay_display = f"${job.get('payment_amount', 'N/A')}/day"
+        elif job.get('payment_type') == 'per hour':
+            pay_display = f"${job.get('payment_amount', 'N/A')}/hour"
+        elif job.get('pay_rate'):
+            pay_display = f"${job.get('pay_rate')}/hour"
+        else:
+            pay_display = "Contact for details"
+
+        return f"""🔔 *New job matching your preferences!*
+
+            *{job.get('work_type', 'Farm Work')}*
+            🏡 {job.get('farm_name', 'Farm')}
+            💰 {pay_display}
+            📍 {job.get('location', 'N/A')}
+
+            Type 'menu' and choose 1 to browse jobs."""
+
     def handle_menu_selection(self, from_number: str, user: dict, choice: str) -> str:
         if user['type'] == 'farmer':
             if choice == '1':
@@ -834,7 +894,7 @@ class FarmConnectBot:
 
                     Reply with number (1-6):"""
             elif choice == '3':
-                matches = self.store.get_farmer_matches(from_number)
+                matches = self.store.get_farmer_matches(from_number, include_archived=True)
                 if not matches:
                     return "You haven't applied to any jobs yet.\n\n" + self.show_farmer_menu(from_number)
                 msg = "📋 *Your Job Applications:*\n\n"
@@ -988,8 +1048,8 @@ class FarmConnectBot:
                 {self.show_farmer_menu(from_number)}"""
 
     def view_owner_jobs(self, from_number: str) -> str:
-        all_jobs = self.store._read_json(self.store.jobs_file)
-        owner_jobs = [j for j in all_jobs.values() if j.get('owner_phone') == from_number]
+        owner_jobs = self.store.get_jobs_by_owner(from_number, fields=['work_type', 'pay_rate', 'status'],
+                                                 include_archived=True)
 
         if not owner_jobs:
             return "You haven't posted any jobs yet.\n\n" + self.show_owner_menu(from_number)
@@ -997,11 +1057,11 @@ class FarmConnectBot:
         msg = "📋 *Your Job Postings:*\n\n"
         
         for job in owner_jobs:
-            matches = self.store.get_job_matches(job['job_id'])
+            applications = self.store.count_job_matches(job['job_id'])
             msg += f"""*{job['work_type']}*
                     Pay: ${job['pay_rate']}/hr
                     Status: {job['status']}
-                    Applications: {len(matches)}
+                    Applications: {applications}
                     ━━━━━━━━━━━
 
                     """
@@ -14,14 +14,15 @@ class MultilingualFarmConnectBot(FarmConnectBot):
         self.store.update_user_profile(from_number, {'language': language})
 
     def handle_message(self, from_number: str, message_body: str, media_url: Optional[str] = None) -> str:
-        if message_body.lower() in ['español', 'spanish', 'es']:
-            self.set_user_language(from_number, 'es')
-            return "✅ Idioma cambiado a Español\n\n" + self.handle_message_multilingual(from_number, message_body, media_url)
-        elif message_body.lower() in ['english', 'inglés', 'ingles', 'en']:
-            self.set_user_language(from_number, 'en')
-            return "✅ Language changed to English\n\n" + self.handle_message_multilingual(from_number, message_body, media_url)
+        with self.sending_after_commit(), self.store.transaction():
+            if message_body.lower() in ['español', 'spanish', 'es']:
+                self.set_user_language(from_number, 'es')
+                return "✅ Idioma cambiado a Español\n\n" + self.handle_message_multilingual(from_number, message_body, media_url)
+            elif message_body.lower() in ['english', 'inglés', 'ingles', 'en']:
+                self.set_user_language(from_number, 'en')
+                return "✅ Language changed to English\n\n" + self.handle_message_multilingual(from_number, message_body, media_url)
 
-        return self.handle_message_multilingual(from_number, message_body, media_url)
+            return self.handle_message_multilingual(from_number, message_body, media_url)
 
     def handle_message_multilingual(self, from_number: str, message_body: str, media_url: Optional[str] = None) -> str:
         user = self.store.get_user(from_number)
@@ -170,26 +171,41 @@ class MultilingualFarmConnectBot(FarmConnectBot):
         }
 
         if choice in hours_map:
-            self.store.update_user_profile(from_number, {'hours_preference': hours_map[choice]})
+            updates = {'hours_preference': hours_map[choice]}
+            matched_jobs = self.match_before_saving(from_number, updates)
+            self.store.update_user_profile(from_number, updates)
             self.store.clear_conversation_state(from_number)
-            return self.show_job_recommendations(from_number)
+            return self.show_job_recommendations(from_number, matched_jobs)
         else:
             error_msg = "Please reply with 1, 2, or 3" if lang == 'en' else "Por favor responda con 1, 2, o 3"
             return error_msg
 
-    def show_job_recommendations(self, from_number: str) -> str:
+    def show_job_recommendations(self, from_number: str, matched_jobs: Optional[list] = None) -> str:
         lang = self.get_user_language(from_number)
-        user = self.store.get_user(from_number)
-        prefs = user.get('profile', {})
-
-        open_jobs = self.store.get_open_jobs()
-        matched_jobs = self.match_jobs(open_jobs, prefs, from_number)
+        if matched_jobs is None:
+            user = self.store.get_user(from_number)
+            prefs = user.get('profile', {})
+            matched_jobs = self.match_jobs(None, prefs, from_number)
 
         if not matched_jobs:
             return get_text('profile_complete', lang) + "\n\n" + get_text('no_jobs', lang) + "\n\n" + self.show_farmer_menu(from_number)
 
         return self.show_multiple_job_recommendations(from_number, matched_jobs)
 
+    def job_alert(self, to_phone: str, job: dict) -> str:
+        lang = self.get_user_language(to_phone)
+        if job.get('payment_type') == 'per day':
+            pay_display = f"${job.get('payment_amount', 'N/A')}" + get_text('per_day', lang)
+        elif job.get('payment_type') == 'per hour':
+            pay_display = f"${job.get('payment_amount', 'N/A')}" + get_text('per_hour', lang)
+        elif job.get('pay_rate'):
+            pay_display = f"${job.get('pay_rate')}" + get_text('per_hour', lang)
+        else:
+            pay_display = "Contact for details" if lang == 'en' else "Contacte para detalles"
+
+        return get_text('new_job_alert', lang, work_type=job.get('work_type', 'Farm Work'),
+                        farm_name=job.get('farm_name', 'Farm'), pay=pay_display, location=job.get('location', 'N/A'))
+
     def show_multiple_job_recommendations(self, from_number: str, matched_jobs: list) -> str:
         lang = self.get_user_language(from_number)
         count = len(matched_jobs)
@@ -173,9 +173,11 @@ class SimpleFarmConnectBot(FarmConnectBot):
             '3': 'flexible'
         }
         if choice in hours_map:
-            self.store.update_user_profile(from_number, {'hours_preference': hours_map[choice]})
+            updates = {'hours_preference': hours_map[choice]}
+            matched_jobs = self.match_before_saving(from_number, updates)
+            self.store.update_user_profile(from_number, updates)
             self.store.clear_conversation_state(from_number)
-            return self.show_job_recommendations(from_number)
+            return self.show_job_recommendations(from_number, matched_jobs)
         else:
             return """❌ Wrong number
 
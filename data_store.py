@@ -1,17 +1,533 @@
+import bisect
 import json
+import zlib
+import itertools
 import os
-from datetime import datetime
-from typing import Dict, List, Optional
+import secrets
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from gazetteer import add_coordinates, cells_within, grid_cell
+from matching import (HoursFilter, JobFilter, WorkTypeFilter, _number, coordinates, distance_miles,
+                      effective_hourly_rate, hourly_rate, job_expiry, reach)
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+try:
+    from job_matrix import JobMatrix
+except ImportError:  # numpy not installed
+    JobMatrix = None
+
+STORAGE_FORMATS = ('json', 'compact', 'fast', 'msgpack')
+
+
+def _codec(storage_format: str):
+    # -> (file extension, dumps to bytes, loads from bytes, decode errors)
+    if storage_format == 'json':
+        return '.json', lambda data: json.dumps(data, indent=2).encode(), json.loads, (ValueError,)
+    if storage_format == 'compact' or (storage_format == 'fast' and orjson is None):
+        return '.json', lambda data: json.dumps(data, separators=(',', ':')).encode(), json.loads, (ValueError,)
+    if storage_format == 'fast':
+        return '.json', orjson.dumps, orjson.loads, (ValueError,)
+    if storage_format == 'msgpack':
+        if msgpack is None:
+            raise RuntimeError("The msgpack format needs the msgpack package (pip install msgpack)")
+        return ('.msgpack', lambda data: msgpack.packb(data, use_bin_type=True),
+                lambda payload: msgpack.unpackb(payload, raw=False), (ValueError, msgpack.UnpackException))
+    raise ValueError(f"Unknown storage format {storage_format!r}, expected one of {STORAGE_FORMATS}")
+
+
+def _conversation_shard_count(data_dir: str, extension: str) -> int:
+    # How many conversation shards data_dir/conversations was last written
+    # with, or failing a record of that, how many its files cover
+    recorded = _recorded_shard_count(os.path.join(data_dir, 'conversations'))
+    if recorded is not None:
+        return recorded
+    shards = [int(name[:3]) for name in _shard_file_names(data_dir, extension)]
+    return max(shards) + 1 if shards else 0
+
+
+def _recorded_shard_count(conversations_dir: str) -> Optional[int]:
+    try:
+        with open(os.path.join(conversations_dir, 'shards')) as f:
+            return int(f.read())
+    except (FileNotFoundError, ValueError):
+        return None
+
+
+def _shard_file_names(data_dir: str, extension: str) -> List[str]:
+    # Shard files in data_dir/conversations, including any that so far
+    # exist only as a journal
+    try:
+        names = os.listdir(os.path.join(data_dir, 'conversations'))
+    except FileNotFoundError:
+        return []
+    return sorted({name[:3] + extension for name in names
+                   if name[:3].isdigit() and name[3:] in (extension, extension + '.log')})
+
+
+def convert_data_dir(data_dir: str, from_format: str, to_format: str, conversation_shards: Optional[int] = None):
+    # Rewrite every collection in data_dir from one storage format to another.
+    # conversation_shards defaults to the shard files already there.
+    if conversation_shards is None:
+        conversation_shards = _conversation_shard_count(data_dir, _codec(from_format)[0])
+    source = DataStore(data_dir, format=from_format, journal=True,  # folds in any journal
+                       conversation_shards=conversation_shards)
+    target = DataStore(data_dir, format=to_format, conversation_shards=conversation_shards)
+    extension = _codec(to_format)[0]
+    for source_file in source._collection_files():
+        target_file = os.path.splitext(source_file)[0] + extension
+        target._write_json(target_file, source._read_json(source_file))
+        if source_file != target_file:
+            os.remove(source_file)
+
+
+class UniqueIdGenerator:
+    """IDs like JOB_20261018093012_3f9a2c0001 that never collide.
+
+    The suffix is the process id plus a few random bits, then a per-process
+    counter, so no two processes (or two stores in one process) can produce
+    the same ID and nothing has to be read to make one.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._pid = None
+
+    def __call__(self, prefix: str) -> str:
+        with self._lock:
+            if self._pid != os.getpid():
+                # First use, or we are a freshly forked worker
+                self._pid = os.getpid()
+                self._node = f"{self._pid:x}{secrets.token_hex(2)}"
+                self._counter = itertools.count(1)
+            count = next(self._counter)
+        return f"{prefix}_{datetime.now().strftime('%Y%m%d%H%M%S')}_{self._node}{count:04d}"
+
+
+class SequenceIdGenerator:
+    """Sequential IDs like JOB_12_20261018093012.
+
+    The last number handed out per prefix is kept in a small JSON file that
+    is locked while it is bumped, so processes sharing it never repeat one.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+
+    def __call__(self, prefix: str) -> str:
+        with self._lock:
+            fd = os.open(self.path + '.lock', os.O_RDWR | os.O_CREAT, 0o644)
+            try:
+                if fcntl is not None:
+                    fcntl.flock(fd, fcntl.LOCK_EX)
+                try:
+                    with open(self.path, 'r') as f:
+                        counters = json.load(f)
+                except (FileNotFoundError, json.JSONDecodeError):
+                    counters = {}
+                counters[prefix] = counters.get(prefix, 0) + 1
+
+                tmp_path = f"{self.path}.{os.getpid()}.tmp"
+                with open(tmp_path, 'w') as f:
+                    json.dump(counters, f)
+                os.replace(tmp_path, self.path)
+            finally:
+                os.close(fd)
+        return f"{prefix}_{counters[prefix]}_{datetime.now().strftime('%Y%m%d%H%M%S')}"
+
+
+class _GroupCommit:
+    """Batches durable writes so that concurrent writers share the fsyncs.
+
+    Work submitted within `window` seconds is flushed together by whichever
+    thread arrived first. A key submitted more than once in the same batch is
+    flushed once, with its latest action. submit() returns when the batch
+    holding the caller's work has been flushed, so callers should not hold
+    locks other writers need while they wait.
+    """
+
+    def __init__(self, window: float):
+        self.window = window
+        self._cond = threading.Condition()
+        self._pending = {}
+        self._batch = 0
+        self._flushed = -1
+        self._flushing = False
+        self._errors = {}
+
+    def submit(self, actions: Dict):
+        with self._cond:
+            self._pending.update(actions)
+            batch = self._batch
+            while self._flushed < batch:
+                if self._flushing:
+                    self._cond.wait()
+                else:
+                    self._flush()
+            error = self._errors.get(batch)
+        if error is not None:
+            raise error
+
+    def _flush(self):
+        # Called with the condition held; drops it while sleeping and writing
+        self._flushing = True
+        self._cond.release()
+        try:
+            time.sleep(self.window)
+        finally:
+            self._cond.acquire()
+
+        actions, self._pending = self._pending, {}
+        batch = self._batch
+        self._batch += 1
+
+        self._cond.release()
+        error = None
+        try:
+            for action in actions.values():
+                try:
+                    action()
+                except Exception as e:
+                    error = error or e
+        finally:
+            self._cond.acquire()
+            if error is not None:
+                self._errors[batch] = error
+            self._flushed = batch
+            self._flushing = False
+            self._cond.notify_all()
+
+
+_DELETED = object()
+
+
+class _Overlay:
+    """A transaction's view of a cached collection.
+
+    Reads fall through to the shared cached records; the records the
+    transaction writes or deletes are kept in `changes` until commit, so
+    nothing is copied up front and other threads never see them. Write
+    methods replace a record rather than change it in place.
+    """
+
+    __slots__ = ('base', 'changes')
+
+    def __init__(self, base: Dict):
+        self.base = base
+        self.changes = {}
+
+    def __getitem__(self, key):
+        value = self.changes.get(key, self)
+        if value is self:
+            return self.base[key]
+        if value is _DELETED:
+            raise KeyError(key)
+        return value
+
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def __contains__(self, key):
+        value = self.changes.get(key, self)
+        return key in self.base if value is self else value is not _DELETED
+
+    def __setitem__(self, key, value):
+        self.changes[key] = value
+
+    def pop(self, key, *default):
+        try:
+            value = self[key]
+        except KeyError:
+            if default:
+                return default[0]
+            raise
+        self.changes[key] = _DELETED
+        return value
+
+    def __iter__(self):
+        changes = self.changes
+        for key in self.base:
+            if changes.get(key) is not _DELETED:
+                yield key
+        for key, value in list(changes.items()):
+            if value is not _DELETED and key not in self.base:
+                yield key
+
+    def __len__(self):
+        return sum(1 for _ in self)
+
+    def __bool__(self):
+        return any(True for _ in self)
+
+    def keys(self):
+        return iter(self)
+
+    def items(self):
+        return ((key, self[key]) for key in self)
+
+    def values(self):
+        return (self[key] for key in self)
+
+
+def _move_sorted(index, key, record):
+    # Re-place key in a (sort_key, ordered, of_key) index; record None removes it
+    sort_key, ordered, of_key = index
+    if key in of_key:
+        del ordered[bisect.bisect_left(ordered, (of_key.pop(key), key))]
+    value = sort_key(record) if record is not None else None
+    if value is not None:
+        of_key[key] = value
+        bisect.insort(ordered, (value, key))
+
+
+def _expired(conversation: Dict, ttl: Optional[float], now: datetime) -> bool:
+    if ttl is None:
+        return False
+    try:
+        updated_at = datetime.fromisoformat(conversation['updated_at'])
+    except (KeyError, TypeError, ValueError):
+        return False
+    return (now - updated_at).total_seconds() > ttl
+
+
+def _preference(name):
+    return lambda user: (user.get('profile') or {}).get(name)
+
+
+def _reach_cell(user: Dict) -> Optional[Tuple[Tuple[int, int], float]]:
+    # (grid cell of home, miles) for a farmer who limits distance, else None
+    within = reach(user.get('profile') or {})
+    if within is None:
+        return None
+    return grid_cell({'latitude': within[0], 'longitude': within[1]}), within[2]
+
+
+def _min_pay(user: Dict) -> float:
+    # Sort key for the farmers' pay floor index
+    return _number((user.get('profile') or {}).get('min_pay_rate')) or 0.0
+
+
+# Index fields computed from the record rather than read from it
+_COMPUTED_FIELDS = {
+    'grid_cell': grid_cell,
+    'profile.work_types': _preference('work_types'),
+    'profile.hours_preference': _preference('hours_preference'),
+    'reach': _reach_cell,
+}
+
+
+def _field_value(record: Dict, field: str):
+    compute = _COMPUTED_FIELDS.get(field)
+    return compute(record) if compute else record.get(field)
+
+
+def _rate(job: Dict) -> float:
+    # Hourly rate for sorting; never fails on odd pay values
+    try:
+        return float(hourly_rate(job))
+    except (TypeError, ValueError):
+        return 0.0
+
+
+def _open_rate(job: Dict) -> Optional[float]:
+    # Sort key for the hourly rate index, which holds only open jobs
+    return _rate(job) if job.get('status') == 'open' else None
+
+
+def _job_expired(job: Dict, now: datetime) -> bool:
+    return _past(job.get('expires_at'), now)
+
+
+def _past(expires_at: Optional[str], now: datetime) -> bool:
+    expiry = job_expiry(expires_at)
+    return expiry is not None and now >= expiry
+
+
+class _JobChangeLog:
+    """Which jobs were created since a version, for caches of match results.
+
+    A version is (epoch, count). Creations are listed so a cache can merge in
+    just the new jobs. Any other change to the jobs, or a write by another
+    process (seen as a stamp this log didn't record), starts a new epoch, and
+    versions from older epochs get None: rebuild from scratch.
+    """
+
+    _epochs = itertools.count()
+
+    def __init__(self, limit: int = 1000):
+        self.limit = limit
+        self.stamp = None
+        self._lock = threading.Lock()
+        self._reset()
+
+    def _reset(self):
+        self.epoch = next(self._epochs)
+        self.created_ids = []
+
+    def created(self, job_id: str, stamp):
+        with self._lock:
+            if len(self.created_ids) >= self.limit:
+                self._reset()
+            self.created_ids.append(job_id)
+            self.stamp = stamp
+
+    def changed(self, stamp):
+        with self._lock:
+            self._reset()
+            self.stamp = stamp
+
+    def written(self, stamp):
+        # A write that can't change any match result, such as archiving
+        self.stamp = stamp
+
+    def since(self, version: Optional[Tuple[int, int]], stamp) -> Tuple[Tuple[int, int], Optional[List[str]]]:
+        with self._lock:
+            if stamp != self.stamp:
+                self._reset()
+                self.stamp = stamp
+            current = (self.epoch, len(self.created_ids))
+            if version is None or version[0] != self.epoch or version[1] > current[1]:
+                return current, None
+            return current, self.created_ids[version[1]:]
+
+
+class ConversationSweeper:
+    """Background thread that calls store.sweep_conversations() every `interval` seconds."""
+
+    def __init__(self, store, interval: float = 300.0):
+        self.store = store
+        self.interval = interval
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        if self._thread is None or not self._thread.is_alive():
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name='conversation-sweeper', daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            try:
+                self.store.sweep_conversations()
+            except Exception as e:
+                print(f"Error sweeping conversation states: {e}")
+
 
 class DataStore:
-    def __init__(self, data_dir='data'):
+    def __init__(self, data_dir='data', cache: bool = False, journal: bool = False,
+                 compact_threshold: int = 1000, fsync: bool = False, fsync_window: float = 0.0,
+                 process_safe: bool = False, id_generator=None, format: str = 'json',
+                 conversation_shards: int = 0, conversation_ttl: Optional[float] = None,
+                 state_ttls: Optional[Dict[str, float]] = None, job_ttl: Optional[float] = None):
         self.data_dir = data_dir
         os.makedirs(data_dir, exist_ok=True)
 
-        self.users_file = os.path.join(data_dir, 'users.json')
-        self.jobs_file = os.path.join(data_dir, 'jobs.json')
-        self.conversations_file = os.path.join(data_dir, 'conversations.json')
-        self.matches_file = os.path.join(data_dir, 'matches.json')
+        # How collections are encoded on disk, one of STORAGE_FORMATS:
+        # 'json' (indented), 'compact' (no whitespace), 'fast' (orjson when
+        # installed, else compact) or 'msgpack' (binary, .msgpack files).
+        # Journal lines are always JSON.
+        self.format = format
+        self._extension, self._dumps, self._loads, self._decode_errors = _codec(format)
+        extension = self._extension
+
+        # Called with 'JOB' or 'MATCH' to name new records
+        self.id_generator = id_generator or UniqueIdGenerator()
+
+        # Every read-modify-write holds a lock on its own collection, so writes
+        # to users.json don't wait for writes to conversations.json. Within a
+        # process that is a thread lock; process_safe adds an fcntl lock on
+        # "<collection>.json.lock" for running several webhook workers.
+        if process_safe and fcntl is None:
+            raise RuntimeError("process_safe needs fcntl, which this platform lacks")
+        self.process_safe = process_safe
+        self._thread_locks = {}
+        self._lock_depths = {}
+        self._lock_fds = {}
+        self._lock_pid = os.getpid()
+
+        # Files are always replaced atomically (temp file + rename). With
+        # fsync enabled every write is also flushed to disk before returning;
+        # a non-zero fsync_window lets writes arriving within that many
+        # seconds of each other share the flush.
+        self.fsync = fsync
+        self._group_commit = _GroupCommit(fsync_window) if fsync and fsync_window > 0 else None
+
+        # With cache enabled each collection is parsed once and kept in memory.
+        # Every access still stats the file, so a write made by another
+        # process (or by hand) is picked up on the next call.
+        self.cache = cache
+        self._cache = {}
+
+        # Secondary indexes over cached collections, rebuilt whenever the
+        # collection is reloaded: filepath -> (data, {field: (by_value, of_key)})
+        self._indexes = {}
+
+        # In journal mode a write appends one line per changed record to
+        # "<collection>.json.log" instead of rewriting the whole collection. Reads
+        # replay the log on top of the snapshot; once the log reaches
+        # compact_threshold entries it is folded back into the snapshot.
+        self.journal = journal
+        self.compact_threshold = compact_threshold
+        self._journal_lengths = {}
+
+        # Per-thread transaction state, see transaction()
+        self._local = threading.local()
+
+        self.users_file = os.path.join(data_dir, 'users' + extension)
+        self.jobs_file = os.path.join(data_dir, 'jobs' + extension)
+        self.conversations_file = os.path.join(data_dir, 'conversations' + extension)
+        self.matches_file = os.path.join(data_dir, 'matches' + extension)
+
+        # With conversation_shards > 0 conversation states are spread over
+        # that many files in conversations/, picked by a hash of the phone
+        # number, so a state change rewrites (and locks) only its own shard.
+        self.conversation_shards = conversation_shards
+        self.conversations_dir = os.path.join(data_dir, 'conversations')
+
+        # Conversation states untouched for longer than their TTL (seconds
+        # since updated_at) read as missing and are deleted by
+        # sweep_conversations(). state_ttls overrides conversation_ttl per
+        # state; None means the state never expires.
+        self.conversation_ttl = conversation_ttl
+        self.state_ttls = state_ttls or {}
+
+        # Jobs past their expires_at (an ISO date or datetime, set from
+        # job_ttl seconds when the poster gave none) drop out of the open
+        # jobs. archive_jobs() moves those and every non-open job, with their
+        # matches, into the *_archive files; reads by ID fall through to them.
+        self.job_ttl = job_ttl
+        self._job_listeners = []
+        self._job_log = _JobChangeLog()
 
         # Initialize files if they don't exist
         self._init_file(self.users_file, {})
@@ -19,21 +535,621 @@ class DataStore:
         self._init_file(self.conversations_file, {})
         self._init_file(self.matches_file, {})
 
+        if journal:
+            # Recover whatever a previous run left in the logs
+            self.compact()
+
+        if conversation_shards or os.path.isdir(self.conversations_dir):
+            os.makedirs(self.conversations_dir, exist_ok=True)
+            self._migrate_conversations()
+
     def _init_file(self, filepath, default_data):
         if not os.path.exists(filepath):
-            with open(filepath, 'w') as f:
-                json.dump(default_data, f, indent=2)
+            with open(filepath, 'wb') as f:
+                f.write(self._dumps(default_data))
+
+    def _collection_files(self) -> List[str]:
+        files = [self.users_file, self.jobs_file, self.conversations_file, self.matches_file]
+        optional = [self.jobs_archive_file, self.matches_archive_file] + self._conversation_shard_files()
+        return files + [path for path in optional
+                        if os.path.exists(path) or os.path.exists(self._journal_file(path))]
+
+    @property
+    def jobs_archive_file(self) -> str:
+        # Follows jobs_file, which callers may point elsewhere
+        base, extension = os.path.splitext(self.jobs_file)
+        return base + '_archive' + extension
+
+    @property
+    def matches_archive_file(self) -> str:
+        base, extension = os.path.splitext(self.matches_file)
+        return base + '_archive' + extension
+
+    def _conversation_file(self, phone_number: str) -> str:
+        if not self.conversation_shards:
+            return self.conversations_file
+        shard = zlib.crc32(phone_number.encode()) % self.conversation_shards
+        return os.path.join(self.conversations_dir, f'{shard:03d}{self._extension}')
+
+    def _conversation_shard_files(self) -> List[str]:
+        if not self.conversation_shards:
+            return []
+        return [os.path.join(self.conversations_dir, f'{shard:03d}{self._extension}')
+                for shard in range(self.conversation_shards)]
+
+    def _migrate_conversations(self):
+        # Move states into the file conversation_shards puts them in: those
+        # left in the single conversations file and, if the shard count
+        # changed since the last run (recorded in conversations/shards),
+        # those in the old shard files. Each file is read once and written
+        # once per side of the move.
+        with self._lock(self.conversations_file):
+            sources = [self.conversations_file]
+            if _recorded_shard_count(self.conversations_dir) != self.conversation_shards:
+                sources += [os.path.join(self.conversations_dir, name)
+                            for name in _shard_file_names(self.data_dir, self._extension)]
+
+            moving, emptied = {}, []
+            for source in sources:
+                moved = False
+                for phone_number, conversation in self._read_json(source).items():
+                    target = self._conversation_file(phone_number)
+                    if target != source:
+                        moving.setdefault(target, {}).setdefault(phone_number, conversation)
+                        moved = True
+                if moved:
+                    emptied.append(source)
+
+            # Targets first: a crash part way leaves states in both places, never in neither
+            for target, conversations in moving.items():
+                with self._lock(target):
+                    data = self._read_json(target)
+                    for phone_number, conversation in conversations.items():
+                        data.setdefault(phone_number, conversation)
+                    self._write_json(target, data)
+
+            shard_files = set(self._conversation_shard_files())
+            for source in emptied:
+                with self._lock(source):
+                    data = self._read_json(source)
+                    kept = {phone_number: conversation for phone_number, conversation in data.items()
+                            if self._conversation_file(phone_number) == source}
+                    if source == self.conversations_file or source in shard_files:
+                        self._write_json(source, kept)
+                    else:
+                        # A shard the current count doesn't use
+                        for path in (source, self._journal_file(source)):
+                            try:
+                                os.remove(path)
+                            except FileNotFoundError:
+                                pass
+                        self.invalidate_cache(source)
+
+            with open(os.path.join(self.conversations_dir, 'shards'), 'w') as f:
+                f.write(str(self.conversation_shards))
+
+    def _journal_file(self, filepath):
+        return filepath + '.log'
+
+    def _file_stamp(self, filepath):
+        try:
+            stat = os.stat(filepath)
+        except FileNotFoundError:
+            return None
+        return (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+
+    def _stamp(self, filepath):
+        stamp = self._file_stamp(filepath)
+        if stamp is not None and self.journal:
+            return (stamp, self._file_stamp(self._journal_file(filepath)))
+        return stamp
 
     def _read_json(self, filepath):
+        pinned = getattr(self._local, 'pinned', None)
+        if pinned is None:
+            return self._load_json(filepath)
+
+        # Inside a transaction every collection is loaded once and then
+        # served from memory until commit. A cached collection is shared with
+        # other threads, so the transaction keeps its own records apart.
+        if filepath not in pinned:
+            data = self._load_json(filepath)
+            pinned[filepath] = _Overlay(data) if self.cache else data
+        return pinned[filepath]
+
+    def _load_json(self, filepath):
+        stamp = self._stamp(filepath) if self.cache or self.journal else None
+        if self.cache:
+            cached = self._cache.get(filepath)
+            if cached is not None and stamp is not None and cached[0] == stamp:
+                return cached[1]
+
+        if not self.journal:
+            data = self._read_file(filepath)
+        else:
+            # The snapshot and its log are read one after the other; a
+            # compaction in between would replace the snapshot and delete
+            # the log, losing the records it moved. Retry while either file
+            # changes under the read, then make writers wait.
+            for _ in range(3):
+                data = self._read_file(filepath)
+                current = self._stamp(filepath)
+                if current == stamp:
+                    break
+                stamp = current
+            else:
+                with self._lock(filepath):
+                    stamp = self._stamp(filepath)
+                    data = self._read_file(filepath)
+
+        if self.cache and stamp is not None:
+            self._cache[filepath] = (stamp, data)
+        return data
+
+    def _read_file(self, filepath):
+        try:
+            with open(filepath, 'rb') as f:
+                data = self._loads(f.read())
+        except (FileNotFoundError,) + self._decode_errors:
+            # A shard's first writes may exist only in its journal
+            data = {}
+
+        if self.journal:
+            self._replay_journal(filepath, data)
+        return data
+
+    def _replay_journal(self, filepath, data):
+        length = 0
         try:
-            with open(filepath, 'r') as f:
-                return json.load(f)
-        except (FileNotFoundError, json.JSONDecodeError):
-            return {}
+            with open(self._journal_file(filepath), 'r') as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except json.JSONDecodeError:
+                        # A line torn by a crash (or still being appended)
+                        continue
+                    if entry.get('deleted'):
+                        data.pop(entry['key'], None)
+                    else:
+                        data[entry['key']] = entry['value']
+                    length += 1
+        except FileNotFoundError:
+            pass
+        self._journal_lengths[filepath] = length
 
     def _write_json(self, filepath, data):
-        with open(filepath, 'w') as f:
-            json.dump(data, f, indent=2)
+        self._replace_file(filepath, data)
+
+        if self.journal:
+            # The snapshot now holds everything the log did
+            try:
+                os.remove(self._journal_file(filepath))
+            except FileNotFoundError:
+                pass
+            self._journal_lengths[filepath] = 0
+
+        if self.cache:
+            self._cache[filepath] = (self._stamp(filepath), data)
+
+    def _replace_file(self, filepath, data):
+        # Serialize first so a bad record can't leave a half-written file
+        payload = self._dumps(data)
+        directory = os.path.dirname(filepath) or '.'
+        fd, tmp_path = tempfile.mkstemp(dir=directory, prefix='.' + os.path.basename(filepath) + '.')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(payload)
+                if self.fsync and self._group_commit is None:
+                    f.flush()
+                    os.fsync(f.fileno())
+            os.replace(tmp_path, filepath)
+        except BaseException:
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
+            raise
+
+        if self._group_commit is not None:
+            # Readers can see the file already; concurrent writers wait for
+            # one fsync of it once they've released their locks
+            def sync():
+                self._fsync_path(filepath)
+                self._fsync_path(directory)
+            self._sync(filepath, sync)
+        elif self.fsync:
+            self._fsync_path(directory)
+
+    def _fsync_path(self, path):
+        fd = os.open(path, os.O_RDONLY)
+        try:
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+
+    def _write_record(self, filepath, data, key):
+        # Persist a change to data[key]; a key missing from data is a delete.
+        self._write_records(filepath, data, [key])
+
+    def _write_records(self, filepath, data, keys):
+        for key in keys:
+            self._update_indexes(filepath, data, key)
+
+        dirty = getattr(self._local, 'dirty', None)
+        if dirty is not None:
+            dirty.setdefault(filepath, {}).update(dict.fromkeys(keys))
+            return
+
+        self._persist(filepath, data, keys)
+
+    def _persist(self, filepath, data, keys):
+        try:
+            self._save_records(filepath, data, keys)
+        except BaseException:
+            if self.cache:
+                # The cached records (and their indexes) already hold the
+                # change that failed to save; reload them from disk next time
+                self.invalidate_cache(filepath)
+            raise
+
+    def _save_records(self, filepath, data, keys):
+        if not self.journal:
+            self._write_json(filepath, data)
+            return
+
+        lines = []
+        for key in keys:
+            if key in data:
+                lines.append(json.dumps({'key': key, 'value': data[key]}) + '\n')
+            else:
+                lines.append(json.dumps({'key': key, 'deleted': True}) + '\n')
+
+        journal_file = self._journal_file(filepath)
+        created = not os.path.exists(journal_file)
+        with open(journal_file, 'ab+') as f:
+            # Start on a fresh line if a crash left the last one unfinished
+            if f.seek(0, os.SEEK_END) > 0:
+                f.seek(-1, os.SEEK_END)
+                if f.read(1) != b'\n':
+                    lines.insert(0, '\n')
+            f.write(''.join(lines).encode())
+
+        if self.fsync:
+            self._sync_journal(journal_file, created)
+
+        length = self._journal_lengths.get(filepath, 0) + len(lines)
+        self._journal_lengths[filepath] = length
+        if length >= self.compact_threshold:
+            # Reload rather than trust data: the log is the source of truth
+            self._write_json(filepath, self._load_json(filepath))
+        elif self.cache:
+            self._cache[filepath] = (self._stamp(filepath), data)
+
+    @contextmanager
+    def transaction(self):
+        """Group several operations so each touched collection is written once.
+
+        Reads inside the block see the block's own writes. Nothing reaches
+        disk until the block exits; if it raises, the buffered writes are
+        dropped. Nested blocks join the outermost one.
+        """
+        if getattr(self._local, 'dirty', None) is not None:
+            yield self
+            return
+
+        self._local.pinned = {}
+        self._local.dirty = {}
+        self._local.indexes = {}
+        self._local.new_jobs = []
+        self._local.job_events = []
+        try:
+            yield self
+        except BaseException:
+            # Only the transaction's own copies hold the discarded writes
+            self._end_transaction()
+            raise
+        else:
+            pinned, dirty, new_jobs, job_events = self._end_transaction()
+            with self._deferred_syncs():
+                for filepath, keys in dirty.items():
+                    with self._lock(filepath):
+                        data = self._merge(filepath, pinned[filepath], keys)
+                        self._persist(filepath, data, list(keys))
+                        if filepath == self.jobs_file:
+                            # Stamp the change log with the jobs file as this commit left it
+                            for event, args in job_events:
+                                self._log_jobs(event, *args)
+            for job in new_jobs:
+                self._job_created(job)
+
+    def _merge(self, filepath, data, keys):
+        # The transaction worked on the collection as it was when first read.
+        # Re-apply its records to the current version so that records written
+        # by others in the meantime survive (last writer wins per record).
+        if self.journal and not self.cache:
+            # Appending records doesn't depend on the rest of the collection
+            return data
+
+        current = self._load_json(filepath)
+        if current is not data:
+            for key in keys:
+                if key in data:
+                    current[key] = data[key]
+                else:
+                    current.pop(key, None)
+                self._update_indexes(filepath, current, key)
+        return current
+
+    def _end_transaction(self):
+        local = self._local
+        state = local.pinned, local.dirty, local.new_jobs, local.job_events
+        local.pinned = local.dirty = local.indexes = local.new_jobs = local.job_events = None
+        return state
+
+    def _sync_journal(self, journal_file, created):
+        def sync():
+            self._fsync_path(journal_file)
+            if created:
+                self._fsync_path(os.path.dirname(journal_file) or '.')
+
+        if self._group_commit is None:
+            sync()
+        else:
+            # Appends are already visible; several of them can wait for one fsync
+            self._sync((journal_file, created), sync)
+
+    def _sync(self, key, action):
+        # Hand a group-commit fsync to the enclosing _deferred_syncs block, or
+        # wait for it now if there isn't one
+        syncs = getattr(self._local, 'syncs', None)
+        if syncs is None:
+            self._group_commit.submit({key: action})
+        else:
+            syncs[key] = action
+
+    @contextmanager
+    def _deferred_syncs(self):
+        # Group-commit fsyncs queued inside the outermost block are waited on
+        # when it exits, after the locks taken inside it are released, so
+        # that other writers can join the batch meanwhile
+        if self._group_commit is None or getattr(self._local, 'syncs', None) is not None:
+            yield
+            return
+
+        self._local.syncs = {}
+        try:
+            yield
+        finally:
+            syncs, self._local.syncs = self._local.syncs, None
+        if syncs:
+            self._group_commit.submit(syncs)
+
+    def compact(self, filepath: Optional[str] = None):
+        filepaths = [filepath] if filepath else self._collection_files()
+        for path in filepaths:
+            with self._lock(path):
+                if os.path.exists(self._journal_file(path)):
+                    self._write_json(path, self._load_json(path))
+
+    @contextmanager
+    def _lock(self, filepath):
+        if getattr(self._local, 'dirty', None) is not None:
+            # Inside a transaction nothing touches disk until commit,
+            # which takes the locks itself
+            yield
+            return
+
+        with self._deferred_syncs(), self._thread_locks.setdefault(filepath, threading.RLock()):
+            depth = self._lock_depths.get(filepath, 0)
+            if self.process_safe and depth == 0:
+                fcntl.flock(self._lock_fd(filepath), fcntl.LOCK_EX)
+            self._lock_depths[filepath] = depth + 1
+            try:
+                yield
+            finally:
+                self._lock_depths[filepath] = depth
+                if self.process_safe and depth == 0:
+                    fcntl.flock(self._lock_fd(filepath), fcntl.LOCK_UN)
+
+    def _lock_fd(self, filepath):
+        if self._lock_pid != os.getpid():
+            # A forked worker must not share the parent's open lock files:
+            # flock locks belong to the open file, so they'd never exclude it
+            for inherited in self._lock_fds.values():
+                os.close(inherited)
+            self._lock_fds = {}
+            self._lock_pid = os.getpid()
+        fd = self._lock_fds.get(filepath)
+        if fd is None:
+            fd = self._lock_fds[filepath] = os.open(filepath + '.lock', os.O_RDWR | os.O_CREAT, 0o644)
+        return fd
+
+    def invalidate_cache(self, filepath: Optional[str] = None):
+        if filepath is None:
+            self._cache.clear()
+            self._indexes.clear()
+        else:
+            self._cache.pop(filepath, None)
+            self._indexes.pop(filepath, None)
+
+    def _index_entry(self, filepath, data):
+        # Without the cache every read returns a fresh dict, so indexes and
+        # columns are built per call; with it (or inside a transaction, for
+        # that thread's copies), they live as long as the data they were built
+        # from. A transaction's overlay reads the shared indexes until it
+        # writes to the collection, then copies of them with its own records
+        # moved. The last slot holds objects derived from the whole
+        # collection, dropped on any write.
+        if isinstance(data, _Overlay):
+            if data.changes:
+                entries = self._local.indexes
+                entry = entries.get(filepath)
+                if entry is None or entry[0] is not data:
+                    entry = entries[filepath] = (data, {}, {}, {}, {})
+                return entry
+            data = data.base
+
+        entries = self._indexes if self.cache else self._index_entries()
+        entry = entries.get(filepath) if entries is not None else None
+        if entry is None or entry[0] is not data:
+            entry = (data, {}, {}, {}, {})
+            if entries is not None:
+                entries[filepath] = entry
+        return entry
+
+    def _index_entries(self) -> Optional[Dict]:
+        # Where index entries are kept: per transaction, in the cache, or nowhere
+        local = getattr(self._local, 'indexes', None)
+        if local is not None:
+            return local
+        return self._indexes if self.cache else None
+
+    def _index(self, filepath, data, field):
+        entry = self._index_entry(filepath, data)
+        index = entry[1].get(field)
+        if index is None:
+            data = entry[0]
+            if isinstance(data, _Overlay):
+                index = entry[1][field] = self._overlay_index(filepath, data, field)
+                return index
+            by_value, of_key = {}, {}
+            for key, record in data.items():
+                value = _field_value(record, field)
+                by_value.setdefault(value, {})[key] = None
+                of_key[key] = value
+            index = entry[1][field] = (by_value, of_key)
+        return index
+
+    def _overlay_index(self, filepath, overlay, field):
+        # The shared index with the overlay's records moved, copying only
+        # the buckets they leave or join
+        by_value, of_key = self._index(filepath, overlay.base, field)
+        by_value, of_key = dict(by_value), dict(of_key)
+        copied = set()
+
+        def bucket(value):
+            if value not in copied:
+                copied.add(value)
+                by_value[value] = dict(by_value.get(value, ()))
+            return by_value[value]
+
+        for key, record in overlay.changes.items():
+            if key in of_key:
+                del bucket(of_key.pop(key))[key]
+            if record is not _DELETED:
+                value = of_key[key] = _field_value(record, field)
+                bucket(value)[key] = None
+        for value in copied:
+            if not by_value[value]:
+                del by_value[value]
+        return by_value, of_key
+
+    def _column(self, filepath, data, field):
+        # One field of every record, key -> value; unlike _index it holds
+        # values that can't be hashed and doesn't group them
+        entry = self._index_entry(filepath, data)
+        column = entry[2].get(field)
+        if column is None:
+            data = entry[0]
+            if isinstance(data, _Overlay):
+                column = dict(self._column(filepath, data.base, field))
+                for key, record in data.changes.items():
+                    if record is _DELETED:
+                        column.pop(key, None)
+                    else:
+                        column[key] = record.get(field)
+                entry[2][field] = column
+                return column
+            column = entry[2][field] = {key: record.get(field) for key, record in data.items()}
+        return column
+
+    def _sorted_index(self, filepath, data, name, sort_key):
+        # ([(sort_key(record), key)] in ascending order, for range queries
+        # with bisect; key -> sort_key(record)). Records whose sort key is
+        # None are left out.
+        entry = self._index_entry(filepath, data)
+        index = entry[3].get(name)
+        if index is None:
+            data = entry[0]
+            if isinstance(data, _Overlay):
+                ordered, of_key = self._sorted_index(filepath, data.base, name, sort_key)
+                index = entry[3][name] = (sort_key, list(ordered), dict(of_key))
+                for key, record in data.changes.items():
+                    _move_sorted(index, key, None if record is _DELETED else record)
+                return index[1:]
+            of_key = {}
+            for key, record in data.items():
+                value = sort_key(record)
+                if value is not None:
+                    of_key[key] = value
+            index = entry[3][name] = (sort_key, sorted((value, key) for key, value in of_key.items()), of_key)
+        return index[1:]
+
+    def _update_indexes(self, filepath, data, key):
+        if isinstance(data, _Overlay):
+            # Its copies of the indexes are made again on the next lookup
+            self._local.indexes.pop(filepath, None)
+            return
+        entries = self._indexes if self.cache else self._index_entries()
+        entry = entries.get(filepath) if entries is not None else None
+        if entry is None or entry[0] is not data:
+            return
+
+        entry[4].clear()
+        for field, (by_value, of_key) in entry[1].items():
+            if key in of_key:
+                old_value = of_key.pop(key)
+                bucket = by_value[old_value]
+                del bucket[key]
+                if not bucket:
+                    del by_value[old_value]
+            if key in data:
+                value = _field_value(data[key], field)
+                by_value.setdefault(value, {})[key] = None
+                of_key[key] = value
+
+        for field, column in entry[2].items():
+            if key in data:
+                column[key] = data[key].get(field)
+            else:
+                column.pop(key, None)
+
+        for index in entry[3].values():
+            _move_sorted(index, key, data.get(key))
+
+    def _keys_with(self, filepath, data, field, value):
+        # Keys of the records whose field has this value. When the index
+        # can't be kept, one pass over the records is cheaper than building
+        # it to throw away.
+        if self._index_entries() is None:
+            return [key for key, record in data.items() if _field_value(record, field) == value]
+        by_value, _ = self._index(filepath, data, field)
+        return by_value.get(value, ())
+
+    def _lookup(self, filepath, field, value, fields: Optional[List[str]] = None) -> List[Dict]:
+        data = self._read_json(filepath)
+        keys = self._keys_with(filepath, data, field, value)
+        if fields is None:
+            return [data[key] for key in keys]
+        return list(self._project(filepath, data, keys, fields))
+
+    def _project(self, filepath, data, keys, fields) -> Iterator[Dict]:
+        # Small dicts holding just `fields` (plus the record's ID field),
+        # read from per-field columns instead of the full records
+        id_field = {self.jobs_file: 'job_id', self.jobs_archive_file: 'job_id', self.matches_file: 'match_id',
+                    self.matches_archive_file: 'match_id'}.get(filepath)
+        if id_field and id_field not in fields:
+            fields = [id_field] + list(fields)
+        if self._index_entries() is None:
+            # Columns built here would be thrown away: read the records
+            for key in list(keys):
+                if key in data:
+                    yield {field: data[key].get(field) for field in fields}
+            return
+        columns = [(field, self._column(filepath, data, field)) for field in fields]
+        for key in list(keys):
+            if key in data:
+                yield {field: column[key] for field, column in columns}
 
     # User Management
     def get_user(self, phone_number: str) -> Optional[Dict]:
@@ -41,108 +1157,380 @@ class DataStore:
         return users.get(phone_number)
 
     def create_user(self, phone_number: str, user_type: str) -> Dict:
-        users = self._read_json(self.users_file)
-        users[phone_number] = {
-            'phone': phone_number,
-            'type': user_type,
-            'created_at': datetime.now().isoformat(),
-            'registered': False,
-            'profile': {}
-        }
-        self._write_json(self.users_file, users)
-        return users[phone_number]
+        with self._lock(self.users_file):
+            users = self._read_json(self.users_file)
+            users[phone_number] = {
+                'phone': phone_number,
+                'type': user_type,
+                'created_at': datetime.now().isoformat(),
+                'registered': False,
+                'profile': {}
+            }
+            self._write_record(self.users_file, users, phone_number)
+            return users[phone_number]
 
     def update_user(self, phone_number: str, updates: Dict):
-        users = self._read_json(self.users_file)
-        if phone_number in users:
-            users[phone_number].update(updates)
-            self._write_json(self.users_file, users)
+        with self._lock(self.users_file):
+            users = self._read_json(self.users_file)
+            if phone_number in users:
+                users[phone_number] = {**users[phone_number], **updates}
+                self._write_record(self.users_file, users, phone_number)
 
     def update_user_profile(self, phone_number: str, profile_data: Dict):
-        users = self._read_json(self.users_file)
-        if phone_number in users:
-            users[phone_number]['profile'].update(profile_data)
-            self._write_json(self.users_file, users)
-            return True
-        return False
+        with self._lock(self.users_file):
+            users = self._read_json(self.users_file)
+            if phone_number in users:
+                user = users[phone_number]
+                profile = {**user['profile'], **profile_data}
+                if 'location' in profile_data and 'latitude' not in profile_data:
+                    add_coordinates(profile)
+                users[phone_number] = {**user, 'profile': profile}
+                self._write_record(self.users_file, users, phone_number)
+                return True
+            return False
 
     # Job Management
     def create_job(self, job_data: Dict) -> str:
-        jobs = self._read_json(self.jobs_file)
-        job_id = f"JOB_{len(jobs) + 1}_{datetime.now().strftime('%Y%m%d%H%M%S')}"
-        jobs[job_id] = {
-            'job_id': job_id,
-            'created_at': datetime.now().isoformat(),
-            'status': 'open',
-            **job_data
-        }
-        self._write_json(self.jobs_file, jobs)
+        with self._lock(self.jobs_file):
+            jobs = self._read_json(self.jobs_file)
+            job_id = self.id_generator('JOB')
+            now = datetime.now()
+            jobs[job_id] = {
+                'job_id': job_id,
+                'created_at': now.isoformat(),
+                'status': 'open',
+                **job_data
+            }
+            if self.job_ttl is not None:
+                jobs[job_id].setdefault('expires_at', (now + timedelta(seconds=self.job_ttl)).isoformat())
+            jobs[job_id]['effective_hourly_rate'] = effective_hourly_rate(jobs[job_id])
+            if 'latitude' not in job_data:
+                add_coordinates(jobs[job_id])
+            self._write_record(self.jobs_file, jobs, job_id)
+            self._log_jobs('created', job_id)
+        self._job_created(jobs[job_id])
         return job_id
 
+    def _log_jobs(self, event: str, *args):
+        # Record a change to the jobs in the change log; inside a transaction
+        # it waits for the commit, which is when the jobs file gets its stamp
+        job_events = getattr(self._local, 'job_events', None)
+        if job_events is not None:
+            job_events.append((event, args))
+        else:
+            getattr(self._job_log, event)(*args, self._stamp(self.jobs_file))
+
+    def add_job_listener(self, listener):
+        # listener(job) is called with each new job once create_job has saved it
+        self._job_listeners.append(listener)
+
+    def _job_created(self, job: Dict):
+        new_jobs = getattr(self._local, 'new_jobs', None)
+        if new_jobs is not None:
+            # Inside a transaction the job isn't saved until commit
+            new_jobs.append(job)
+            return
+        for listener in self._job_listeners:
+            try:
+                listener(job)
+            except Exception as e:
+                print(f"Error in job listener: {e}")
+
     def get_job(self, job_id: str) -> Optional[Dict]:
         jobs = self._read_json(self.jobs_file)
-        return jobs.get(job_id)
+        if job_id in jobs:
+            return jobs[job_id]
+        return self._read_json(self.jobs_archive_file).get(job_id)
+
+    def get_jobs_by_owner(self, owner_phone: str, fields: Optional[List[str]] = None,
+                          include_archived: bool = False) -> List[Dict]:
+        jobs = self._lookup(self.jobs_file, 'owner_phone', owner_phone, fields)
+        if include_archived:
+            jobs += self._lookup(self.jobs_archive_file, 'owner_phone', owner_phone, fields)
+        return jobs
+
+    def get_open_jobs(self, fields: Optional[List[str]] = None, work_type=None, min_rate: Optional[float] = None,
+                      hours=None, within: Optional[Tuple[float, float, float]] = None) -> List[Dict]:
+        return list(self.iter_open_jobs(fields, work_type, min_rate, hours, within))
 
-    def get_open_jobs(self) -> List[Dict]:
+    def iter_open_jobs(self, fields: Optional[List[str]] = None, work_type=None, min_rate: Optional[float] = None,
+                       hours=None, within: Optional[Tuple[float, float, float]] = None) -> Iterator[Dict]:
+        # With fields, yields only those (plus job_id) for listing screens.
+        # work_type and hours are predicates on those fields' values (see
+        # matching.WorkTypeFilter and HoursFilter), run once per distinct
+        # value in the index; min_rate cuts the jobs sorted by hourly rate.
+        # within=(latitude, longitude, miles) looks up nearby grid cells;
+        # jobs without coordinates are kept.
+        now = datetime.now()
         jobs = self._read_json(self.jobs_file)
-        return [job for job in jobs.values() if job.get('status') == 'open']
+        by_value, _ = self._index(self.jobs_file, jobs, 'status')
+        job_ids = by_value.get('open', {})
+        for field, predicate in (('work_type', work_type), ('hours', hours)):
+            if predicate is not None:
+                by_field, _ = self._index(self.jobs_file, jobs, field)
+                wanted = set()
+                for value, bucket in by_field.items():
+                    if predicate(value):
+                        wanted.update(bucket)
+                job_ids = [job_id for job_id in job_ids if job_id in wanted]
+        if min_rate is not None:
+            by_rate, rates = self._sorted_index(self.jobs_file, jobs, 'open_rate', _open_rate)
+            start = bisect.bisect_left(by_rate, (min_rate,))
+            if len(by_rate) - start < len(job_ids):
+                # Few open jobs pay enough: walk just those
+                paid = {job_id for _, job_id in itertools.islice(by_rate, start, None)}
+                job_ids = [job_id for job_id in job_ids if job_id in paid]
+            else:
+                job_ids = [job_id for job_id in job_ids if rates[job_id] >= min_rate]
+        if within is not None:
+            latitude, longitude, miles = within
+            by_cell, _ = self._index(self.jobs_file, jobs, 'grid_cell')
+            nearby = set(by_cell.get(None, ()))
+            for cell in cells_within((latitude, longitude), miles):
+                for job_id in by_cell.get(cell, ()):
+                    if distance_miles((latitude, longitude), coordinates(jobs[job_id])) <= miles:
+                        nearby.add(job_id)
+            job_ids = [job_id for job_id in job_ids if job_id in nearby]
+
+        expires_at = self._column(self.jobs_file, jobs, 'expires_at')
+        job_ids = [job_id for job_id in job_ids if job_id in jobs and not _past(expires_at[job_id], now)]
+        if fields is None:
+            return (jobs[job_id] for job_id in job_ids)
+        return self._project(self.jobs_file, jobs, job_ids, fields)
+
+    def find_matching_farmers(self, job: Dict) -> List[str]:
+        # Reverse matching: phone numbers of registered farmers whose
+        # preferences (see matching.JobFilter) accept this job. Work types and
+        # hours are checked once per distinct preference in the users' indexes,
+        # the pay floor by bisecting them sorted by min_pay_rate, and distance
+        # only for farmers whose home cell is within their range of the job.
+        users = self._read_json(self.users_file)
+        if self._index_entries() is None:
+            # Nothing would keep the indexes: check each farmer instead
+            return [phone for phone, user in users.items()
+                    if user.get('type') == 'farmer' and user.get('registered')
+                    and JobFilter(user.get('profile') or {})(job)]
+
+        by_type, _ = self._index(self.users_file, users, 'type')
+        registered = self._column(self.users_file, users, 'registered')
+        phones = [phone for phone in by_type.get('farmer', ()) if registered[phone]]
+
+        work_type, hours = job.get('work_type', ''), job.get('hours')
+        for field, accepts in (('profile.work_types', lambda value: WorkTypeFilter(value)(work_type)),
+                               ('profile.hours_preference', lambda value: HoursFilter(value)(hours))):
+            by_value, _ = self._index(self.users_file, users, field)
+            wanted = set()
+            for value, bucket in by_value.items():
+                if accepts(value):
+                    wanted.update(bucket)
+            phones = [phone for phone in phones if phone in wanted]
+
+        by_pay, _ = self._sorted_index(self.users_file, users, 'min_pay', _min_pay)
+        rate = _rate(job)
+        paid = {phone for _, phone in by_pay[:bisect.bisect_right(by_pay, (rate, chr(0x10ffff)))]}
+        phones = [phone for phone in phones if phone in paid]
+
+        point = coordinates(job)
+        if point is not None:
+            by_reach, _ = self._index(self.users_file, users, 'reach')
+            nearby = set(by_reach.get(None, ()))
+            cells = {}
+            for value, bucket in by_reach.items():
+                if value is None:
+                    continue
+                cell, miles = value
+                if miles not in cells:
+                    cells[miles] = set(cells_within(point, miles))
+                if cell in cells[miles]:
+                    nearby.update(phone for phone in bucket
+                                  if distance_miles(reach(users[phone]['profile'])[:2], point) <= miles)
+            phones = [phone for phone in phones if phone in nearby]
+        return phones
+
+    def job_changes(self, since: Optional[Tuple[int, int]] = None) -> Tuple[Tuple[int, int], Optional[List[str]]]:
+        # (version, IDs of jobs created since `since`); the IDs are None when
+        # since is None or the jobs changed in any other way
+        with self._lock(self.jobs_file):
+            return self._job_log.since(since, self._stamp(self.jobs_file))
+
+    def job_matrix(self):
+        # The open jobs as a JobMatrix, kept with the cached jobs and rebuilt
+        # after any change to them. None without numpy, or when the matrix
+        # couldn't be kept (no cache, or a transaction that changed the
+        # jobs): building one per call is slower than the index path.
+        if JobMatrix is None or not self.cache:
+            return None
+        dirty = getattr(self._local, 'dirty', None)
+        if dirty is not None and self.jobs_file in dirty:
+            return None
+
+        # The shared copy, also inside a transaction: its jobs are unchanged
+        with self._thread_locks.setdefault(self.jobs_file, threading.RLock()):
+            jobs = self._load_json(self.jobs_file)
+            entry = self._indexes.get(self.jobs_file)
+            if entry is None or entry[0] is not jobs:
+                entry = self._indexes[self.jobs_file] = (jobs, {}, {}, {}, {})
+            matrix = entry[4].get('job_matrix')
+            if matrix is None:
+                now = datetime.now()
+                matrix = entry[4]['job_matrix'] = JobMatrix(
+                    [job for job in jobs.values() if job.get('status') == 'open' and not _job_expired(job, now)])
+            return matrix
 
     def update_job(self, job_id: str, updates: Dict):
-        jobs = self._read_json(self.jobs_file)
-        if job_id in jobs:
-            jobs[job_id].update(updates)
-            self._write_json(self.jobs_file, jobs)
+        with self._lock(self.jobs_file):
+            jobs = self._read_json(self.jobs_file)
+            if job_id in jobs:
+                job = {**jobs[job_id], **updates}
+                job['effective_hourly_rate'] = effective_hourly_rate(job)
+                if 'location' in updates and 'latitude' not in updates:
+                    add_coordinates(job)
+                jobs[job_id] = job
+                self._write_record(self.jobs_file, jobs, job_id)
+                self._log_jobs('changed')
 
     def update_job_status(self, job_id: str, status: str):
-        jobs = self._read_json(self.jobs_file)
-        if job_id in jobs:
-            jobs[job_id]['status'] = status
-            self._write_json(self.jobs_file, jobs)
+        with self._lock(self.jobs_file):
+            jobs = self._read_json(self.jobs_file)
+            if job_id in jobs:
+                jobs[job_id] = {**jobs[job_id], 'status': status}
+                self._write_record(self.jobs_file, jobs, job_id)
+                self._log_jobs('changed')
+
+    def archive_jobs(self, now: Optional[datetime] = None) -> int:
+        # Move closed and expired jobs, with their matches, to the archive
+        # files; returns how many jobs moved
+        now = now or datetime.now()
+        with self._lock(self.jobs_file), self._lock(self.matches_file):
+            jobs = self._read_json(self.jobs_file)
+            job_ids = [job_id for job_id, job in jobs.items()
+                       if job.get('status') != 'open' or _job_expired(job, now)]
+            if not job_ids:
+                return 0
+
+            matches = self._read_json(self.matches_file)
+            by_job, _ = self._index(self.matches_file, matches, 'job_id')
+            with self._lock(self.jobs_archive_file), self._lock(self.matches_archive_file):
+                jobs_archive = self._read_json(self.jobs_archive_file)
+                matches_archive = self._read_json(self.matches_archive_file)
+                match_ids = []
+                for job_id in job_ids:
+                    job = jobs.pop(job_id)
+                    if job.get('status') == 'open':
+                        job = {**job, 'status': 'expired'}
+                    jobs_archive[job_id] = job
+                    for match_id in list(by_job.get(job_id, ())):
+                        matches_archive[match_id] = matches.pop(match_id)
+                        match_ids.append(match_id)
+
+                # Archive first: a crash part way leaves records in both places, never in neither
+                self._write_records(self.jobs_archive_file, jobs_archive, job_ids)
+                if match_ids:
+                    self._write_records(self.matches_archive_file, matches_archive, match_ids)
+                    self._write_records(self.matches_file, matches, match_ids)
+                self._write_records(self.jobs_file, jobs, job_ids)
+                # Only closed and expired jobs moved, and neither is ever matched
+                self._log_jobs('written')
+            return len(job_ids)
 
     # Conversation State Management
     def get_conversation_state(self, phone_number: str) -> Optional[Dict]:
-        conversations = self._read_json(self.conversations_file)
-        return conversations.get(phone_number)
+        conversations = self._read_json(self._conversation_file(phone_number))
+        conversation = conversations.get(phone_number)
+        if conversation and _expired(conversation, self._state_ttl(conversation.get('state')), datetime.now()):
+            return None
+        return conversation
 
     def set_conversation_state(self, phone_number: str, state: str, data: Dict = None):
-        conversations = self._read_json(self.conversations_file)
-        conversations[phone_number] = {
-            'state': state,
-            'data': data or {},
-            'updated_at': datetime.now().isoformat()
-        }
-        self._write_json(self.conversations_file, conversations)
+        conversations_file = self._conversation_file(phone_number)
+        with self._lock(conversations_file):
+            conversations = self._read_json(conversations_file)
+            conversations[phone_number] = {
+                'state': state,
+                'data': data or {},
+                'updated_at': datetime.now().isoformat()
+            }
+            self._write_record(conversations_file, conversations, phone_number)
 
     def clear_conversation_state(self, phone_number: str):
-        conversations = self._read_json(self.conversations_file)
-        if phone_number in conversations:
-            del conversations[phone_number]
-            self._write_json(self.conversations_file, conversations)
+        conversations_file = self._conversation_file(phone_number)
+        with self._lock(conversations_file):
+            conversations = self._read_json(conversations_file)
+            if phone_number in conversations:
+                del conversations[phone_number]
+                self._write_record(conversations_file, conversations, phone_number)
+
+    def sweep_conversations(self, now: Optional[datetime] = None) -> int:
+        # Delete every expired conversation state; returns how many went
+        now = now or datetime.now()
+        removed = 0
+        for conversations_file in [self.conversations_file] + self._conversation_shard_files():
+            with self._lock(conversations_file):
+                conversations = self._read_json(conversations_file)
+                expired = [phone for phone, conversation in conversations.items()
+                           if _expired(conversation, self._state_ttl(conversation.get('state')), now)]
+                if expired:
+                    for phone in expired:
+                        del conversations[phone]
+                    self._write_records(conversations_file, conversations, expired)
+                    removed += len(expired)
+        return removed
+
+    def _state_ttl(self, state: Optional[str]) -> Optional[float]:
+        return self.state_ttls.get(state, self.conversation_ttl)
 
     # Job Matching
     def create_match(self, job_id: str, farmer_phone: str, status: str = 'pending'):
-        matches = self._read_json(self.matches_file)
-        match_id = f"MATCH_{len(matches) + 1}_{datetime.now().strftime('%Y%m%d%H%M%S')}"
-        matches[match_id] = {
-            'match_id': match_id,
-            'job_id': job_id,
-            'farmer_phone': farmer_phone,
-            'status': status,
-            'created_at': datetime.now().isoformat()
-        }
-        self._write_json(self.matches_file, matches)
-        return match_id
-
-    def get_farmer_matches(self, farmer_phone: str) -> List[Dict]:
-        matches = self._read_json(self.matches_file)
-        return [match for match in matches.values() if match['farmer_phone'] == farmer_phone]
+        with self._lock(self.matches_file):
+            matches = self._read_json(self.matches_file)
+            match_id = self.id_generator('MATCH')
+            matches[match_id] = {
+                'match_id': match_id,
+                'job_id': job_id,
+                'farmer_phone': farmer_phone,
+                'status': status,
+                'created_at': datetime.now().isoformat()
+            }
+            self._write_record(self.matches_file, matches, match_id)
+            return match_id
+
+    def get_farmer_matches(self, farmer_phone: str, include_archived: bool = False) -> List[Dict]:
+        matches = self._lookup(self.matches_file, 'farmer_phone', farmer_phone)
+        if include_archived:
+            matches += self._lookup(self.matches_archive_file, 'farmer_phone', farmer_phone)
+        return matches
 
     def get_job_matches(self, job_id: str) -> List[Dict]:
+        matches = self._lookup(self.matches_file, 'job_id', job_id)
+        if not matches and job_id not in self._read_json(self.jobs_file):
+            return self._lookup(self.matches_archive_file, 'job_id', job_id)
+        return matches
+
+    def count_job_matches(self, job_id: str) -> int:
         matches = self._read_json(self.matches_file)
-        return [match for match in matches.values() if match['job_id'] == job_id]
+        count = len(self._keys_with(self.matches_file, matches, 'job_id', job_id))
+        if not count and job_id not in self._read_json(self.jobs_file):
+            return len(self._lookup(self.matches_archive_file, 'job_id', job_id))
+        return count
 
     def update_match(self, match_id: str, updates: Dict):
-        matches = self._read_json(self.matches_file)
-        if match_id in matches:
-            matches[match_id].update(updates)
-            self._write_json(self.matches_file, matches)
+        with self._lock(self.matches_file):
+            matches = self._read_json(self.matches_file)
+            if match_id in matches:
+                matches[match_id] = {**matches[match_id], **updates}
+                self._write_record(self.matches_file, matches, match_id)
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Convert FarmConnect data files between storage formats")
+    parser.add_argument('from_format', choices=STORAGE_FORMATS)
+    parser.add_argument('to_format', choices=STORAGE_FORMATS)
+    parser.add_argument('--data-dir', default='data')
+    parser.add_argument('--conversation-shards', type=int, default=None,
+                        help="number of conversation shard files (default: those found in the data dir)")
+    args = parser.parse_args()
+
+    convert_data_dir(args.data_dir, args.from_format, args.to_format, args.conversation_shards)
+    print(f"Converted {args.data_dir} from {args.from_format} to {args.to_format}")
@@ -0,0 +1,138 @@
+"""
+Offline geocoding of free-text locations ("Chapel Hill, NC", "27514")
+using the bundled gazetteer.csv, plus the grid cells used to index
+records by position
+"""
+import csv
+import math
+import os
+import re
+from functools import lru_cache
+from typing import Dict, Iterator, Optional, Tuple
+
+GAZETTEER_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'gazetteer.csv')
+
+STATE_NAMES = {
+    'alabama': 'al', 'alaska': 'ak', 'arizona': 'az', 'arkansas': 'ar', 'california': 'ca', 'colorado': 'co',
+    'connecticut': 'ct', 'delaware': 'de', 'florida': 'fl', 'georgia': 'ga', 'hawaii': 'hi', 'idaho': 'id',
+    'illinois': 'il', 'indiana': 'in', 'iowa': 'ia', 'kansas': 'ks', 'kentucky': 'ky', 'louisiana': 'la',
+    'maine': 'me', 'maryland': 'md', 'massachusetts': 'ma', 'michigan': 'mi', 'minnesota': 'mn',
+    'mississippi': 'ms', 'missouri': 'mo', 'montana': 'mt', 'nebraska': 'ne', 'nevada': 'nv', 'new hampshire': 'nh',
+    'new jersey': 'nj', 'new mexico': 'nm', 'new york': 'ny', 'north carolina': 'nc', 'north dakota': 'nd',
+    'ohio': 'oh', 'oklahoma': 'ok', 'oregon': 'or', 'pennsylvania': 'pa', 'rhode island': 'ri',
+    'south carolina': 'sc', 'south dakota': 'sd', 'tennessee': 'tn', 'texas': 'tx', 'utah': 'ut', 'vermont': 'vt',
+    'virginia': 'va', 'washington': 'wa', 'west virginia': 'wv', 'wisconsin': 'wi', 'wyoming': 'wy',
+}
+
+# Grid cells are GRID_DEGREES on a side, about 17 miles north to south
+GRID_DEGREES = 0.25
+MILES_PER_DEGREE = 69.0
+
+
+class Gazetteer:
+    """City and ZIP code coordinates loaded from a CSV file.
+
+    Columns are city, state, zip, latitude, longitude; zip may be empty.
+    A city may have a row for each of its ZIP codes; the first one gives
+    the coordinates for the city's name.
+    """
+
+    def __init__(self, path: str = GAZETTEER_FILE):
+        self.by_zip = {}
+        self.by_city_state = {}
+        by_city = {}
+        with open(path, newline='') as f:
+            for row in csv.DictReader(f):
+                point = (float(row['latitude']), float(row['longitude']))
+                city, state = normalize(row['city']), row['state'].strip().lower()
+                self.by_city_state.setdefault((city, state), point)
+                by_city.setdefault(city, {}).setdefault(state, point)
+                if row.get('zip'):
+                    self.by_zip[row['zip'].strip()] = point
+        # A city name alone is enough only when no two states share it
+        self.by_city = {city: next(iter(states.values())) for city, states in by_city.items() if len(states) == 1}
+
+    def geocode(self, location: Optional[str]) -> Optional[Tuple[float, float]]:
+        if not location or not isinstance(location, str):
+            return None
+
+        zip_code = re.search(r'\b(\d{5})(?:-\d{4})?\b', location)
+        if zip_code and zip_code.group(1) in self.by_zip:
+            return self.by_zip[zip_code.group(1)]
+
+        parts = [normalize(part) for part in location.split(',')]
+        parts = [part for part in parts if part]
+        state = None
+        if parts:
+            state, parts = _split_state(parts)
+        # "Green Valley Farm, Sacramento, CA": try the parts nearest the state first
+        for part in reversed(parts):
+            if state and (part, state) in self.by_city_state:
+                return self.by_city_state[(part, state)]
+            if not state and part in self.by_city:
+                return self.by_city[part]
+        return None
+
+
+def normalize(text: str) -> str:
+    text = re.sub(r'[^\w\s,-]', ' ', text.lower())
+    text = re.sub(r'\b\d{5}(-\d{4})?\b', ' ', text)
+    return ' '.join(text.replace('-', ' ').split())
+
+
+def _split_state(parts):
+    # Pull the state off the end: "raleigh, nc", "raleigh nc", "raleigh, north carolina"
+    last = parts[-1]
+    if last in STATE_NAMES:
+        return STATE_NAMES[last], parts[:-1]
+    if len(last) == 2 and last in STATE_NAMES.values():
+        return last, parts[:-1]
+    words = last.rsplit(' ', 1)
+    if len(words) == 2 and len(words[1]) == 2 and words[1] in STATE_NAMES.values():
+        return words[1], parts[:-1] + [words[0]]
+    for name, code in STATE_NAMES.items():
+        if last.endswith(' ' + name):
+            return code, parts[:-1] + [last[:-len(name) - 1]]
+    return None, parts
+
+
+_default = None
+
+
+@lru_cache(maxsize=4096)
+def geocode(location: Optional[str]) -> Optional[Tuple[float, float]]:
+    # Coordinates of a free-text location from the bundled gazetteer, or None
+    global _default
+    if _default is None:
+        _default = Gazetteer()
+    return _default.geocode(location)
+
+
+def add_coordinates(record: Dict):
+    # Store latitude/longitude for record['location'] on the record itself,
+    # dropping stale ones when the new location isn't known
+    point = geocode(record.get('location'))
+    if point:
+        record['latitude'], record['longitude'] = point
+    else:
+        record.pop('latitude', None)
+        record.pop('longitude', None)
+
+
+def grid_cell(record: Dict) -> Optional[Tuple[int, int]]:
+    latitude, longitude = record.get('latitude'), record.get('longitude')
+    if latitude is None or longitude is None:
+        return None
+    return math.floor(latitude / GRID_DEGREES), math.floor(longitude / GRID_DEGREES)
+
+
+def cells_within(origin: Tuple[float, float], miles: float) -> Iterator[Tuple[int, int]]:
+    # Every grid cell that may hold a point within `miles` of origin
+    latitude, longitude = origin
+    lat_span = miles / MILES_PER_DEGREE
+    lon_span = miles / (MILES_PER_DEGREE * max(math.cos(math.radians(latitude)), 0.01))
+    for row in range(math.floor((latitude - lat_span) / GRID_DEGREES),
+                     math.floor((latitude + lat_span) / GRID_DEGREES) + 1):
+        for column in range(math.floor((longitude - lon_span) / GRID_DEGREES),
+                            math.floor((longitude + lon_span) / GRID_DEGREES) + 1):
+            yield row, column
@@ -0,0 +1,99 @@
+"""
+Columnar view of the open jobs for scoring them all at once with NumPy
+"""
+from datetime import datetime
+from typing import Dict, List, Optional
+
+import numpy as np
+
+from matching import EARTH_RADIUS_MILES, JobFilter, coordinates, hourly_rate, job_expiry
+
+
+class JobMatrix:
+    """The open jobs as parallel arrays, one row per job.
+
+    Work types and hours are stored as ids into small vocabularies, so a
+    farmer's preferences are checked once per distinct value and then
+    broadcast to every row. Build a new matrix when the jobs change; the data
+    stores cache one until the next write to the jobs.
+    """
+
+    def __init__(self, jobs: List[Dict]):
+        self.jobs = jobs
+        count = len(jobs)
+
+        self.work_types, self.work_type_ids = _vocabulary(job.get('work_type', '') for job in jobs)
+        self.hours, self.hours_ids = _vocabulary(job.get('hours') for job in jobs)
+
+        self.rates = np.zeros(count)
+        self.latitudes = np.full(count, np.nan)
+        self.longitudes = np.full(count, np.nan)
+        self.expiry = np.full(count, np.inf)
+        for row, job in enumerate(jobs):
+            try:
+                self.rates[row] = float(hourly_rate(job))
+            except (TypeError, ValueError):
+                pass
+            point = coordinates(job)
+            if point is not None:
+                self.latitudes[row], self.longitudes[row] = point
+            expiry = job_expiry(job.get('expires_at'))
+            if expiry is not None:
+                self.expiry[row] = expiry.timestamp()
+
+    def __len__(self):
+        return len(self.jobs)
+
+    def scores(self, job_filter: JobFilter, now: Optional[datetime] = None) -> Dict[str, np.ndarray]:
+        # Per-job checks for one farmer: type/schedule/pay/distance as booleans,
+        # plus the distance in miles (NaN where a job has no coordinates)
+        now = now or datetime.now()
+        type_ok = np.fromiter((job_filter.work_type(value) for value in self.work_types), bool,
+                              len(self.work_types))[self.work_type_ids]
+        schedule_ok = np.fromiter((job_filter.hours(value) for value in self.hours), bool,
+                                  len(self.hours))[self.hours_ids]
+        pay_ok = self.rates >= job_filter.min_rate if job_filter.min_rate is not None else np.ones(len(self), bool)
+
+        distance = np.full(len(self), np.nan)
+        if job_filter.origin is not None:
+            distance = _haversine(job_filter.origin, self.latitudes, self.longitudes)
+        if job_filter.max_distance is None:
+            distance_ok = np.ones(len(self), bool)
+        else:
+            distance_ok = np.isnan(distance) | (distance <= job_filter.max_distance)
+
+        return {
+            'type': type_ok,
+            'schedule': schedule_ok,
+            'pay': pay_ok,
+            'distance': distance_ok,
+            'open': self.expiry > now.timestamp(),
+            'rate': self.rates,
+            'miles': distance,
+        }
+
+    def top(self, job_filter: JobFilter, k: int = 5, now: Optional[datetime] = None) -> List[Dict]:
+        # The k best paid jobs passing every check; equal pay keeps job order,
+        # as heapq.nlargest does in the bots
+        scores = self.scores(job_filter, now)
+        rows = np.flatnonzero(scores['type'] & scores['schedule'] & scores['pay'] & scores['distance'] & scores['open'])
+        if len(rows) > k:
+            # Only rows paying at least the k-th best rate can make the cut
+            cutoff = np.partition(self.rates[rows], len(rows) - k)[len(rows) - k]
+            rows = rows[self.rates[rows] >= cutoff]
+        order = np.lexsort((rows, -self.rates[rows]))[:k]
+        return [self.jobs[row] for row in rows[order]]
+
+
+def _vocabulary(values):
+    # Distinct values and, per row, the index of its value
+    index = {}
+    ids = [index.setdefault(value, len(index)) for value in values]
+    return list(index), np.array(ids, dtype=np.int32)
+
+
+def _haversine(origin, latitudes: np.ndarray, longitudes: np.ndarray) -> np.ndarray:
+    lat1, lon1 = np.radians(origin[0]), np.radians(origin[1])
+    lat2, lon2 = np.radians(latitudes), np.radians(longitudes)
+    a = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS_MILES * np.arcsin(np.sqrt(a))
@@ -0,0 +1,247 @@
+"""
+Rule-based job matching shared by the bots and the data stores
+"""
+import heapq
+import math
+import threading
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from typing import Callable, Dict, List, Optional, Tuple
+
+from gazetteer import geocode
+
+HOURS_PER_DAY = 8
+
+# The job schedules a worker's hours_preference accepts; 'flexible' (or no
+# preference) accepts any. Jobs whose hours aren't one of SCHEDULES, such as
+# a free-text shift, are never ruled out on hours.
+SCHEDULES = {'full-time', 'part-time', 'flexible', 'seasonal'}
+HOURS_ACCEPTED = {
+    'full-time': {'full-time', 'flexible', 'seasonal'},
+    'part-time': {'part-time', 'flexible'},
+}
+
+# The registration menu's "Any distance" option
+ANY_DISTANCE = 999
+
+EARTH_RADIUS_MILES = 3958.8
+
+# The profile fields matching reads; changing any other field keeps a
+# farmer's cached recommendations
+PREFERENCE_FIELDS = ('work_types', 'min_pay_rate', 'hours_preference', 'max_distance', 'location',
+                     'latitude', 'longitude')
+
+
+def effective_hourly_rate(job: Dict) -> float:
+    # What a job pays per hour, whichever way the owner gave the pay
+    payment_type = job.get('payment_type')
+    if payment_type == 'per day':
+        return (job.get('payment_amount') or 0) / HOURS_PER_DAY
+    elif payment_type == 'per hour':
+        return job.get('payment_amount') or 0
+    else:
+        return job.get('pay_rate') or 0
+
+
+def hourly_rate(job: Dict) -> float:
+    # The rate stored with the job by the data store, or computed for jobs saved before it was
+    rate = job.get('effective_hourly_rate')
+    return rate if rate is not None else effective_hourly_rate(job)
+
+
+def job_expiry(expires_at: Optional[str]) -> Optional[datetime]:
+    # When a job's expires_at (ISO date or datetime) runs out, or None
+    if not expires_at:
+        return None
+    try:
+        expiry = datetime.fromisoformat(expires_at)
+    except (TypeError, ValueError):
+        return None
+    if len(expires_at) == 10:
+        # A bare date: the job runs through the end of that day
+        expiry += timedelta(days=1)
+    return expiry
+
+
+def parse_work_types(work_types: Optional[str]) -> Optional[List[str]]:
+    # A farmer's comma-separated work types, lowercased; None means any work
+    pref_types = (work_types or '').lower()
+    if not pref_types or 'all types of work' in pref_types:
+        return None
+    return [pref_type.strip() for pref_type in pref_types.split(',')]
+
+
+class WorkTypeFilter:
+    """Tells whether a job's work_type matches a farmer's work types.
+
+    A preference matches when either string contains the other, so
+    "Harvesting" matches "Tomato Harvesting". Each distinct work_type is
+    checked once, which lets the stores run it over their work-type index
+    instead of over every job.
+    """
+
+    def __init__(self, work_types: Optional[str]):
+        self.pref_types = parse_work_types(work_types)
+        self._seen = {}
+
+    def __call__(self, work_type: Optional[str]) -> bool:
+        if self.pref_types is None:
+            return True
+        matched = self._seen.get(work_type)
+        if matched is None:
+            job_type = (work_type or '').lower()
+            matched = self._seen[work_type] = any(
+                pref_type in job_type or job_type in pref_type for pref_type in self.pref_types
+            )
+        return matched
+
+
+class HoursFilter:
+    """Tells whether a job's hours suit a worker's hours_preference."""
+
+    def __init__(self, hours_preference: Optional[str]):
+        preference = hours_preference.lower() if isinstance(hours_preference, str) else None
+        self.accepted = HOURS_ACCEPTED.get(preference)
+
+    def __call__(self, hours: Optional[str]) -> bool:
+        if self.accepted is None:
+            return True
+        schedule = hours.strip().lower() if isinstance(hours, str) else None
+        return schedule in self.accepted or schedule not in SCHEDULES
+
+
+def coordinates(record: Dict) -> Optional[Tuple[float, float]]:
+    latitude, longitude = record.get('latitude'), record.get('longitude')
+    if latitude is None or longitude is None:
+        return None
+    return float(latitude), float(longitude)
+
+
+def distance_miles(origin: Tuple[float, float], destination: Tuple[float, float]) -> float:
+    # Great-circle (haversine) distance
+    lat1, lon1 = map(math.radians, origin)
+    lat2, lon2 = map(math.radians, destination)
+    a = math.sin((lat2 - lat1) / 2) ** 2 + math.cos(lat1) * math.cos(lat2) * math.sin((lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS_MILES * math.asin(math.sqrt(a))
+
+
+def _number(value) -> Optional[float]:
+    try:
+        return float(value) if value is not None else None
+    except (TypeError, ValueError):
+        return None
+
+
+def origin(prefs: Dict) -> Optional[Tuple[float, float]]:
+    # Where a farmer travels from: their stored coordinates, else their location geocoded
+    return coordinates(prefs) or geocode(prefs.get('location'))
+
+
+def reach(prefs: Dict, start: Optional[Tuple[float, float]] = None) -> Optional[Tuple[float, float, float]]:
+    # (latitude, longitude, miles) a farmer will travel, or None when distance doesn't limit them
+    start = start or origin(prefs)
+    max_distance = _number(prefs.get('max_distance'))
+    if start is None or max_distance is None or max_distance >= ANY_DISTANCE:
+        return None
+    return start[0], start[1], max_distance
+
+
+class JobFilter:
+    """Every rule-based check for one farmer, built once from their profile.
+
+    Work type, minimum pay, hours and distance (as `within`) are also
+    exposed on their own so the stores can answer them from their indexes.
+    Distance is checked only when both the farmer and the job have
+    coordinates; a profile saved without them is geocoded from its location.
+    """
+
+    def __init__(self, prefs: Dict):
+        self.work_type = WorkTypeFilter(prefs.get('work_types', ''))
+        self.min_rate = _number(prefs.get('min_pay_rate')) or None
+        self.hours = HoursFilter(prefs.get('hours_preference'))
+
+        self.origin = origin(prefs)
+        self.within = reach(prefs, self.origin)
+        self.max_distance = self.within[2] if self.within else None
+
+    def __call__(self, job: Dict) -> bool:
+        return (self.work_type(job.get('work_type', ''))
+                and (self.min_rate is None or hourly_rate(job) >= self.min_rate)
+                and self.hours(job.get('hours'))
+                and self.near(job))
+
+    def near(self, job: Dict) -> bool:
+        if self.max_distance is None:
+            return True
+        destination = coordinates(job)
+        return destination is None or distance_miles(self.origin, destination) <= self.max_distance
+
+
+def preference_key(prefs: Dict) -> Tuple:
+    return tuple(prefs.get(field) for field in PREFERENCE_FIELDS)
+
+
+def _open(job: Dict, now: datetime) -> bool:
+    expiry = job_expiry(job.get('expires_at'))
+    return job.get('status') == 'open' and (expiry is None or now < expiry)
+
+
+class RecommendationCache:
+    """Each farmer's top matches, reused until their preferences or the jobs change.
+
+    An entry remembers the farmer's preference_key() and the store's jobs
+    version (store.job_changes()). If only new jobs were posted since, just
+    those are matched and merged into the cached top k; a changed preference,
+    a closed or edited job, or an expired cached match means matching every
+    open job again.
+    """
+
+    def __init__(self, k: int = 5, max_entries: int = 10000):
+        self.k = k
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def top(self, store, phone: str, prefs: Dict, match: Callable[[Dict], List[Dict]]) -> List[Dict]:
+        # match(prefs) is the full search, run on a miss
+        key = preference_key(prefs)
+        with self._lock:
+            entry = self._entries.get(phone)
+
+        if entry is not None and entry[0] == key:
+            version, created = store.job_changes(entry[1])
+            now = datetime.now()
+            if created is not None and all(_open(job, now) for job in entry[2]):
+                matches = entry[2]
+                if created:
+                    matches = self._merge(store, prefs, matches, created, now)
+                self._put(phone, (key, version, matches))
+                return matches
+
+        # Take the version first: a job posted during the search is merged
+        # again next time, and _merge skips it as already seen
+        version, _ = store.job_changes()
+        matches = match(prefs)
+        self._put(phone, (key, version, matches))
+        return matches
+
+    def _merge(self, store, prefs: Dict, matches: List[Dict], created: List[str], now: datetime) -> List[Dict]:
+        job_filter = JobFilter(prefs)
+        seen = {job['job_id'] for job in matches}
+        new_jobs = [job for job in map(store.get_job, created)
+                    if job and job['job_id'] not in seen and _open(job, now) and job_filter(job)]
+        return heapq.nlargest(self.k, matches + new_jobs, key=hourly_rate)
+
+    def _put(self, phone: str, entry: Tuple):
+        with self._lock:
+            self._entries[phone] = entry
+            self._entries.move_to_end(phone)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, phone: Optional[str] = None):
+        with self._lock:
+            if phone is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(phone, None)
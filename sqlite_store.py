@@ -0,0 +1,541 @@
+import json
+import math
+import os
+import sqlite3
+import threading
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from data_store import JobMatrix, UniqueIdGenerator, _JobChangeLog, _expired, _job_expired, _past, _rate
+from gazetteer import MILES_PER_DEGREE, add_coordinates
+from matching import HoursFilter, JobFilter, WorkTypeFilter, coordinates, distance_miles, effective_hourly_rate, hourly_rate
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS users (
+    phone TEXT PRIMARY KEY,
+    type TEXT,
+    registered INTEGER NOT NULL DEFAULT 0,
+    data TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_users_type ON users (type, registered);
+
+CREATE TABLE IF NOT EXISTS jobs (
+    job_id TEXT PRIMARY KEY,
+    status TEXT,
+    owner_phone TEXT,
+    data TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_jobs_status ON jobs (status);
+CREATE INDEX IF NOT EXISTS idx_jobs_owner_phone ON jobs (owner_phone);
+CREATE INDEX IF NOT EXISTS idx_jobs_work_type ON jobs (status, json_extract(data, '$.work_type'));
+CREATE INDEX IF NOT EXISTS idx_jobs_hourly_rate ON jobs (status, json_extract(data, '$.effective_hourly_rate'));
+CREATE INDEX IF NOT EXISTS idx_jobs_latitude ON jobs (status, json_extract(data, '$.latitude'));
+
+CREATE TABLE IF NOT EXISTS conversations (
+    phone TEXT PRIMARY KEY,
+    state TEXT,
+    data TEXT NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS matches (
+    match_id TEXT PRIMARY KEY,
+    job_id TEXT,
+    farmer_phone TEXT,
+    status TEXT,
+    data TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_matches_job_id ON matches (job_id);
+CREATE INDEX IF NOT EXISTS idx_matches_farmer_phone ON matches (farmer_phone);
+
+CREATE TABLE IF NOT EXISTS jobs_archive (
+    job_id TEXT PRIMARY KEY,
+    status TEXT,
+    owner_phone TEXT,
+    data TEXT NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS matches_archive (
+    match_id TEXT PRIMARY KEY,
+    job_id TEXT,
+    farmer_phone TEXT,
+    status TEXT,
+    data TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_matches_archive_job_id ON matches_archive (job_id);
+CREATE INDEX IF NOT EXISTS idx_matches_archive_farmer_phone ON matches_archive (farmer_phone);
+
+-- Counts changes to the jobs table from any connection, for caches of job data
+CREATE TABLE IF NOT EXISTS versions (
+    name TEXT PRIMARY KEY,
+    version INTEGER NOT NULL
+);
+INSERT OR IGNORE INTO versions (name, version) VALUES ('jobs', 0);
+CREATE TRIGGER IF NOT EXISTS jobs_inserted AFTER INSERT ON jobs
+BEGIN UPDATE versions SET version = version + 1 WHERE name = 'jobs'; END;
+CREATE TRIGGER IF NOT EXISTS jobs_updated AFTER UPDATE ON jobs
+BEGIN UPDATE versions SET version = version + 1 WHERE name = 'jobs'; END;
+CREATE TRIGGER IF NOT EXISTS jobs_deleted AFTER DELETE ON jobs
+BEGIN UPDATE versions SET version = version + 1 WHERE name = 'jobs'; END;
+"""
+
+
+def _with_id(fields: List[str], id_field: str) -> List[str]:
+    return list(fields) if id_field in fields else [id_field] + list(fields)
+
+
+class SQLiteDataStore:
+    """Drop-in replacement for DataStore backed by a single SQLite database.
+
+    Each record is a JSON document in its own row; the fields we look up by
+    are copied into indexed columns, so an update touches one row only.
+    """
+
+    def __init__(self, db_path='data/farmconnect.db', id_generator=None,
+                 conversation_ttl: Optional[float] = None, state_ttls: Optional[Dict[str, float]] = None,
+                 job_ttl: Optional[float] = None):
+        directory = os.path.dirname(db_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        self.db_path = db_path
+        self.id_generator = id_generator or UniqueIdGenerator()
+        self.conversation_ttl = conversation_ttl
+        self.state_ttls = state_ttls or {}
+        self.job_ttl = job_ttl
+        self._lock = threading.RLock()
+        # Bumped when a transaction rolls back; the versions table counts committed job changes
+        self._jobs_version = 0
+        self._job_listeners = []
+        self._job_log = _JobChangeLog()
+        self._job_matrix = (None, None)
+        # Per-thread connection and transaction state, see transaction()
+        self._local = threading.local()
+        self._connections = {}
+        self._conn.executescript(SCHEMA)
+
+    @property
+    def _conn(self) -> sqlite3.Connection:
+        # Each thread has its own connection, so a transaction in one thread
+        # doesn't stop the others reading
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, check_same_thread=False, isolation_level=None, timeout=30)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            with self._lock:
+                for thread in [thread for thread in self._connections if not thread.is_alive()]:
+                    self._connections.pop(thread).close()
+                self._connections[threading.current_thread()] = conn
+            self._local.conn = conn
+        return conn
+
+    def close(self):
+        with self._lock:
+            for conn in self._connections.values():
+                conn.close()
+            self._connections.clear()
+
+    @contextmanager
+    def transaction(self):
+        """Group several operations into one SQLite transaction.
+
+        Reads inside the block see the block's own writes; if it raises,
+        they are rolled back. SQLite's write lock is taken at the block's
+        first write (see _writing()) rather than on entry, so other threads
+        can keep writing while it reads or waits on the network. Nested
+        blocks join the outermost one.
+        """
+        local = self._local
+        if getattr(local, 'new_jobs', None) is not None:
+            yield self
+            return
+
+        local.new_jobs = []
+        local.job_events = []
+        try:
+            yield self
+        except BaseException:
+            local.new_jobs = local.job_events = None
+            if self._conn.in_transaction:
+                self._conn.execute('ROLLBACK')
+                # A job matrix built inside the block may hold rolled-back jobs
+                self._jobs_version += 1
+            raise
+        else:
+            new_jobs, job_events = local.new_jobs, local.job_events
+            local.new_jobs = local.job_events = None
+            if self._conn.in_transaction:
+                # Still holding the write lock, so this is the stamp the commit leaves
+                stamp = self._jobs_stamp() if job_events else None
+                with self._lock:
+                    self._conn.execute('COMMIT')
+                    for event, args in job_events:
+                        getattr(self._job_log, event)(*args, stamp)
+        for job in new_jobs:
+            self._job_created(job)
+
+    @contextmanager
+    def _writing(self):
+        # Writes, and the reads they depend on, run holding SQLite's write
+        # lock: in the caller's transaction, begun here at its first write,
+        # or in one of their own
+        with self.transaction():
+            conn = self._conn
+            if not conn.in_transaction:
+                conn.execute('BEGIN IMMEDIATE')
+            yield conn
+
+    def _fetch_one(self, sql, params=()) -> Optional[Dict]:
+        row = self._conn.execute(sql, params).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def _fetch_all(self, sql, params=()) -> List[Dict]:
+        rows = self._conn.execute(sql, params).fetchall()
+        return [json.loads(row[0]) for row in rows]
+
+    def _fetch_fields(self, table, where, params, fields: List[str]) -> List[Dict]:
+        # Pull just these fields out of each row's JSON document in SQLite,
+        # rather than decoding whole records
+        columns = ', '.join('json_extract(data, ?)' for _ in fields)
+        paths = tuple('$."{}"'.format(field.replace('"', '""')) for field in fields)
+        rows = self._conn.execute(f'SELECT {columns} FROM {table} WHERE {where} ORDER BY rowid',
+                                  paths + tuple(params)).fetchall()
+        return [dict(zip(fields, row)) for row in rows]
+
+    def _jobs_stamp(self) -> int:
+        # Moves with every change to the jobs table, whichever connection made it
+        return self._conn.execute("SELECT version FROM versions WHERE name = 'jobs'").fetchone()[0]
+
+    def _execute(self, sql, params=()):
+        with self._writing() as conn:
+            return conn.execute(sql, params)
+
+    def _save_user(self, user: Dict):
+        self._execute(
+            'INSERT INTO users (phone, type, registered, data) VALUES (?, ?, ?, ?) '
+            'ON CONFLICT (phone) DO UPDATE SET type = excluded.type, '
+            'registered = excluded.registered, data = excluded.data',
+            (user['phone'], user.get('type'), int(bool(user.get('registered'))), json.dumps(user))
+        )
+
+    def _save_job(self, job: Dict):
+        self._execute(
+            'INSERT INTO jobs (job_id, status, owner_phone, data) VALUES (?, ?, ?, ?) '
+            'ON CONFLICT (job_id) DO UPDATE SET status = excluded.status, '
+            'owner_phone = excluded.owner_phone, data = excluded.data',
+            (job['job_id'], job.get('status'), job.get('owner_phone'), json.dumps(job))
+        )
+
+    def _save_match(self, match: Dict):
+        self._execute(
+            'INSERT INTO matches (match_id, job_id, farmer_phone, status, data) VALUES (?, ?, ?, ?, ?) '
+            'ON CONFLICT (match_id) DO UPDATE SET job_id = excluded.job_id, '
+            'farmer_phone = excluded.farmer_phone, status = excluded.status, data = excluded.data',
+            (match['match_id'], match['job_id'], match['farmer_phone'], match.get('status'), json.dumps(match))
+        )
+
+    # User Management
+    def get_user(self, phone_number: str) -> Optional[Dict]:
+        return self._fetch_one('SELECT data FROM users WHERE phone = ?', (phone_number,))
+
+    def create_user(self, phone_number: str, user_type: str) -> Dict:
+        user = {
+            'phone': phone_number,
+            'type': user_type,
+            'created_at': datetime.now().isoformat(),
+            'registered': False,
+            'profile': {}
+        }
+        self._save_user(user)
+        return user
+
+    def update_user(self, phone_number: str, updates: Dict):
+        with self._writing():
+            user = self.get_user(phone_number)
+            if user:
+                user.update(updates)
+                self._save_user(user)
+
+    def update_user_profile(self, phone_number: str, profile_data: Dict):
+        with self._writing():
+            user = self.get_user(phone_number)
+            if user:
+                user['profile'].update(profile_data)
+                if 'location' in profile_data and 'latitude' not in profile_data:
+                    add_coordinates(user['profile'])
+                self._save_user(user)
+                return True
+            return False
+
+    # Job Management
+    def create_job(self, job_data: Dict) -> str:
+        job_id = self.id_generator('JOB')
+        now = datetime.now()
+        job = {
+            'job_id': job_id,
+            'created_at': now.isoformat(),
+            'status': 'open',
+            **job_data
+        }
+        if self.job_ttl is not None:
+            job.setdefault('expires_at', (now + timedelta(seconds=self.job_ttl)).isoformat())
+        job['effective_hourly_rate'] = effective_hourly_rate(job)
+        if 'latitude' not in job_data:
+            add_coordinates(job)
+        with self._writing():
+            self._save_job(job)
+            self._log_jobs('created', job_id)
+        self._job_created(job)
+        return job_id
+
+    def _log_jobs(self, event: str, *args):
+        # Record a change to the jobs in the change log; inside a transaction
+        # it waits for the commit
+        job_events = getattr(self._local, 'job_events', None)
+        if job_events is not None:
+            job_events.append((event, args))
+        else:
+            getattr(self._job_log, event)(*args, self._jobs_stamp())
+
+    def add_job_listener(self, listener):
+        # listener(job) is called with each new job once create_job has saved it
+        self._job_listeners.append(listener)
+
+    def _job_created(self, job: Dict):
+        new_jobs = getattr(self._local, 'new_jobs', None)
+        if new_jobs is not None:
+            # Inside a transaction the job isn't saved until commit
+            new_jobs.append(job)
+            return
+        for listener in self._job_listeners:
+            try:
+                listener(job)
+            except Exception as e:
+                print(f"Error in job listener: {e}")
+
+    def get_job(self, job_id: str) -> Optional[Dict]:
+        job = self._fetch_one('SELECT data FROM jobs WHERE job_id = ?', (job_id,))
+        if job is None:
+            job = self._fetch_one('SELECT data FROM jobs_archive WHERE job_id = ?', (job_id,))
+        return job
+
+    def get_jobs_by_owner(self, owner_phone: str, fields: Optional[List[str]] = None,
+                          include_archived: bool = False) -> List[Dict]:
+        tables = ['jobs', 'jobs_archive'] if include_archived else ['jobs']
+        jobs = []
+        for table in tables:
+            if fields is not None:
+                jobs += self._fetch_fields(table, 'owner_phone = ?', (owner_phone,), _with_id(fields, 'job_id'))
+            else:
+                jobs += self._fetch_all(f'SELECT data FROM {table} WHERE owner_phone = ? ORDER BY rowid', (owner_phone,))
+        return jobs
+
+    def get_open_jobs(self, fields: Optional[List[str]] = None, work_type=None, min_rate: Optional[float] = None,
+                      hours=None, within: Optional[Tuple[float, float, float]] = None) -> List[Dict]:
+        return list(self.iter_open_jobs(fields, work_type, min_rate, hours, within))
+
+    def iter_open_jobs(self, fields: Optional[List[str]] = None, work_type=None, min_rate: Optional[float] = None,
+                       hours=None, within: Optional[Tuple[float, float, float]] = None) -> Iterator[Dict]:
+        now = datetime.now()
+        where, params = "status = 'open'", ()
+        for field, predicate in (('work_type', work_type), ('hours', hours)):
+            if predicate is not None:
+                clause, values = self._matching_values(field, predicate)
+                where += ' AND ' + clause
+                params += values
+        if min_rate is not None:
+            # Jobs saved before the rate was stored are checked below
+            where += (" AND (json_extract(data, '$.effective_hourly_rate') >= ?"
+                      " OR json_extract(data, '$.effective_hourly_rate') IS NULL)")
+            params += (min_rate,)
+        if within is not None:
+            # A bounding box on the latitude index; distance is checked below
+            latitude, longitude, miles = within
+            lat_span = miles / MILES_PER_DEGREE
+            lon_span = miles / (MILES_PER_DEGREE * max(math.cos(math.radians(latitude)), 0.01))
+            where += (" AND ((json_extract(data, '$.latitude') BETWEEN ? AND ?"
+                      " AND json_extract(data, '$.longitude') BETWEEN ? AND ?)"
+                      " OR json_extract(data, '$.latitude') IS NULL)")
+            params += (latitude - lat_span, latitude + lat_span, longitude - lon_span, longitude + lon_span)
+
+        if fields is None:
+            jobs = self._fetch_all(f'SELECT data FROM jobs WHERE {where} ORDER BY rowid', params)
+        else:
+            extra = ['expires_at'] + (['effective_hourly_rate', 'payment_type', 'payment_amount', 'pay_rate']
+                                      if min_rate is not None else [])
+            extra += ['latitude', 'longitude'] if within is not None else []
+            jobs = self._fetch_fields('jobs', where, params, _with_id(fields, 'job_id') + extra)
+        for job in jobs:
+            if _past(job.get('expires_at'), now) or (min_rate is not None and hourly_rate(job) < min_rate):
+                continue
+            if within is not None and coordinates(job) is not None \
+                    and distance_miles(within[:2], coordinates(job)) > within[2]:
+                continue
+            if fields is not None:
+                job = {field: job[field] for field in _with_id(fields, 'job_id')}
+            yield job
+
+    def _matching_values(self, field, predicate, table='jobs', scope="status = 'open'"):
+        # An SQL condition selecting rows in scope (by default, open jobs) whose
+        # field value passes predicate, checking each distinct value once
+        path = f"json_extract(data, '$.{field}')"
+        values = [row[0] for row in self._conn.execute(f"SELECT DISTINCT {path} FROM {table} WHERE {scope}")]
+        matched = tuple(value for value in values if predicate(value))
+        placeholders = ', '.join('?' * len(matched))
+        clause = f"({path} IN ({placeholders})" + (f" OR {path} IS NULL)" if None in matched else ")")
+        return clause, matched
+
+    def find_matching_farmers(self, job: Dict) -> List[str]:
+        # Reverse matching: registered farmers narrowed by work type and hours
+        # in SQL (each distinct preference checked once), then by pay floor
+        # and distance
+        scope = "type = 'farmer' AND registered = 1"
+        work_type, hours = job.get('work_type', ''), job.get('hours')
+        where, params = scope, ()
+        for field, predicate in (('profile.work_types', lambda value: WorkTypeFilter(value)(work_type)),
+                                 ('profile.hours_preference', lambda value: HoursFilter(value)(hours))):
+            clause, values = self._matching_values(field, predicate, 'users', scope)
+            where += ' AND ' + clause
+            params += values
+        rows = self._conn.execute(f'SELECT phone, data FROM users WHERE {where} ORDER BY rowid', params).fetchall()
+
+        rate = _rate(job)
+        phones = []
+        for phone, data in rows:
+            farmer_filter = JobFilter(json.loads(data).get('profile') or {})
+            if (farmer_filter.min_rate is None or rate >= farmer_filter.min_rate) and farmer_filter.near(job):
+                phones.append(phone)
+        return phones
+
+    def job_changes(self, since: Optional[Tuple[int, int]] = None) -> Tuple[Tuple[int, int], Optional[List[str]]]:
+        # (version, IDs of jobs created since `since`); the IDs are None when
+        # since is None or the jobs changed in any other way
+        with self._lock:
+            return self._job_log.since(since, self._jobs_stamp())
+
+    def job_matrix(self):
+        # The open jobs as a JobMatrix (None without numpy), rebuilt after
+        # any change to the jobs
+        if JobMatrix is None:
+            return None
+        version = (self._jobs_version, self._jobs_stamp())
+        built_at, matrix = self._job_matrix
+        if built_at != version:
+            matrix = JobMatrix(list(self.iter_open_jobs()))
+            self._job_matrix = (version, matrix)
+        return matrix
+
+    def update_job(self, job_id: str, updates: Dict):
+        with self._writing():
+            job = self._fetch_one('SELECT data FROM jobs WHERE job_id = ?', (job_id,))
+            if job:
+                job.update(updates)
+                job['effective_hourly_rate'] = effective_hourly_rate(job)
+                if 'location' in updates and 'latitude' not in updates:
+                    add_coordinates(job)
+                self._save_job(job)
+                self._log_jobs('changed')
+
+    def update_job_status(self, job_id: str, status: str):
+        self.update_job(job_id, {'status': status})
+
+    def archive_jobs(self, now: Optional[datetime] = None) -> int:
+        now = now or datetime.now()
+        with self._writing() as conn:
+            job_ids = []
+            for job_id, data in conn.execute('SELECT job_id, data FROM jobs').fetchall():
+                job = json.loads(data)
+                if job.get('status') == 'open' and _job_expired(job, now):
+                    job['status'] = 'expired'
+                    self._save_job(job)
+                if job.get('status') != 'open':
+                    job_ids.append((job_id,))
+
+            conn.executemany(
+                'INSERT OR REPLACE INTO jobs_archive SELECT job_id, status, owner_phone, data FROM jobs WHERE job_id = ?',
+                job_ids)
+            conn.executemany(
+                'INSERT OR REPLACE INTO matches_archive '
+                'SELECT match_id, job_id, farmer_phone, status, data FROM matches WHERE job_id = ?', job_ids)
+            conn.executemany('DELETE FROM matches WHERE job_id = ?', job_ids)
+            conn.executemany('DELETE FROM jobs WHERE job_id = ?', job_ids)
+            # Only closed and expired jobs moved, and neither is ever matched
+            self._log_jobs('written')
+        return len(job_ids)
+
+    # Conversation State Management
+    def get_conversation_state(self, phone_number: str) -> Optional[Dict]:
+        conversation = self._fetch_one('SELECT data FROM conversations WHERE phone = ?', (phone_number,))
+        if conversation and _expired(conversation, self._state_ttl(conversation.get('state')), datetime.now()):
+            return None
+        return conversation
+
+    def set_conversation_state(self, phone_number: str, state: str, data: Dict = None):
+        conversation = {
+            'state': state,
+            'data': data or {},
+            'updated_at': datetime.now().isoformat()
+        }
+        self._execute(
+            'INSERT INTO conversations (phone, state, data) VALUES (?, ?, ?) '
+            'ON CONFLICT (phone) DO UPDATE SET state = excluded.state, data = excluded.data',
+            (phone_number, state, json.dumps(conversation))
+        )
+
+    def clear_conversation_state(self, phone_number: str):
+        self._execute('DELETE FROM conversations WHERE phone = ?', (phone_number,))
+
+    def sweep_conversations(self, now: Optional[datetime] = None) -> int:
+        now = now or datetime.now()
+        with self._writing() as conn:
+            rows = conn.execute('SELECT phone, data FROM conversations').fetchall()
+            expired = []
+            for phone, data in rows:
+                conversation = json.loads(data)
+                if _expired(conversation, self._state_ttl(conversation.get('state')), now):
+                    expired.append((phone,))
+            conn.executemany('DELETE FROM conversations WHERE phone = ?', expired)
+        return len(expired)
+
+    def _state_ttl(self, state: Optional[str]) -> Optional[float]:
+        return self.state_ttls.get(state, self.conversation_ttl)
+
+    # Job Matching
+    def create_match(self, job_id: str, farmer_phone: str, status: str = 'pending'):
+        match_id = self.id_generator('MATCH')
+        self._save_match({
+            'match_id': match_id,
+            'job_id': job_id,
+            'farmer_phone': farmer_phone,
+            'status': status,
+            'created_at': datetime.now().isoformat()
+        })
+        return match_id
+
+    def get_farmer_matches(self, farmer_phone: str, include_archived: bool = False) -> List[Dict]:
+        matches = self._fetch_all('SELECT data FROM matches WHERE farmer_phone = ? ORDER BY rowid', (farmer_phone,))
+        if include_archived:
+            matches += self._fetch_all('SELECT data FROM matches_archive WHERE farmer_phone = ? ORDER BY rowid',
+                                       (farmer_phone,))
+        return matches
+
+    def get_job_matches(self, job_id: str) -> List[Dict]:
+        matches = self._fetch_all('SELECT data FROM matches WHERE job_id = ? ORDER BY rowid', (job_id,))
+        if not matches and self._fetch_one('SELECT data FROM jobs WHERE job_id = ?', (job_id,)) is None:
+            return self._fetch_all('SELECT data FROM matches_archive WHERE job_id = ? ORDER BY rowid', (job_id,))
+        return matches
+
+    def count_job_matches(self, job_id: str) -> int:
+        conn = self._conn
+        count = conn.execute('SELECT COUNT(*) FROM matches WHERE job_id = ?', (job_id,)).fetchone()[0]
+        if not count and conn.execute('SELECT 1 FROM jobs WHERE job_id = ?', (job_id,)).fetchone() is None:
+            count = conn.execute('SELECT COUNT(*) FROM matches_archive WHERE job_id = ?', (job_id,)).fetchone()[0]
+        return count
+
+    def update_match(self, match_id: str, updates: Dict):
+        with self._writing():
+            match = self._fetch_one('SELECT data FROM matches WHERE match_id = ?', (match_id,))
+            if match:
+                match.update(updates)
+                self._save_match(match)
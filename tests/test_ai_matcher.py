@@ -0,0 +1,212 @@
+"""
+Unit tests for AIJobMatcher's response cache
+Gemini is replaced by a mock model; no network calls are made
+"""
+import json
+import os
+import time
+from unittest.mock import Mock
+
+import pytest
+from ai_matcher import AIJobMatcher, ResponseCache, cache_key, truncate
+
+
+def make_jobs():
+    return [
+        {'job_id': 'JOB_1', 'work_type': 'Tomato Harvesting', 'pay_rate': 18.0, 'location': 'Durham, NC'},
+        {'job_id': 'JOB_2', 'work_type': 'Pruning', 'pay_rate': 15.0, 'location': 'Raleigh, NC'},
+    ]
+
+
+PREFS = {'name': 'John', 'work_types': 'Harvesting, Pruning', 'min_pay_rate': 15, 'hours_preference': 'full-time'}
+
+
+@pytest.fixture
+def matcher(monkeypatch):
+    """An AIJobMatcher whose model always ranks candidate 1 above candidate 0"""
+    monkeypatch.setenv('GEMINI_API_KEY', 'test_key')
+    matcher = AIJobMatcher(cache=ResponseCache())
+    matcher.model = Mock()
+    matcher.model.generate_content.return_value = Mock(text=json.dumps([
+        {'job_index': 1, 'score': 90, 'reason': 'Good pay'},
+        {'job_index': 0, 'score': 60, 'reason': 'Close by'},
+    ]))
+    return matcher
+
+
+class TestCacheKey:
+    """Test what makes two requests the same"""
+
+    def test_normalized_preferences(self):
+        """Test that formatting and non-preference fields don't change the key"""
+        other = {'name': 'Maria', 'work_types': 'pruning,  harvesting', 'min_pay_rate': '$15', 'hours_preference': 'Full-Time'}
+
+        assert cache_key(make_jobs(), PREFS) == cache_key(make_jobs(), other)
+        assert cache_key(make_jobs(), PREFS) != cache_key(make_jobs(), dict(PREFS, min_pay_rate=16))
+
+    def test_job_order_and_versions(self):
+        """Test that job order doesn't matter but a changed job does"""
+        jobs = make_jobs()
+        changed = make_jobs()
+        changed[1]['description'] = 'Bring gloves'
+
+        assert cache_key(jobs, PREFS) == cache_key(list(reversed(jobs)), PREFS)
+        assert cache_key(jobs, PREFS) != cache_key(changed, PREFS)
+        assert cache_key(jobs, PREFS) != cache_key(jobs[:1], PREFS)
+
+    def test_jobs_without_ids(self):
+        """Test that jobs without IDs aren't cached"""
+        assert cache_key([{'work_type': 'Pruning'}], PREFS) is None
+
+
+class TestCachedMatching:
+    """Test that repeat requests are answered without calling Gemini"""
+
+    def test_hit_skips_model(self, matcher):
+        """Test that a second farmer with the same preferences gets the cached result"""
+        first = matcher.match_jobs(make_jobs(), PREFS)
+        second = matcher.match_jobs(make_jobs(), dict(PREFS, name='Maria'))
+
+        assert matcher.model.generate_content.call_count == 1
+        assert second == first
+        assert [job['job_id'] for job in second] == ['JOB_2', 'JOB_1']
+
+    def test_hit_remapped_to_current_jobs(self, matcher):
+        """Test that a hit returns the jobs passed in, whatever their order"""
+        matcher.match_jobs(make_jobs(), PREFS)
+        jobs = list(reversed(make_jobs()))
+        jobs[0]['status'] = 'open'
+
+        matched = matcher.match_jobs(jobs, PREFS)
+
+        assert matcher.model.generate_content.call_count == 1
+        assert matched[0]['job_id'] == 'JOB_2'
+        assert matched[0]['status'] == 'open'
+        assert matched[0]['_ai_score'] == 90
+        assert matched[0] is not jobs[0]
+
+    def test_failed_response_not_cached(self, matcher):
+        """Test that unparseable responses are retried next time"""
+        matcher.model.generate_content.return_value = Mock(text='not json')
+        assert matcher.match_jobs(make_jobs(), PREFS) is None
+        assert matcher.match_jobs(make_jobs(), PREFS) is None
+
+        assert matcher.model.generate_content.call_count == 2
+
+
+class TestResponseCache:
+    """Test eviction and persistence"""
+
+    def test_lru_eviction(self):
+        """Test that the least recently used entry goes first"""
+        cache = ResponseCache(max_entries=2)
+        cache.put('a', [])
+        cache.put('b', [])
+        cache.get('a')
+        cache.put('c', [])
+
+        assert cache.get('b') is None
+        assert cache.get('a') == []
+
+    def test_ttl(self):
+        """Test that entries expire"""
+        cache = ResponseCache(ttl=0.1)
+        cache.put('a', [])
+        time.sleep(0.2)
+
+        assert cache.get('a') is None
+
+    def test_persisted(self, tmp_path):
+        """Test that entries survive a restart"""
+        path = os.path.join(str(tmp_path), 'ai_cache.json')
+        ResponseCache(path=path).put('a', [['JOB_1', 90, 'Good pay']])
+
+        assert ResponseCache(path=path).get('a') == [['JOB_1', 90, 'Good pay']]
+        time.sleep(0.01)
+        assert ResponseCache(path=path, ttl=0).get('a') is None
+
+    def test_corrupt_file_ignored(self, tmp_path):
+        """Test starting empty when the cache file can't be read"""
+        path = os.path.join(str(tmp_path), 'ai_cache.json')
+        with open(path, 'w') as f:
+            f.write('{not json')
+
+        assert ResponseCache(path=path).get('a') is None
+
+
+class TestCandidates:
+    """Test the local pre-filter and prompt budget in front of Gemini"""
+
+    def test_only_candidates_sent(self, matcher):
+        """Test that jobs failing the farmer's preferences stay out of the prompt"""
+        jobs = make_jobs() + [
+            {'job_id': 'JOB_3', 'work_type': 'Irrigation', 'pay_rate': 30.0},
+            {'job_id': 'JOB_4', 'work_type': 'Pruning', 'pay_rate': 10.0},
+        ]
+
+        matcher.match_jobs(jobs, PREFS)
+
+        prompt = matcher.model.generate_content.call_args[0][0]
+        assert 'JOB_1' in prompt and 'JOB_2' in prompt
+        assert 'JOB_3' not in prompt and 'JOB_4' not in prompt
+
+    def test_piece_rate_jobs_sent(self, matcher):
+        """Test that jobs without an hourly rate aren't dropped by the pay floor"""
+        jobs = [
+            {'job_id': 'JOB_TASK', 'work_type': 'Pruning', 'payment_type': 'per task', 'payment_amount': 2},
+            {'job_id': 'JOB_LOW', 'work_type': 'Pruning', 'payment_type': 'per hour', 'payment_amount': 10},
+            {'job_id': 'JOB_OFF', 'work_type': 'Irrigation', 'payment_type': 'per task', 'payment_amount': 2},
+        ]
+
+        matcher.match_jobs(jobs, PREFS)
+
+        prompt = matcher.model.generate_content.call_args[0][0]
+        assert 'JOB_TASK' in prompt
+        assert 'JOB_LOW' not in prompt and 'JOB_OFF' not in prompt
+
+    def test_job_index_maps_to_candidates(self, matcher):
+        """Test that job_index refers to the candidate list, best paid first"""
+        jobs = [
+            {'job_id': 'JOB_LOW', 'work_type': 'Pruning', 'pay_rate': 15.0},
+            {'job_id': 'JOB_OFF', 'work_type': 'Irrigation', 'pay_rate': 25.0},
+            {'job_id': 'JOB_HIGH', 'work_type': 'Pruning', 'pay_rate': 20.0},
+        ]
+
+        matched = matcher.match_jobs(jobs, PREFS)
+
+        assert [(job['job_id'], job['_ai_score']) for job in matched] == [('JOB_LOW', 90), ('JOB_HIGH', 60)]
+        assert 'job_index: 0, ID: JOB_HIGH' in matcher.model.generate_content.call_args[0][0]
+
+    def test_max_candidates(self, matcher):
+        """Test that only the best paid matches are sent"""
+        matcher.max_candidates = 3
+        jobs = [{'job_id': f'JOB_{rate}', 'work_type': 'Pruning', 'pay_rate': float(rate)} for rate in range(15, 25)]
+
+        matcher.match_jobs(jobs, PREFS)
+
+        prompt = matcher.model.generate_content.call_args[0][0]
+        assert [f'JOB_{rate}' in prompt for rate in range(15, 25)] == [False] * 7 + [True] * 3
+
+    def test_no_candidates_skips_model(self, matcher):
+        """Test that nothing is sent when no job passes the pre-filter"""
+        assert matcher.match_jobs([{'job_id': 'JOB_1', 'work_type': 'Irrigation'}], PREFS) == []
+        matcher.model.generate_content.assert_not_called()
+
+    def test_descriptions_share_budget(self, matcher):
+        """Test that long descriptions are cut to the token budget"""
+        matcher.description_tokens = 20
+        jobs = make_jobs()
+        for job in jobs:
+            job['description'] = 'word ' * 200
+
+        matcher.match_jobs(jobs, PREFS)
+
+        prompt = matcher.model.generate_content.call_args[0][0]
+        descriptions = [line.split('Description: ')[1] for line in prompt.splitlines() if 'Description: ' in line]
+        assert len(descriptions) == 2
+        assert all(len(description) <= 10 * 4 + 1 and description.endswith('…') for description in descriptions)
+
+    def test_truncate(self):
+        """Test cutting text at a word boundary"""
+        assert truncate('short', 10) == 'short'
+        assert truncate('pick ripe tomatoes carefully', 4) == 'pick ripe…'
@@ -386,6 +386,43 @@ class TestJobMatching:
         assert "found" in response.lower() or "job" in response.lower()
         assert "Tomato Harvest" in response
 
+    def test_new_job_notifies_matching_farmers(self, bot):
+        """Test that posting a job messages the farmers it matches"""
+        for phone, work_types in [('whatsapp:+15555551234', 'Harvesting'), ('whatsapp:+15555551235', 'Pruning')]:
+            bot.store.create_user(phone, 'farmer')
+            bot.store.update_user(phone, {'registered': True})
+            bot.store.update_user_profile(phone, {'work_types': work_types})
+
+        with patch.object(bot, 'send_message') as send_message:
+            bot.store.create_job({'work_type': 'Tomato Harvesting', 'pay_rate': 18.0, 'farm_name': 'Sunny Acres'})
+            bot.sender.shutdown(wait=True)
+
+        send_message.assert_called_once()
+        to_phone, message = send_message.call_args[0]
+        assert to_phone == 'whatsapp:+15555551234'
+        assert "Tomato Harvesting" in message
+        assert "$18.0/hour" in message
+
+    def test_recommendations_cached_per_farmer(self, bot):
+        """Test that repeat lookups reuse the farmer's matches and pick up new jobs"""
+        phone = "whatsapp:+15555551234"
+        bot.store.create_user(phone, 'farmer')
+        bot.store.update_user_profile(phone, {'work_types': 'Harvesting'})
+        bot.store.create_job({'work_type': 'Tomato Harvesting', 'pay_rate': 15.0})
+        prefs = bot.store.get_user(phone)['profile']
+
+        with patch.object(bot, '_rule_based_match', wraps=bot._rule_based_match) as rule_based_match:
+            assert len(bot.match_jobs(None, prefs, phone)) == 1
+            job_id = bot.store.create_job({'work_type': 'Corn Harvesting', 'pay_rate': 20.0})
+            matched = bot.match_jobs(None, prefs, phone)
+
+        assert rule_based_match.call_count == 1
+        assert [job['job_id'] for job in matched][0] == job_id
+
+    def test_closed_job_not_announced(self, bot):
+        """Test that only open jobs are sent to farmers"""
+        assert bot.notify_new_job({'job_id': 'JOB_1', 'status': 'closed'}) == []
+
     def test_job_application(self, bot):
         """Test applying for a job"""
         # Create farmer
@@ -420,6 +457,42 @@ class TestJobMatching:
         assert len(matches) == 1
         assert matches[0]['job_id'] == job_id
 
+    def test_rule_based_match_uses_store_index(self, bot):
+        """Test that matching from the store agrees with matching a job list"""
+        for work_type, pay_rate in [('Tomato Harvesting', 16.0), ('Irrigation', 20.0),
+                                    ('Harvest', 15.0), ('Pruning', 17.0), ('Tomato Harvesting', 19.0)]:
+            bot.store.create_job({'work_type': work_type, 'pay_rate': pay_rate})
+        prefs = {'work_types': 'Harvesting, Pruning'}
+
+        from_store = bot._rule_based_match(None, prefs)
+
+        assert from_store == bot._rule_based_match(bot.store.get_open_jobs(), prefs)
+        assert [job['pay_rate'] for job in from_store] == [19.0, 17.0, 16.0, 15.0]
+
+
+    def test_rule_based_match_enforces_preferences(self, bot):
+        """Test that minimum pay and hours preference rule jobs out"""
+        good = bot.store.create_job({'work_type': 'Harvesting', 'pay_rate': 17.0, 'hours': 'full-time'})
+        bot.store.create_job({'work_type': 'Harvesting', 'pay_rate': 12.0, 'hours': 'full-time'})
+        bot.store.create_job({'work_type': 'Harvesting', 'pay_rate': 20.0, 'hours': 'part-time'})
+        prefs = {'work_types': 'Harvesting', 'min_pay_rate': 15.0, 'hours_preference': 'full-time',
+                 'max_distance': 25}
+
+        matched = bot._rule_based_match(None, prefs)
+
+        assert [job['job_id'] for job in matched] == [good]
+        assert bot._rule_based_match(bot.store.get_open_jobs(), prefs) == matched
+
+
+    def test_rule_based_match_enforces_distance(self, bot):
+        """Test that jobs beyond the farmer's travel distance are left out"""
+        near = bot.store.create_job({'work_type': 'Harvesting', 'pay_rate': 16.0, 'location': 'Carrboro, NC'})
+        bot.store.create_job({'work_type': 'Harvesting', 'pay_rate': 20.0, 'location': 'Wilmington, NC'})
+        prefs = {'work_types': 'Harvesting', 'location': 'Chapel Hill, NC', 'max_distance': 25}
+
+        assert [job['job_id'] for job in bot._rule_based_match(None, prefs)] == [near]
+        assert len(bot._rule_based_match(None, dict(prefs, max_distance=999))) == 2
+
 
 class TestMenus:
     """Test menu navigation"""
@@ -458,6 +531,26 @@ class TestMenus:
         assert "Menu" in response
 
 
+    def test_owner_views_own_jobs(self, bot):
+        """Test that the owner job list shows only their jobs and application counts"""
+        phone = "whatsapp:+15555550001"
+        bot.store.create_user(phone, 'farm_owner')
+        bot.store.update_user(phone, {'registered': True})
+
+        job_id = bot.store.create_job({
+            'work_type': 'Tomato Harvest', 'pay_rate': 18.00, 'owner_phone': phone
+        })
+        bot.store.create_job({
+            'work_type': 'Corn Planting', 'pay_rate': 15.00, 'owner_phone': 'whatsapp:+15555550002'
+        })
+        bot.store.create_match(job_id, 'whatsapp:+15555551234', 'accepted')
+
+        response = bot.handle_message(phone, "2")
+
+        assert "Tomato Harvest" in response
+        assert "Corn Planting" not in response
+        assert "Applications: 1" in response
+
 class TestUpdatePreferences:
     """Test updating farmer preferences"""
 
@@ -4,11 +4,17 @@ Tests data persistence, user management, job postings, and matching
 """
 import pytest
 import json
+import multiprocessing
 import os
 import tempfile
 import shutil
-from datetime import datetime
-from data_store import DataStore
+import threading
+import time
+from datetime import datetime, timedelta
+import data_store as data_store_module
+from matching import HoursFilter, WorkTypeFilter
+from data_store import (ConversationSweeper, DataStore, SequenceIdGenerator, UniqueIdGenerator,
+                        convert_data_dir)
 
 
 @pytest.fixture
@@ -40,6 +46,12 @@ def data_store(temp_data_dir):
     return store
 
 
+@pytest.fixture
+def cached_store(temp_data_dir):
+    """Create a DataStore that keeps collections in memory between reads"""
+    return DataStore(data_dir=temp_data_dir, cache=True)
+
+
 class TestDataStoreUserManagement:
     """Test user creation and management"""
 
@@ -352,3 +364,1240 @@ class TestDataStorePersistence:
         user = store2.get_user(phone)
         assert user is not None
         assert user['profile']['name'] == 'Test User'
+
+
+class TestDataStoreCache:
+    """Test the in-memory cached mode"""
+
+    def test_reads_come_from_memory(self, cached_store):
+        """Test that repeated reads do not re-parse the file"""
+        phone = "whatsapp:+15555551234"
+        cached_store.create_user(phone, 'farmer')
+
+        first = cached_store._read_json(cached_store.users_file)
+        second = cached_store._read_json(cached_store.users_file)
+
+        assert first is second
+        assert cached_store.get_user(phone)['type'] == 'farmer'
+
+    def test_writes_update_cache_and_disk(self, cached_store):
+        """Test that writes go through to disk"""
+        phone = "whatsapp:+15555551234"
+        cached_store.create_user(phone, 'farmer')
+        cached_store.update_user_profile(phone, {'name': 'John Doe'})
+
+        with open(cached_store.users_file) as f:
+            on_disk = json.load(f)
+
+        assert on_disk[phone]['profile']['name'] == 'John Doe'
+        assert cached_store.get_user(phone)['profile']['name'] == 'John Doe'
+
+    def test_detects_external_changes(self, cached_store):
+        """Test that a change made by another writer is picked up"""
+        phone = "whatsapp:+15555551234"
+        cached_store.create_user(phone, 'farmer')
+
+        other = DataStore(data_dir=cached_store.data_dir)
+        other.update_user_profile(phone, {'name': 'Changed Elsewhere'})
+
+        assert cached_store.get_user(phone)['profile']['name'] == 'Changed Elsewhere'
+
+        # A write through the cached store must not lose the external change
+        cached_store.update_user(phone, {'registered': True})
+        user = other.get_user(phone)
+        assert user['registered'] == True
+        assert user['profile']['name'] == 'Changed Elsewhere'
+
+    def test_failed_write_not_cached(self, cached_store):
+        """Test that a change which couldn't be saved is dropped from memory too"""
+        phone = "whatsapp:+15555551234"
+        cached_store.create_user(phone, 'farmer')
+
+        with pytest.raises(TypeError):
+            cached_store.update_user(phone, {'bad': object()})
+
+        assert 'bad' not in cached_store.get_user(phone)
+        cached_store.update_user(phone, {'registered': True})
+        assert DataStore(data_dir=cached_store.data_dir).get_user(phone)['registered'] == True
+
+
+class TestDataStoreJournal:
+    """Test the append-only journal mode"""
+
+    @pytest.fixture
+    def journal_store(self, temp_data_dir):
+        return DataStore(data_dir=temp_data_dir, journal=True, compact_threshold=5)
+
+    def test_writes_append_to_log(self, journal_store):
+        """Test that a record write appends to the log, not the snapshot"""
+        phone = "whatsapp:+15555551234"
+        journal_store.create_user(phone, 'farmer')
+        journal_store.update_user_profile(phone, {'name': 'John Doe'})
+
+        with open(journal_store.users_file) as f:
+            assert json.load(f) == {}
+        with open(journal_store.users_file + '.log') as f:
+            assert len(f.readlines()) == 2
+
+        assert journal_store.get_user(phone)['profile']['name'] == 'John Doe'
+
+    def test_delete_is_journaled(self, journal_store):
+        """Test that clearing a record survives replay"""
+        phone = "whatsapp:+15555551234"
+        journal_store.set_conversation_state(phone, 'farmer_reg_name')
+        journal_store.clear_conversation_state(phone)
+
+        assert journal_store.get_conversation_state(phone) is None
+
+    def test_compacts_on_threshold(self, journal_store):
+        """Test that the log is folded into the snapshot once it grows"""
+        for i in range(5):
+            journal_store.set_conversation_state(f"whatsapp:+1555555000{i}", 'chatting')
+
+        assert not os.path.exists(journal_store.conversations_file + '.log')
+        with open(journal_store.conversations_file) as f:
+            assert len(json.load(f)) == 5
+
+    def test_replays_log_on_startup(self, journal_store):
+        """Test crash recovery from a log left behind, including a torn last line"""
+        phone = "whatsapp:+15555551234"
+        journal_store.create_user(phone, 'farmer')
+        journal_store.update_user(phone, {'registered': True})
+        with open(journal_store.users_file + '.log', 'a') as f:
+            f.write('{"key": "whatsapp:+1555')
+
+        restarted = DataStore(data_dir=journal_store.data_dir, journal=True)
+
+        assert restarted.get_user(phone)['registered'] == True
+        assert not os.path.exists(restarted.users_file + '.log')
+
+    def test_journal_with_cache(self, temp_data_dir):
+        """Test that journal and cache modes work together"""
+        store = DataStore(data_dir=temp_data_dir, journal=True, cache=True)
+        phone = "whatsapp:+15555551234"
+        store.create_user(phone, 'farmer')
+
+        other = DataStore(data_dir=temp_data_dir, journal=True)
+        other.update_user(phone, {'registered': True})
+
+        assert store.get_user(phone)['registered'] == True
+
+    def test_read_during_compaction(self, temp_data_dir, mocker):
+        """Test that a compaction between reading the snapshot and its log loses no records"""
+        reader = DataStore(data_dir=temp_data_dir, journal=True)
+        writer = DataStore(data_dir=temp_data_dir, journal=True)
+        phone = "whatsapp:+15555551234"
+        writer.create_user(phone, 'farmer')
+        replay = reader._replay_journal
+
+        def compact_first(filepath, data):
+            if filepath == writer.users_file and os.path.exists(writer.users_file + '.log'):
+                writer.compact(writer.users_file)
+            replay(filepath, data)
+
+        mocker.patch.object(reader, '_replay_journal', side_effect=compact_first)
+
+        assert reader.get_user(phone) is not None
+
+
+class TestDataStoreMatchIndexes:
+    """Test the farmer/job match indexes"""
+
+    def test_indexes_follow_writes(self, cached_store):
+        """Test that lookups see matches created after the index was built"""
+        farmer = 'whatsapp:+15555551234'
+        first = cached_store.create_match('JOB_1', farmer, 'accepted')
+        assert cached_store.count_job_matches('JOB_1') == 1
+
+        second = cached_store.create_match('JOB_1', 'whatsapp:+15555555678', 'accepted')
+        third = cached_store.create_match('JOB_2', farmer, 'accepted')
+
+        assert cached_store.count_job_matches('JOB_1') == 2
+        assert cached_store.count_job_matches('JOB_3') == 0
+        assert [m['match_id'] for m in cached_store.get_job_matches('JOB_1')] == [first, second]
+        assert [m['match_id'] for m in cached_store.get_farmer_matches(farmer)] == [first, third]
+
+    def test_index_moves_updated_match(self, cached_store):
+        """Test that changing an indexed field moves the match between buckets"""
+        match_id = cached_store.create_match('JOB_1', 'whatsapp:+15555551234')
+        cached_store.get_job_matches('JOB_1')
+
+        cached_store.update_match(match_id, {'job_id': 'JOB_2'})
+
+        assert cached_store.get_job_matches('JOB_1') == []
+        assert cached_store.count_job_matches('JOB_2') == 1
+
+    def test_index_rebuilt_after_external_write(self, cached_store):
+        """Test that the index is rebuilt when another writer changes the file"""
+        cached_store.create_match('JOB_1', 'whatsapp:+15555551234')
+        assert cached_store.count_job_matches('JOB_1') == 1
+
+        other = DataStore(data_dir=cached_store.data_dir)
+        other.create_match('JOB_1', 'whatsapp:+15555555678')
+
+        assert cached_store.count_job_matches('JOB_1') == 2
+
+    def test_no_index_without_cache(self, data_store, mocker):
+        """Test that an uncached store looks matches up without building indexes it would throw away"""
+        farmer = 'whatsapp:+15555551234'
+        first = data_store.create_match('JOB_1', farmer)
+        data_store.create_match('JOB_2', 'whatsapp:+15555555678')
+        index = mocker.spy(data_store, '_index')
+
+        assert [m['match_id'] for m in data_store.get_farmer_matches(farmer)] == [first]
+        assert [m['match_id'] for m in data_store.get_job_matches('JOB_1')] == [first]
+        assert data_store.count_job_matches('JOB_2') == 1
+        assert index.call_count == 0
+
+
+class TestDataStoreOwnerJobs:
+    """Test looking up jobs by owner"""
+
+    def test_get_jobs_by_owner(self, data_store):
+        """Test that only the owner's jobs are returned, in posting order"""
+        owner = 'whatsapp:+15555550001'
+        first = data_store.create_job({'work_type': 'Planting', 'owner_phone': owner})
+        data_store.create_job({'work_type': 'Irrigation', 'owner_phone': 'whatsapp:+15555550002'})
+        second = data_store.create_job({'work_type': 'Harvesting', 'owner_phone': owner})
+
+        jobs = data_store.get_jobs_by_owner(owner)
+
+        assert [j['job_id'] for j in jobs] == [first, second]
+        assert data_store.get_jobs_by_owner('whatsapp:+19999999999') == []
+
+    def test_owner_index_follows_update_job(self, cached_store):
+        """Test that reassigning a job moves it to the new owner"""
+        job_id = cached_store.create_job({'work_type': 'Planting', 'owner_phone': 'whatsapp:+15555550001'})
+        assert len(cached_store.get_jobs_by_owner('whatsapp:+15555550001')) == 1
+
+        cached_store.update_job(job_id, {'owner_phone': 'whatsapp:+15555550002'})
+
+        assert cached_store.get_jobs_by_owner('whatsapp:+15555550001') == []
+        assert cached_store.get_jobs_by_owner('whatsapp:+15555550002')[0]['job_id'] == job_id
+
+
+class TestDataStoreOpenJobsIndex:
+    """Test the status index behind the open job listing"""
+
+    def test_open_jobs_follow_status_changes(self, cached_store):
+        """Test that closing and reopening jobs updates the open listing"""
+        first = cached_store.create_job({'work_type': 'Planting'})
+        second = cached_store.create_job({'work_type': 'Harvesting'})
+        assert [j['job_id'] for j in cached_store.get_open_jobs()] == [first, second]
+
+        cached_store.update_job_status(first, 'filled')
+        assert [j['job_id'] for j in cached_store.get_open_jobs()] == [second]
+
+        cached_store.update_job(first, {'status': 'open'})
+        assert {j['job_id'] for j in cached_store.get_open_jobs()} == {first, second}
+
+    def test_iter_open_jobs(self, cached_store):
+        """Test the iterator form of the open job listing"""
+        job_id = cached_store.create_job({'work_type': 'Planting'})
+        closed = cached_store.create_job({'work_type': 'Harvesting'})
+        cached_store.update_job_status(closed, 'closed')
+
+        jobs = cached_store.iter_open_jobs()
+
+        assert not isinstance(jobs, list)
+        assert [j['job_id'] for j in jobs] == [job_id]
+
+    def test_closing_jobs_while_iterating(self, cached_store):
+        """Test that jobs can be closed while walking the open listing"""
+        for i in range(3):
+            cached_store.create_job({'work_type': f'Job {i}'})
+
+        for job in cached_store.iter_open_jobs():
+            cached_store.update_job_status(job['job_id'], 'closed')
+
+        assert cached_store.get_open_jobs() == []
+
+
+class TestDataStoreTransaction:
+    """Test batching writes with transaction()"""
+
+    def test_each_collection_written_once(self, data_store, mocker):
+        """Test that several writes to a collection are flushed together"""
+        phone = "whatsapp:+15555551234"
+        data_store.create_user(phone, 'farmer')
+        write = mocker.spy(data_store, '_write_json')
+
+        with data_store.transaction():
+            data_store.update_user_profile(phone, {'id_verified': True})
+            data_store.update_user(phone, {'registered': True})
+            data_store.set_conversation_state(phone, 'farmer_pref_work_type')
+            assert write.call_count == 0
+
+        written = sorted(call.args[0] for call in write.call_args_list)
+        assert written == sorted([data_store.users_file, data_store.conversations_file])
+
+        user = data_store.get_user(phone)
+        assert user['registered'] == True
+        assert user['profile']['id_verified'] == True
+
+    def test_reads_see_own_writes(self, data_store):
+        """Test that reads inside the block see buffered writes"""
+        with data_store.transaction():
+            job_id = data_store.create_job({'work_type': 'Planting', 'owner_phone': 'whatsapp:+15555550001'})
+            assert data_store.get_job(job_id)['status'] == 'open'
+            assert len(data_store.get_jobs_by_owner('whatsapp:+15555550001')) == 1
+
+    def test_exception_discards_writes(self, cached_store):
+        """Test that nothing is written if the block raises"""
+        phone = "whatsapp:+15555551234"
+        cached_store.create_user(phone, 'farmer')
+
+        with pytest.raises(RuntimeError):
+            with cached_store.transaction():
+                cached_store.update_user(phone, {'registered': True})
+                cached_store.set_conversation_state(phone, 'chatting')
+                raise RuntimeError("handler failed")
+
+        assert cached_store.get_user(phone)['registered'] == False
+        assert cached_store.get_conversation_state(phone) is None
+
+    def test_cached_indexes_shared_until_commit(self, cached_store, mocker):
+        """Test that a transaction reuses the cache's indexes, re-indexing only the records it writes"""
+        owner = 'whatsapp:+15555550001'
+        for i in range(5):
+            cached_store.create_job({'work_type': f'Job {i}', 'owner_phone': owner})
+        assert len(cached_store.get_jobs_by_owner(owner)) == 5
+        field_value = mocker.spy(data_store_module, '_field_value')
+
+        with cached_store.transaction():
+            assert len(cached_store.get_jobs_by_owner(owner)) == 5
+            assert field_value.call_count == 0
+            cached_store.create_job({'work_type': 'Pruning', 'owner_phone': owner})
+            assert len(cached_store.get_jobs_by_owner(owner)) == 6
+            assert field_value.call_count == 1
+            assert len(cached_store._indexes[cached_store.jobs_file][1]['owner_phone'][0][owner]) == 5
+
+        assert len(cached_store.get_jobs_by_owner(owner)) == 6
+
+    def test_other_threads_dont_write_uncommitted_records(self, temp_data_dir, cached_store):
+        """Test that a writer sharing the cache can't persist another thread's open transaction"""
+        cached_store.create_user("whatsapp:+15555550000", 'farmer')
+        started, written = threading.Event(), threading.Event()
+
+        def fail_transaction():
+            with pytest.raises(RuntimeError):
+                with cached_store.transaction():
+                    cached_store.create_user("whatsapp:+15555551234", 'farmer')
+                    cached_store.update_user("whatsapp:+15555550000", {'registered': True})
+                    started.set()
+                    written.wait(5)
+                    raise RuntimeError("handler failed")
+
+        thread = threading.Thread(target=fail_transaction)
+        thread.start()
+        started.wait(5)
+        cached_store.create_user("whatsapp:+15555555678", 'farm_owner')
+        written.set()
+        thread.join()
+
+        users = DataStore(data_dir=temp_data_dir)._read_json(cached_store.users_file)
+        assert sorted(users) == ["whatsapp:+15555550000", "whatsapp:+15555555678"]
+        assert users["whatsapp:+15555550000"]['registered'] == False
+        assert cached_store.get_user("whatsapp:+15555551234") is None
+
+    def test_nested_transactions_join_outer(self, data_store, mocker):
+        """Test that an inner block defers to the outer one"""
+        write = mocker.spy(data_store, '_write_json')
+
+        with data_store.transaction():
+            with data_store.transaction():
+                data_store.set_conversation_state("whatsapp:+15555551234", 'chatting')
+            data_store.set_conversation_state("whatsapp:+15555555678", 'chatting')
+            assert write.call_count == 0
+
+        assert write.call_count == 1
+
+    def test_journal_transaction_appends_once(self, temp_data_dir):
+        """Test that a journaled transaction appends all its records together"""
+        store = DataStore(data_dir=temp_data_dir, journal=True)
+
+        with store.transaction():
+            for i in range(3):
+                store.set_conversation_state(f"whatsapp:+1555555000{i}", 'chatting')
+
+        with open(store.conversations_file + '.log') as f:
+            assert len(f.readlines()) == 3
+        assert store.get_conversation_state("whatsapp:+15555550002")['state'] == 'chatting'
+
+
+class TestDataStoreAtomicWrites:
+    """Test crash-safe writes and fsync batching"""
+
+    def test_failed_write_keeps_old_file(self, data_store):
+        """Test that a write that fails midway leaves the previous file intact"""
+        phone = "whatsapp:+15555551234"
+        data_store.create_user(phone, 'farmer')
+
+        with pytest.raises(TypeError):
+            data_store.update_user(phone, {'bad': object()})
+
+        with open(data_store.users_file) as f:
+            assert phone in json.load(f)
+        assert [name for name in os.listdir(data_store.data_dir) if name.startswith('.')] == []
+
+    def test_fsync_on_every_write(self, temp_data_dir, mocker):
+        """Test that durable mode flushes file and directory"""
+        store = DataStore(data_dir=temp_data_dir, fsync=True)
+        fsync = mocker.spy(os, 'fsync')
+
+        store.create_user("whatsapp:+15555551234", 'farmer')
+
+        assert fsync.call_count == 2
+        assert store.get_user("whatsapp:+15555551234") is not None
+
+    def test_concurrent_writes_share_fsync(self, temp_data_dir, mocker):
+        """Test that writes within the window are flushed together"""
+        store = DataStore(data_dir=temp_data_dir, fsync=True, fsync_window=0.05)
+        phones = [f"whatsapp:+155555500{i:02d}" for i in range(8)]
+        for phone in phones:
+            store.create_user(phone, 'farmer')
+        fsync = mocker.spy(os, 'fsync')
+        barrier = threading.Barrier(len(phones))
+
+        def register(phone):
+            barrier.wait()
+            store.update_user(phone, {'registered': True})
+
+        threads = [threading.Thread(target=register, args=(phone,)) for phone in phones]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        # Unbatched, each write syncs the file and its directory
+        assert fsync.call_count < len(phones)
+        users = DataStore(data_dir=temp_data_dir)._read_json(store.users_file)
+        assert all(users[phone]['registered'] for phone in phones)
+
+    def test_concurrent_journal_appends_share_fsync(self, temp_data_dir, mocker):
+        """Test that journaled writes within the window are flushed together"""
+        store = DataStore(data_dir=temp_data_dir, journal=True, fsync=True, fsync_window=0.05)
+        store.set_conversation_state("whatsapp:+15555550000", 'chatting')
+        fsync = mocker.spy(os, 'fsync')
+        barrier = threading.Barrier(5)
+
+        def chat(i):
+            barrier.wait()
+            store.set_conversation_state(f"whatsapp:+1555555100{i}", 'chatting')
+
+        threads = [threading.Thread(target=chat, args=(i,)) for i in range(5)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        assert fsync.call_count < 5
+        with open(store.conversations_file + '.log') as f:
+            assert len(f.readlines()) == 6
+
+
+def _create_matches(data_dir, worker, count):
+    store = DataStore(data_dir=data_dir, cache=True, process_safe=True)
+    for i in range(count):
+        store.create_match('JOB_1', f'whatsapp:+1555{worker:03d}{i:04d}', 'accepted')
+        store.set_conversation_state(f'whatsapp:+1555{worker:03d}{i:04d}', 'chatting')
+
+
+class TestDataStoreLocking:
+    """Test concurrent writers"""
+
+    def test_threads_do_not_lose_updates(self, temp_data_dir, cached_store):
+        """Test that concurrent threads appending matches keep every match"""
+        threads = [
+            threading.Thread(target=lambda w=w: [cached_store.create_user(f'whatsapp:+1555{w}{i:04d}', 'farmer') for i in range(20)])
+            for w in range(4)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        assert len(DataStore(data_dir=temp_data_dir)._read_json(cached_store.users_file)) == 80
+
+    @pytest.mark.parametrize('journal', [False, True])
+    def test_processes_do_not_lose_updates(self, temp_data_dir, journal):
+        """Test that several worker processes can write the same files safely"""
+        DataStore(data_dir=temp_data_dir, journal=journal)
+        context = multiprocessing.get_context('fork')
+        workers = [context.Process(target=_create_matches, args=(temp_data_dir, w, 10)) for w in range(4)]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+
+        store = DataStore(data_dir=temp_data_dir, journal=journal)
+        assert store.count_job_matches('JOB_1') == 40
+        assert len(store._read_json(store.conversations_file)) == 40
+
+    def test_forked_worker_reopens_lock_files(self, temp_data_dir):
+        """Test that a store created before fork still locks out its forked workers"""
+        store = DataStore(data_dir=temp_data_dir, journal=True, process_safe=True)
+        context = multiprocessing.get_context('fork')
+        held = context.Event()
+        worker = context.Process(target=_hold_users_lock, args=(store, held, 0.5))
+        worker.start()
+        held.wait(5)
+
+        started = time.time()
+        with store._lock(store.users_file):
+            waited = time.time() - started
+        worker.join()
+
+        assert waited >= 0.3
+
+    def test_transaction_keeps_concurrent_records(self, temp_data_dir):
+        """Test that committing a transaction doesn't drop records written meanwhile"""
+        store = DataStore(data_dir=temp_data_dir, cache=True, process_safe=True)
+        other = DataStore(data_dir=temp_data_dir, process_safe=True)
+
+        with store.transaction():
+            store.get_user("whatsapp:+15555551234")
+            store.create_user("whatsapp:+15555551234", 'farmer')
+            other.create_user("whatsapp:+15555555678", 'farm_owner')
+
+        users = DataStore(data_dir=temp_data_dir)._read_json(store.users_file)
+        assert set(users) == {"whatsapp:+15555551234", "whatsapp:+15555555678"}
+
+    def test_append_after_torn_line_is_kept(self, temp_data_dir):
+        """Test that a write following a crash mid-append is not swallowed"""
+        store = DataStore(data_dir=temp_data_dir, journal=True)
+        with open(store.users_file + '.log', 'a') as f:
+            f.write('{"key": "whatsapp:+1555')
+
+        store.create_user("whatsapp:+15555551234", 'farmer')
+
+        assert store.get_user("whatsapp:+15555551234") is not None
+
+
+def _hold_users_lock(store, held, seconds):
+    with store._lock(store.users_file):
+        held.set()
+        time.sleep(seconds)
+
+
+def _generate_ids(path, queue):
+    generator = SequenceIdGenerator(path)
+    queue.put([generator('JOB') for _ in range(20)])
+
+
+class TestIdGeneration:
+    """Test job and match ID generation"""
+
+    def test_unique_ids_within_one_second(self):
+        """Test that IDs made back to back, by several stores, never repeat"""
+        first, second = UniqueIdGenerator(), UniqueIdGenerator()
+        ids = [first('JOB') for _ in range(500)] + [second('JOB') for _ in range(500)]
+
+        assert len(set(ids)) == 1000
+        assert all(job_id.startswith('JOB_') for job_id in ids)
+
+    def test_ids_survive_deletion(self, data_store):
+        """Test that a new job never reuses the ID of one that was removed"""
+        first = data_store.create_job({'work_type': 'Planting'})
+        second = data_store.create_job({'work_type': 'Irrigation'})
+        jobs = data_store._read_json(data_store.jobs_file)
+        del jobs[first]
+        data_store._write_json(data_store.jobs_file, jobs)
+
+        third = data_store.create_job({'work_type': 'Harvesting'})
+
+        assert third != second
+        assert data_store.get_job(second)['work_type'] == 'Irrigation'
+
+    def test_sequence_ids_across_processes(self, temp_data_dir):
+        """Test that the persisted counter hands out each number once"""
+        path = os.path.join(temp_data_dir, 'ids.json')
+        context = multiprocessing.get_context('fork')
+        queue = context.Queue()
+        workers = [context.Process(target=_generate_ids, args=(path, queue)) for _ in range(3)]
+        for worker in workers:
+            worker.start()
+        ids = [job_id for _ in workers for job_id in queue.get()]
+        for worker in workers:
+            worker.join()
+
+        numbers = sorted(int(job_id.split('_')[1]) for job_id in ids)
+        assert numbers == list(range(1, 61))
+
+    def test_store_uses_given_generator(self, temp_data_dir):
+        """Test plugging a generator into the store"""
+        store = DataStore(data_dir=temp_data_dir,
+                          id_generator=SequenceIdGenerator(os.path.join(temp_data_dir, 'ids.json')))
+
+        assert store.create_job({'work_type': 'Planting'}).startswith('JOB_1_')
+        assert store.create_match('JOB_1', 'whatsapp:+15555551234').startswith('MATCH_1_')
+        assert store.create_job({'work_type': 'Irrigation'}).startswith('JOB_2_')
+
+
+class TestStorageFormats:
+    """Test the on-disk storage formats and the converter"""
+
+    def test_default_format_is_indented_json(self, data_store):
+        """Test that the default format keeps today's readable files"""
+        data_store.create_user('whatsapp:+15555551234', 'farmer')
+
+        with open(data_store.users_file) as f:
+            content = f.read()
+        assert '\n  ' in content
+        assert json.loads(content)['whatsapp:+15555551234']['type'] == 'farmer'
+
+    def test_compact_format_has_no_whitespace(self, temp_data_dir):
+        """Test that the compact format writes plain JSON without pretty-printing"""
+        store = DataStore(data_dir=temp_data_dir, format='compact')
+        store.create_user('whatsapp:+15555551234', 'farmer')
+
+        with open(store.users_file) as f:
+            content = f.read()
+        assert '\n' not in content and ', ' not in content
+        assert store.get_user('whatsapp:+15555551234')['type'] == 'farmer'
+
+    def test_fast_format_round_trip(self, temp_data_dir):
+        """Test that the fast format reads back what it wrote"""
+        store = DataStore(data_dir=temp_data_dir, format='fast')
+        job_id = store.create_job({'work_type': 'Planting', 'pay_rate': 15.0})
+
+        reopened = DataStore(data_dir=temp_data_dir, format='compact')
+        assert reopened.get_job(job_id)['pay_rate'] == 15.0
+
+    def test_msgpack_format(self, temp_data_dir):
+        """Test storing collections as msgpack files"""
+        pytest.importorskip('msgpack')
+        store = DataStore(data_dir=temp_data_dir, format='msgpack')
+        store.create_user('whatsapp:+15555551234', 'farmer')
+
+        assert store.users_file.endswith('users.msgpack')
+        assert DataStore(data_dir=temp_data_dir, format='msgpack').get_user('whatsapp:+15555551234')
+
+    def test_unknown_format_rejected(self, temp_data_dir):
+        """Test that a typo in the format name fails loudly"""
+        with pytest.raises(ValueError):
+            DataStore(data_dir=temp_data_dir, format='yaml')
+
+    def test_convert_data_dir(self, temp_data_dir):
+        """Test converting existing data, including journaled changes"""
+        store = DataStore(data_dir=temp_data_dir, journal=True)
+        store.create_user('whatsapp:+15555551234', 'farmer')
+        job_id = store.create_job({'work_type': 'Planting'})
+
+        convert_data_dir(temp_data_dir, 'json', 'compact')
+
+        converted = DataStore(data_dir=temp_data_dir, format='compact')
+        assert converted.get_user('whatsapp:+15555551234')['type'] == 'farmer'
+        assert converted.get_job(job_id)['work_type'] == 'Planting'
+        assert not os.path.exists(converted.jobs_file + '.log')
+        with open(converted.jobs_file) as f:
+            assert '\n' not in f.read()
+
+    def test_convert_finds_conversation_shards(self, temp_data_dir):
+        """Test that shard files are converted without being told the shard count"""
+        store = DataStore(data_dir=temp_data_dir, conversation_shards=8)
+        phones = [f'whatsapp:+1555555{i:04d}' for i in range(20)]
+        for phone in phones:
+            store.set_conversation_state(phone, 'farmer_reg_name')
+
+        convert_data_dir(temp_data_dir, 'json', 'compact')
+
+        converted = DataStore(data_dir=temp_data_dir, format='compact', conversation_shards=8)
+        assert all(converted.get_conversation_state(phone)['state'] == 'farmer_reg_name' for phone in phones)
+        for name in os.listdir(converted.conversations_dir):
+            with open(os.path.join(converted.conversations_dir, name)) as f:
+                assert '\n' not in f.read()
+
+
+class TestConversationShards:
+    """Test spreading conversation states over shard files"""
+
+    @pytest.fixture
+    def sharded_store(self, temp_data_dir):
+        return DataStore(data_dir=temp_data_dir, conversation_shards=8)
+
+    def test_state_round_trip(self, sharded_store):
+        """Test that sharded states read back like unsharded ones"""
+        sharded_store.set_conversation_state('whatsapp:+15555551234', 'awaiting_name', {'step': 1})
+
+        state = sharded_store.get_conversation_state('whatsapp:+15555551234')
+        assert state['state'] == 'awaiting_name'
+        assert state['data'] == {'step': 1}
+
+        sharded_store.clear_conversation_state('whatsapp:+15555551234')
+        assert sharded_store.get_conversation_state('whatsapp:+15555551234') is None
+
+    def test_write_touches_only_own_shard(self, sharded_store):
+        """Test that a state change rewrites a single shard file"""
+        phones = [f'whatsapp:+1555555{i:04d}' for i in range(20)]
+        for phone in phones:
+            sharded_store.set_conversation_state(phone, 'main_menu')
+        mtimes = {path: os.stat(path).st_mtime_ns for path in sharded_store._conversation_shard_files()
+                  if os.path.exists(path)}
+        assert len(mtimes) > 1
+
+        sharded_store.set_conversation_state(phones[0], 'awaiting_location')
+
+        own_file = sharded_store._conversation_file(phones[0])
+        changed = [path for path, mtime in mtimes.items() if os.stat(path).st_mtime_ns != mtime]
+        assert changed == [own_file]
+        with open(sharded_store.conversations_file) as f:
+            assert json.load(f) == {}
+
+    def test_shard_is_stable_across_stores(self, temp_data_dir):
+        """Test that every store instance picks the same shard for a phone"""
+        first = DataStore(data_dir=temp_data_dir, conversation_shards=8)
+        first.set_conversation_state('whatsapp:+15555551234', 'main_menu')
+
+        second = DataStore(data_dir=temp_data_dir, conversation_shards=8)
+        assert second.get_conversation_state('whatsapp:+15555551234')['state'] == 'main_menu'
+
+    def test_existing_states_are_migrated(self, temp_data_dir):
+        """Test that turning sharding on keeps states from the single file"""
+        DataStore(data_dir=temp_data_dir).set_conversation_state('whatsapp:+15555551234', 'main_menu')
+
+        store = DataStore(data_dir=temp_data_dir, conversation_shards=4)
+
+        assert store.get_conversation_state('whatsapp:+15555551234')['state'] == 'main_menu'
+        with open(store.conversations_file) as f:
+            assert json.load(f) == {}
+
+    def test_migration_writes_each_shard_once(self, temp_data_dir, mocker):
+        """Test that moving many states rewrites each shard once, not once per state"""
+        store = DataStore(data_dir=temp_data_dir)
+        with store.transaction():
+            for i in range(200):
+                store.set_conversation_state(f'whatsapp:+1555555{i:04d}', 'main_menu')
+        write = mocker.spy(DataStore, '_write_json')
+
+        store = DataStore(data_dir=temp_data_dir, conversation_shards=4)
+
+        assert write.call_count == 5
+        assert all(store.get_conversation_state(f'whatsapp:+1555555{i:04d}')['state'] == 'main_menu'
+                   for i in range(200))
+
+    @pytest.mark.parametrize('shards', [3, 16, 0])
+    def test_changing_shard_count_moves_states(self, temp_data_dir, shards):
+        """Test that states follow a change of conversation_shards between runs"""
+        phones = [f'whatsapp:+1555555{i:04d}' for i in range(50)]
+        store = DataStore(data_dir=temp_data_dir, conversation_shards=8)
+        for phone in phones:
+            store.set_conversation_state(phone, 'main_menu')
+
+        store = DataStore(data_dir=temp_data_dir, conversation_shards=shards)
+
+        assert all(store.get_conversation_state(phone)['state'] == 'main_menu' for phone in phones)
+        files = [store.conversations_file] + store._conversation_shard_files()
+        for path in files:
+            for phone in store._read_json(path):
+                assert store._conversation_file(phone) == path
+        assert sum(len(store._read_json(path)) for path in files) == len(phones)
+        names = sorted(name for name in os.listdir(store.conversations_dir) if name != 'shards')
+        assert names == sorted(os.path.basename(path) for path in store._conversation_shard_files())
+
+    def test_concurrent_conversations(self, sharded_store):
+        """Test that concurrent users on different shards lose no updates"""
+        def converse(worker):
+            phone = f'whatsapp:+1555555{worker:04d}'
+            for step in range(20):
+                sharded_store.set_conversation_state(phone, 'step', {'step': step})
+
+        threads = [threading.Thread(target=converse, args=(worker,)) for worker in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        for worker in range(8):
+            state = sharded_store.get_conversation_state(f'whatsapp:+1555555{worker:04d}')
+            assert state['data'] == {'step': 19}
+
+    def test_journal_mode(self, temp_data_dir):
+        """Test that sharded journals are recovered on startup"""
+        store = DataStore(data_dir=temp_data_dir, journal=True, conversation_shards=4)
+        store.set_conversation_state('whatsapp:+15555551234', 'main_menu')
+        shard_file = store._conversation_file('whatsapp:+15555551234')
+        assert os.path.exists(shard_file + '.log')
+
+        reopened = DataStore(data_dir=temp_data_dir, journal=True, conversation_shards=4)
+
+        assert not os.path.exists(shard_file + '.log')
+        assert reopened.get_conversation_state('whatsapp:+15555551234')['state'] == 'main_menu'
+
+
+class TestConversationExpiry:
+    """Test conversation state TTLs and the sweeper"""
+
+    @pytest.fixture
+    def expiring_store(self, temp_data_dir):
+        return DataStore(data_dir=temp_data_dir, conversation_ttl=3600,
+                         state_ttls={'selecting_from_recommendations': 600, 'main_menu': None})
+
+    def test_expired_state_reads_as_missing(self, expiring_store):
+        """Test that a state older than its TTL is treated as gone"""
+        phone = 'whatsapp:+15555551234'
+        expiring_store.set_conversation_state(phone, 'selecting_from_recommendations', {'job_ids': ['JOB_1']})
+        assert expiring_store.get_conversation_state(phone) is not None
+
+        conversations = expiring_store._read_json(expiring_store.conversations_file)
+        conversations[phone]['updated_at'] = (datetime.now() - timedelta(minutes=11)).isoformat()
+        expiring_store._write_json(expiring_store.conversations_file, conversations)
+
+        assert expiring_store.get_conversation_state(phone) is None
+
+    def test_sweep_removes_only_expired(self, expiring_store):
+        """Test per-state TTLs when sweeping"""
+        expiring_store.set_conversation_state('whatsapp:+15555550001', 'selecting_from_recommendations')
+        expiring_store.set_conversation_state('whatsapp:+15555550002', 'chatting')
+        expiring_store.set_conversation_state('whatsapp:+15555550003', 'main_menu')
+
+        assert expiring_store.sweep_conversations() == 0
+        assert expiring_store.sweep_conversations(now=datetime.now() + timedelta(minutes=30)) == 1
+        assert expiring_store.sweep_conversations(now=datetime.now() + timedelta(days=30)) == 1
+
+        with open(expiring_store.conversations_file) as f:
+            assert list(json.load(f)) == ['whatsapp:+15555550003']
+
+    def test_sweep_is_one_write_per_file(self, expiring_store, mocker):
+        """Test that expired states are evicted in bulk"""
+        for i in range(10):
+            expiring_store.set_conversation_state(f'whatsapp:+1555555{i:04d}', 'chatting')
+        persist = mocker.spy(expiring_store, '_persist')
+
+        assert expiring_store.sweep_conversations(now=datetime.now() + timedelta(days=1)) == 10
+        assert persist.call_count == 1
+
+    def test_sweep_sharded_journal(self, temp_data_dir):
+        """Test sweeping shards in journal mode"""
+        store = DataStore(data_dir=temp_data_dir, journal=True, conversation_shards=4, conversation_ttl=60)
+        for i in range(10):
+            store.set_conversation_state(f'whatsapp:+1555555{i:04d}', 'chatting')
+
+        assert store.sweep_conversations(now=datetime.now() + timedelta(hours=1)) == 10
+
+        reopened = DataStore(data_dir=temp_data_dir, journal=True, conversation_shards=4)
+        assert all(reopened.get_conversation_state(f'whatsapp:+1555555{i:04d}') is None for i in range(10))
+
+    def test_no_ttl_never_expires(self, data_store):
+        """Test that states are kept forever by default"""
+        data_store.set_conversation_state('whatsapp:+15555551234', 'chatting')
+
+        assert data_store.sweep_conversations(now=datetime.now() + timedelta(days=365)) == 0
+
+    def test_background_sweeper(self, temp_data_dir):
+        """Test that the sweeper thread evicts expired states"""
+        store = DataStore(data_dir=temp_data_dir, conversation_ttl=0)
+        store.set_conversation_state('whatsapp:+15555551234', 'chatting')
+
+        sweeper = ConversationSweeper(store, interval=0.01).start()
+        deadline = time.time() + 2
+        while store._read_json(store.conversations_file) and time.time() < deadline:
+            time.sleep(0.01)
+        sweeper.stop()
+
+        assert store._read_json(store.conversations_file) == {}
+
+
+class TestJobArchive:
+    """Test job expiry and archival of old postings"""
+
+    def test_expired_jobs_leave_open_jobs(self, data_store):
+        """Test that a job past its expiry date is no longer listed as open"""
+        past = data_store.create_job({'work_type': 'Blueberry Harvesting', 'expires_at': '2020-08-31'})
+        current = data_store.create_job({'work_type': 'Planting',
+                                         'expires_at': (datetime.now() + timedelta(days=1)).isoformat()})
+        forever = data_store.create_job({'work_type': 'Irrigation'})
+
+        assert [job['job_id'] for job in data_store.get_open_jobs()] == [current, forever]
+        assert data_store.get_job(past)['status'] == 'open'
+
+    def test_job_ttl_sets_expiry(self, temp_data_dir):
+        """Test that job_ttl gives new jobs a default expiry date"""
+        store = DataStore(data_dir=temp_data_dir, job_ttl=3600)
+        job_id = store.create_job({'work_type': 'Planting'})
+        own_date = store.create_job({'work_type': 'Harvesting', 'expires_at': '2099-01-01'})
+
+        assert datetime.fromisoformat(store.get_job(job_id)['expires_at']) > datetime.now()
+        assert store.get_job(own_date)['expires_at'] == '2099-01-01'
+
+    def test_archive_moves_jobs_and_matches(self, data_store):
+        """Test that closed and expired jobs move to the archive with their matches"""
+        expired = data_store.create_job({'work_type': 'Blueberry Harvesting', 'expires_at': '2020-08-31'})
+        filled = data_store.create_job({'work_type': 'Pruning'})
+        data_store.update_job_status(filled, 'filled')
+        active = data_store.create_job({'work_type': 'Planting'})
+        data_store.create_match(expired, 'whatsapp:+15555551234')
+        data_store.create_match(active, 'whatsapp:+15555551234')
+
+        assert data_store.archive_jobs() == 2
+
+        assert list(data_store._read_json(data_store.jobs_file)) == [active]
+        assert len(data_store._read_json(data_store.matches_file)) == 1
+        assert data_store.get_job(expired)['status'] == 'expired'
+        assert data_store.get_job(filled)['status'] == 'filled'
+        assert data_store.get_job_matches(expired)[0]['farmer_phone'] == 'whatsapp:+15555551234'
+        assert len(data_store.get_farmer_matches('whatsapp:+15555551234')) == 1
+        assert len(data_store.get_farmer_matches('whatsapp:+15555551234', include_archived=True)) == 2
+
+    def test_owner_history_includes_archive(self, data_store):
+        """Test that an owner still sees archived jobs and their application counts"""
+        expired = data_store.create_job({'work_type': 'Pruning', 'owner_phone': 'whatsapp:+15555550000',
+                                         'expires_at': '2020-08-31'})
+        active = data_store.create_job({'work_type': 'Planting', 'owner_phone': 'whatsapp:+15555550000'})
+        data_store.create_match(expired, 'whatsapp:+15555551234')
+        data_store.archive_jobs()
+
+        assert [job['job_id'] for job in data_store.get_jobs_by_owner('whatsapp:+15555550000')] == [active]
+        owner_jobs = data_store.get_jobs_by_owner('whatsapp:+15555550000', fields=['status'], include_archived=True)
+        assert owner_jobs == [{'job_id': active, 'status': 'open'}, {'job_id': expired, 'status': 'expired'}]
+        assert data_store.count_job_matches(expired) == 1
+        assert data_store.count_job_matches(active) == 0
+
+    def test_archive_with_nothing_to_move(self, data_store):
+        """Test that archiving leaves the files alone when every job is open"""
+        data_store.create_job({'work_type': 'Planting'})
+
+        assert data_store.archive_jobs() == 0
+        assert not os.path.exists(data_store.jobs_archive_file)
+
+    def test_archive_in_journal_mode(self, temp_data_dir):
+        """Test that archived jobs survive a restart in journal mode"""
+        store = DataStore(data_dir=temp_data_dir, journal=True)
+        job_id = store.create_job({'work_type': 'Pruning', 'expires_at': '2020-01-01'})
+        store.archive_jobs()
+
+        reopened = DataStore(data_dir=temp_data_dir, journal=True)
+        assert reopened.get_open_jobs() == []
+        assert reopened.get_job(job_id)['status'] == 'expired'
+
+
+class TestFieldProjection:
+    """Test loading only some fields of each job"""
+
+    @pytest.fixture
+    def jobs(self, data_store):
+        first = data_store.create_job({'work_type': 'Planting', 'pay_rate': 15.0, 'description': 'x' * 1000,
+                                       'owner_phone': 'whatsapp:+15555559999'})
+        second = data_store.create_job({'work_type': 'Irrigation', 'pay_rate': 17.0, 'skills': ['pipes']})
+        return first, second
+
+    def test_iter_open_jobs_with_fields(self, data_store, jobs):
+        """Test that only the requested fields and the job ID are returned"""
+        listed = list(data_store.iter_open_jobs(fields=['work_type', 'pay_rate', 'skills']))
+
+        assert listed == [
+            {'job_id': jobs[0], 'work_type': 'Planting', 'pay_rate': 15.0, 'skills': None},
+            {'job_id': jobs[1], 'work_type': 'Irrigation', 'pay_rate': 17.0, 'skills': ['pipes']},
+        ]
+
+    def test_projection_skips_expired_and_closed(self, data_store, jobs):
+        """Test that projected listings honour status and expiry"""
+        data_store.update_job_status(jobs[0], 'filled')
+        data_store.create_job({'work_type': 'Pruning', 'expires_at': '2020-01-01'})
+
+        assert data_store.get_open_jobs(fields=['work_type']) == [{'job_id': jobs[1], 'work_type': 'Irrigation'}]
+
+    def test_jobs_by_owner_with_fields(self, data_store, jobs):
+        """Test projecting an owner's jobs"""
+        assert data_store.get_jobs_by_owner('whatsapp:+15555559999', fields=['status']) == [
+            {'job_id': jobs[0], 'status': 'open'}
+        ]
+
+    def test_cached_columns_follow_updates(self, cached_store):
+        """Test that cached columns are kept in step with writes"""
+        job_id = cached_store.create_job({'work_type': 'Planting', 'pay_rate': 15.0})
+        assert cached_store.get_open_jobs(fields=['pay_rate'])[0]['pay_rate'] == 15.0
+
+        cached_store.update_job(job_id, {'pay_rate': 18.0})
+        other = cached_store.create_job({'work_type': 'Irrigation', 'pay_rate': 16.0})
+
+        assert cached_store.get_open_jobs(fields=['pay_rate']) == [
+            {'job_id': job_id, 'pay_rate': 18.0},
+            {'job_id': other, 'pay_rate': 16.0},
+        ]
+
+
+class TestWorkTypeIndex:
+    """Test filtering open jobs by work type through the index"""
+
+    def test_filter_open_jobs(self, data_store):
+        """Test that only open jobs of a matching work type come back, in order"""
+        tomato = data_store.create_job({'work_type': 'Tomato Harvesting'})
+        data_store.create_job({'work_type': 'Irrigation'})
+        closed = data_store.create_job({'work_type': 'Harvest'})
+        data_store.update_job_status(closed, 'filled')
+        harvest = data_store.create_job({'work_type': 'Harvest'})
+
+        jobs = data_store.get_open_jobs(work_type=WorkTypeFilter('Harvesting'))
+
+        assert [job['job_id'] for job in jobs] == [tomato, harvest]
+
+    def test_predicate_runs_per_distinct_value(self, data_store, mocker):
+        """Test that the predicate sees each work type once, not each job"""
+        for _ in range(10):
+            data_store.create_job({'work_type': 'Planting'})
+            data_store.create_job({'work_type': 'Pruning'})
+        predicate = mocker.Mock(side_effect=lambda value: value == 'Pruning')
+
+        assert len(data_store.get_open_jobs(work_type=predicate)) == 10
+        assert predicate.call_count == 2
+
+    def test_cached_index_follows_updates(self, cached_store):
+        """Test that the cached work-type index sees new and changed jobs"""
+        job_id = cached_store.create_job({'work_type': 'Planting'})
+        assert cached_store.get_open_jobs(work_type=WorkTypeFilter('Pruning')) == []
+
+        cached_store.update_job(job_id, {'work_type': 'Pruning'})
+
+        assert [job['job_id'] for job in cached_store.get_open_jobs(work_type=WorkTypeFilter('Pruning'))] == [job_id]
+
+
+class TestEffectiveHourlyRate:
+    """Test the hourly rate stored with each job"""
+
+    def test_set_on_create(self, data_store):
+        """Test that new jobs carry their hourly rate"""
+        daily = data_store.create_job({'payment_type': 'per day', 'payment_amount': 160.0})
+        hourly = data_store.create_job({'pay_rate': 15.0})
+
+        assert data_store.get_job(daily)['effective_hourly_rate'] == 20.0
+        assert data_store.get_job(hourly)['effective_hourly_rate'] == 15.0
+
+    def test_recomputed_on_update(self, data_store):
+        """Test that changing the pay updates the stored rate"""
+        job_id = data_store.create_job({'payment_type': 'per hour', 'payment_amount': 15.0})
+
+        data_store.update_job(job_id, {'payment_type': 'per day', 'payment_amount': 200.0})
+
+        assert data_store.get_job(job_id)['effective_hourly_rate'] == 25.0
+
+
+class TestOpenJobFilters:
+    """Test filtering open jobs by pay and hours through indexes"""
+
+    def test_min_rate(self, data_store):
+        """Test the pay cutoff, including day rates and jobs saved without a stored rate"""
+        low = data_store.create_job({'pay_rate': 14.0})
+        daily = data_store.create_job({'payment_type': 'per day', 'payment_amount': 160.0})
+        exact = data_store.create_job({'pay_rate': 16.0})
+        jobs = data_store._read_json(data_store.jobs_file)
+        legacy = 'JOB_legacy'
+        jobs[legacy] = {'job_id': legacy, 'status': 'open', 'pay_rate': 18.0}
+        data_store._write_json(data_store.jobs_file, jobs)
+
+        assert [job['job_id'] for job in data_store.get_open_jobs(min_rate=16.0)] == [daily, exact, legacy]
+        assert len(data_store.get_open_jobs(min_rate=0)) == 4
+        assert low not in [job['job_id'] for job in data_store.get_open_jobs(min_rate=14.5)]
+
+    def test_hours(self, data_store):
+        """Test filtering by hours preference"""
+        full = data_store.create_job({'hours': 'full-time'})
+        data_store.create_job({'hours': 'part-time'})
+        shift = data_store.create_job({'work_hours': '6:00 AM - 2:00 PM'})
+
+        jobs = data_store.get_open_jobs(hours=HoursFilter('full-time'))
+
+        assert [job['job_id'] for job in jobs] == [full, shift]
+
+    def test_cached_rate_index_follows_updates(self, cached_store):
+        """Test that the cached rate index sees pay changes and removals"""
+        first = cached_store.create_job({'pay_rate': 14.0})
+        second = cached_store.create_job({'pay_rate': 20.0})
+        assert [job['job_id'] for job in cached_store.get_open_jobs(min_rate=15.0)] == [second]
+
+        cached_store.update_job(first, {'pay_rate': 22.0})
+        cached_store.update_job(second, {'pay_rate': 12.0})
+        third = cached_store.create_job({'pay_rate': 15.0})
+
+        assert [job['job_id'] for job in cached_store.get_open_jobs(min_rate=15.0)] == [first, third]
+        by_rate, _ = cached_store._sorted_index(cached_store.jobs_file, cached_store._read_json(cached_store.jobs_file), 'open_rate', None)
+        assert [rate for rate, _ in by_rate] == [12.0, 15.0, 22.0]
+
+    def test_rate_index_holds_only_open_jobs(self, cached_store):
+        """Test that closed jobs leave the rate index instead of being filtered per call"""
+        job_ids = [cached_store.create_job({'pay_rate': 15.0 + i}) for i in range(4)]
+        assert len(cached_store.get_open_jobs(min_rate=16.0)) == 3
+
+        cached_store.update_job_status(job_ids[3], 'closed')
+
+        assert [job['job_id'] for job in cached_store.get_open_jobs(min_rate=16.0)] == job_ids[1:3]
+        by_rate, rates = cached_store._sorted_index(cached_store.jobs_file, cached_store._read_json(cached_store.jobs_file), 'open_rate', None)
+        assert [job_id for _, job_id in by_rate] == job_ids[:3]
+        assert sorted(rates) == sorted(job_ids[:3])
+
+
+class TestLocationIndex:
+    """Test geocoding at write time and the grid index over jobs"""
+
+    def test_coordinates_cached_on_write(self, data_store):
+        """Test that jobs and profiles get coordinates for their location"""
+        job_id = data_store.create_job({'work_type': 'Planting', 'location': 'Durham, NC'})
+        data_store.create_user('whatsapp:+15555551234', 'farmer')
+        data_store.update_user_profile('whatsapp:+15555551234', {'location': 'Raleigh, NC'})
+
+        assert data_store.get_job(job_id)['latitude'] == pytest.approx(35.994)
+        assert data_store.get_user('whatsapp:+15555551234')['profile']['longitude'] == pytest.approx(-78.6382)
+
+        data_store.update_job(job_id, {'location': 'Unknown Town'})
+        assert 'latitude' not in data_store.get_job(job_id)
+
+    def test_jobs_within(self, data_store):
+        """Test finding jobs near a point, keeping jobs without coordinates"""
+        durham = data_store.create_job({'location': 'Durham, NC'})
+        data_store.create_job({'location': 'Charlotte, NC'})
+        unknown = data_store.create_job({'location': 'Back forty'})
+        carrboro = data_store.create_job({'location': 'Carrboro, NC'})
+
+        jobs = data_store.get_open_jobs(within=(35.9132, -79.0558, 25))
+
+        assert [job['job_id'] for job in jobs] == [durham, unknown, carrboro]
+
+    def test_only_nearby_cells_checked(self, data_store, mocker):
+        """Test that the grid index skips distance checks for far-away jobs"""
+        for _ in range(20):
+            data_store.create_job({'location': 'Fresno, CA'})
+        data_store.create_job({'location': 'Cary, NC'})
+        distance = mocker.spy(data_store_module, 'distance_miles')
+
+        assert len(data_store.get_open_jobs(within=(35.9132, -79.0558, 25))) == 1
+        assert distance.call_count == 1
+
+    def test_cached_grid_follows_moves(self, cached_store):
+        """Test that the cached grid index sees a job's new location"""
+        job_id = cached_store.create_job({'location': 'Fresno, CA'})
+        assert cached_store.get_open_jobs(within=(35.9132, -79.0558, 25)) == []
+
+        cached_store.update_job(job_id, {'location': 'Hillsborough, NC'})
+
+        assert [job['job_id'] for job in cached_store.get_open_jobs(within=(35.9132, -79.0558, 25))] == [job_id]
+
+
+def add_farmer(store, phone, registered=True, **profile):
+    """Create a farmer with the given preferences"""
+    store.create_user(phone, 'farmer')
+    store.update_user(phone, {'registered': registered})
+    store.update_user_profile(phone, profile)
+
+
+class TestReverseMatching:
+    """Test finding the farmers a new job matches"""
+
+    def test_same_as_job_filter(self, data_store):
+        """Test random farmers against the forward JobFilter check"""
+        import random
+        from matching import JobFilter
+        rng = random.Random(3)
+        for i in range(60):
+            add_farmer(data_store, f'whatsapp:+1555555{i:04d}',
+                       work_types=rng.choice(['Harvesting', 'Pruning, Irrigation', 'All types of work', '']),
+                       min_pay_rate=rng.choice([None, 12, 15, 18]),
+                       hours_preference=rng.choice(['full-time', 'part-time', 'flexible', None]),
+                       location=rng.choice(['Durham, NC', 'Fresno, CA', 'Nowhere']),
+                       max_distance=rng.choice([10, 25, 999, None]))
+        users = data_store._read_json(data_store.users_file)
+
+        for work_type in ['Tomato Harvesting', 'Pruning', 'Planting']:
+            for location in ['Chapel Hill, NC', 'Salinas, CA', 'Back forty']:
+                for hours in ['full-time', 'part-time', None]:
+                    job_id = data_store.create_job({'work_type': work_type, 'location': location, 'hours': hours,
+                                                    'pay_rate': rng.choice([12.0, 16.0, 20.0])})
+                    job = data_store.get_job(job_id)
+                    expected = [phone for phone, user in users.items() if JobFilter(user['profile'])(job)]
+                    assert data_store.find_matching_farmers(job) == expected
+
+    def test_only_registered_farmers(self, data_store):
+        """Test that owners and unregistered farmers aren't matched"""
+        add_farmer(data_store, 'whatsapp:+15555551234')
+        add_farmer(data_store, 'whatsapp:+15555551235', registered=False)
+        data_store.create_user('whatsapp:+15555550001', 'owner')
+        job_id = data_store.create_job({'work_type': 'Pruning', 'pay_rate': 15.0})
+
+        assert data_store.find_matching_farmers(data_store.get_job(job_id)) == ['whatsapp:+15555551234']
+
+    def test_cached_indexes_follow_profile_updates(self, cached_store):
+        """Test that a changed preference is seen by the cached user indexes"""
+        add_farmer(cached_store, 'whatsapp:+15555551234', work_types='Pruning', min_pay_rate=20,
+                   location='Durham, NC', max_distance=10)
+        job = cached_store.get_job(cached_store.create_job({'work_type': 'Pruning', 'pay_rate': 15.0, 'location': 'Raleigh, NC'}))
+        assert cached_store.find_matching_farmers(job) == []
+
+        cached_store.update_user_profile('whatsapp:+15555551234', {'min_pay_rate': 15, 'max_distance': 25})
+        assert cached_store.find_matching_farmers(job) == ['whatsapp:+15555551234']
+
+    def test_job_listener(self, data_store):
+        """Test that listeners get each new job after it is saved"""
+        created = []
+        data_store.add_job_listener(lambda job: created.append(data_store.get_job(job['job_id'])))
+
+        job_id = data_store.create_job({'work_type': 'Pruning'})
+
+        assert [job['job_id'] for job in created] == [job_id]
+
+    def test_job_listener_waits_for_commit(self, data_store, temp_data_dir):
+        """Test that jobs created in a transaction reach listeners after commit, or never"""
+        created = []
+        data_store.add_job_listener(lambda job: created.append(DataStore(data_dir=temp_data_dir).get_job(job['job_id'])))
+
+        with data_store.transaction():
+            job_id = data_store.create_job({'work_type': 'Pruning'})
+            assert created == []
+        assert [job['job_id'] for job in created] == [job_id]
+
+        with pytest.raises(RuntimeError):
+            with data_store.transaction():
+                data_store.create_job({'work_type': 'Planting'})
+                raise RuntimeError('rolled back')
+        assert len(created) == 1
+
+
+class TestJobChanges:
+    """Test the jobs version used by recommendation caches"""
+
+    def test_created_since(self, data_store):
+        """Test listing jobs created since a version"""
+        version, created = data_store.job_changes()
+        assert created is None
+
+        first = data_store.create_job({'work_type': 'Pruning'})
+        second = data_store.create_job({'work_type': 'Planting'})
+        later, created = data_store.job_changes(version)
+        assert created == [first, second]
+        assert data_store.job_changes(later) == (later, [])
+
+    def test_created_in_transaction(self, data_store):
+        """Test that jobs created in a transaction are listed once it commits"""
+        version, _ = data_store.job_changes()
+
+        with data_store.transaction():
+            job_id = data_store.create_job({'work_type': 'Pruning'})
+            data_store.create_match(job_id, 'whatsapp:+15555551234')
+
+        assert data_store.job_changes(version)[1] == [job_id]
+
+    def test_other_changes_need_rebuild(self, data_store):
+        """Test that closing a job invalidates older versions"""
+        job_id = data_store.create_job({'work_type': 'Pruning'})
+        version, _ = data_store.job_changes()
+
+        data_store.update_job_status(job_id, 'closed')
+
+        assert data_store.job_changes(version)[1] is None
+
+    def test_archive_keeps_version(self, data_store):
+        """Test that archiving closed jobs doesn't invalidate"""
+        job_id = data_store.create_job({'work_type': 'Pruning'})
+        data_store.update_job_status(job_id, 'closed')
+        version, _ = data_store.job_changes()
+
+        assert data_store.archive_jobs() == 1
+        assert data_store.job_changes(version) == (version, [])
+
+    def test_write_from_other_store(self, temp_data_dir):
+        """Test that another process's writes invalidate"""
+        store = DataStore(data_dir=temp_data_dir)
+        other = DataStore(data_dir=temp_data_dir)
+        version, _ = store.job_changes()
+
+        other.create_job({'work_type': 'Pruning'})
+
+        assert store.job_changes(version)[1] is None
@@ -0,0 +1,85 @@
+"""
+Unit tests for offline geocoding and grid cells
+"""
+import pytest
+from gazetteer import Gazetteer, add_coordinates, cells_within, geocode, grid_cell
+from matching import distance_miles
+
+CHAPEL_HILL = (35.9132, -79.0558)
+
+
+class TestGeocode:
+    """Test turning free-text locations into coordinates"""
+
+    @pytest.mark.parametrize('location', [
+        'Chapel Hill, NC', 'chapel hill nc', '  CHAPEL HILL ,  N.C. ', 'Chapel Hill, North Carolina',
+        '27514', 'Chapel Hill, NC 27514', 'Chapel Hill',
+    ])
+    def test_spellings(self, location):
+        """Test that the usual ways of writing a place find it"""
+        assert geocode(location) == CHAPEL_HILL
+
+    def test_place_within_location(self):
+        """Test a farm name in front of the town"""
+        assert geocode('Green Valley Farm, Sacramento') == geocode('Sacramento, CA')
+
+    @pytest.mark.parametrize('location', ['Springfield, IL', 'Berry Farm, CA', '', None, 12345])
+    def test_unknown(self, location):
+        """Test that places outside the gazetteer give None"""
+        assert geocode(location) is None
+
+    @pytest.mark.parametrize('location', ['27516', 'Chapel Hill 27516', 'Chapel Hill, NC 27517'])
+    def test_every_zip_of_a_city(self, location):
+        """Test ZIP codes other than the one a city is listed under"""
+        point = geocode(location)
+
+        assert point is not None
+        assert distance_miles(point, CHAPEL_HILL) < 5
+
+    def test_city_with_many_zips(self, tmp_path):
+        """Test that a city's own coordinates come from its first row"""
+        path = tmp_path / 'gazetteer.csv'
+        path.write_text('city,state,zip,latitude,longitude\n'
+                        'Salem,OR,97301,44.9429,-123.0351\n'
+                        'Salem,OR,97302,44.9030,-123.0640\n')
+        gazetteer = Gazetteer(str(path))
+
+        assert gazetteer.geocode('Salem') == (44.9429, -123.0351)
+        assert gazetteer.geocode('97302') == (44.9030, -123.0640)
+
+    def test_ambiguous_city_needs_state(self, tmp_path):
+        """Test that a city name shared by two states is not guessed"""
+        path = tmp_path / 'gazetteer.csv'
+        path.write_text('city,state,zip,latitude,longitude\n'
+                        'Salem,OR,97301,44.9429,-123.0351\n'
+                        'Salem,MA,,42.5195,-70.8967\n')
+        gazetteer = Gazetteer(str(path))
+
+        assert gazetteer.geocode('Salem') is None
+        assert gazetteer.geocode('Salem, MA') == (42.5195, -70.8967)
+
+    def test_add_coordinates(self):
+        """Test storing and clearing coordinates on a record"""
+        record = {'location': 'Durham, NC'}
+        add_coordinates(record)
+        assert (record['latitude'], record['longitude']) == geocode('Durham, NC')
+
+        record['location'] = 'Somewhere else'
+        add_coordinates(record)
+        assert 'latitude' not in record and 'longitude' not in record
+
+
+class TestGridCells:
+    """Test the cells used by the spatial index"""
+
+    def test_cells_cover_radius(self):
+        """Test that every gazetteer place within range lies in a returned cell"""
+        gazetteer = Gazetteer()
+        cells = set(cells_within(CHAPEL_HILL, 50))
+        for point in gazetteer.by_city_state.values():
+            if distance_miles(CHAPEL_HILL, point) <= 50:
+                assert grid_cell({'latitude': point[0], 'longitude': point[1]}) in cells
+
+    def test_no_coordinates(self):
+        """Test that records without coordinates have no cell"""
+        assert grid_cell({'location': 'Chapel Hill, NC'}) is None
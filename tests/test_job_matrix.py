@@ -0,0 +1,171 @@
+"""
+Unit tests for the NumPy job matrix used by rule-based matching
+"""
+import heapq
+import os
+import random
+from datetime import datetime, timedelta
+
+import pytest
+
+pytest.importorskip('numpy')
+
+from data_store import DataStore
+from job_matrix import JobMatrix
+from matching import JobFilter, hourly_rate
+from sqlite_store import SQLiteDataStore
+
+WORK_TYPES = ['Tomato Harvesting', 'Strawberry Picking', 'Pruning', 'Irrigation', 'General Farm Labor', '']
+LOCATIONS = ['Durham, NC', 'Raleigh, NC', 'Charlotte, NC', 'Fresno, CA', 'Salinas, CA', 'Back forty']
+HOURS = ['full-time', 'part-time', 'flexible', 'seasonal', '6am-2pm', None]
+
+
+def random_job(rng, store):
+    """Create a job with random pay, type, hours and place"""
+    job = {'work_type': rng.choice(WORK_TYPES), 'location': rng.choice(LOCATIONS), 'hours': rng.choice(HOURS)}
+    pay = rng.choice(['hour', 'day', 'rate'])
+    if pay == 'hour':
+        job.update(payment_type='per hour', payment_amount=rng.randint(10, 25))
+    elif pay == 'day':
+        job.update(payment_type='per day', payment_amount=rng.randint(80, 200))
+    else:
+        job['pay_rate'] = rng.choice([12.0, 15.0, 18.0, 20.0])
+    return store.create_job(job)
+
+
+def random_prefs(rng):
+    """Random farmer preferences in the shape registration saves them"""
+    return {
+        'work_types': rng.choice(['Harvesting', 'Pruning, Irrigation', 'All types of work', 'Picking', '']),
+        'min_pay_rate': rng.choice([None, 12, 15, 18]),
+        'hours_preference': rng.choice(['full-time', 'part-time', 'flexible', None]),
+        'location': rng.choice(['Durham, NC', 'Fresno, CA', 'Nowhere']),
+        'max_distance': rng.choice([10, 50, 999, None]),
+    }
+
+
+def filtered_top(jobs, prefs):
+    """The per-job filter and heap that the matrix replaces"""
+    return heapq.nlargest(5, filter(JobFilter(prefs), jobs), key=hourly_rate)
+
+
+class TestJobMatrix:
+    """Test that the matrix picks the same jobs as the per-job filter"""
+
+    def test_same_as_filter(self, tmp_path):
+        """Test random preferences against random jobs"""
+        rng = random.Random(7)
+        store = DataStore(data_dir=str(tmp_path))
+        for _ in range(200):
+            random_job(rng, store)
+        jobs = store.get_open_jobs()
+        matrix = JobMatrix(jobs)
+
+        for _ in range(100):
+            prefs = random_prefs(rng)
+            assert matrix.top(JobFilter(prefs), 5) == filtered_top(jobs, prefs)
+
+    def test_equal_pay_keeps_job_order(self):
+        """Test that ties on pay go to the earlier job"""
+        jobs = [{'job_id': str(i), 'pay_rate': 15.0} for i in range(8)]
+
+        top = JobMatrix(jobs).top(JobFilter({}), 3)
+
+        assert [job['job_id'] for job in top] == ['0', '1', '2']
+
+    def test_expired_jobs_skipped(self):
+        """Test that jobs expire at query time, not build time"""
+        now = datetime.now()
+        jobs = [
+            {'job_id': 'old', 'pay_rate': 20.0, 'expires_at': (now - timedelta(hours=1)).isoformat()},
+            {'job_id': 'new', 'pay_rate': 15.0, 'expires_at': (now + timedelta(hours=1)).isoformat()},
+            {'job_id': 'none', 'pay_rate': 10.0},
+        ]
+        matrix = JobMatrix(jobs)
+
+        assert [job['job_id'] for job in matrix.top(JobFilter({}), 5, now)] == ['new', 'none']
+        later = now + timedelta(hours=2)
+        assert [job['job_id'] for job in matrix.top(JobFilter({}), 5, later)] == ['none']
+
+    def test_scores(self):
+        """Test the per-check columns for one farmer"""
+        jobs = [
+            {'work_type': 'Pruning', 'pay_rate': 12.0, 'latitude': 35.994, 'longitude': -78.8986},
+            {'work_type': 'Tomato Harvesting', 'pay_rate': 18.0},
+        ]
+        prefs = {'work_types': 'Harvesting', 'min_pay_rate': 15, 'latitude': 35.994, 'longitude': -78.8986,
+                 'max_distance': 10}
+
+        scores = JobMatrix(jobs).scores(JobFilter(prefs))
+
+        assert scores['type'].tolist() == [False, True]
+        assert scores['pay'].tolist() == [False, True]
+        assert scores['distance'].tolist() == [True, True]
+        assert scores['miles'][0] == pytest.approx(0)
+
+    def test_empty(self):
+        """Test a matrix with no jobs"""
+        assert JobMatrix([]).top(JobFilter({'work_types': 'Harvesting'}), 5) == []
+
+
+class TestStoreJobMatrix:
+    """Test that the stores keep their job matrix in step with the jobs"""
+
+    def test_cached_matrix_rebuilt_after_write(self, tmp_path):
+        """Test that the cached matrix is reused until the jobs change"""
+        store = DataStore(data_dir=str(tmp_path), cache=True)
+        first = store.create_job({'work_type': 'Pruning', 'pay_rate': 15.0})
+        matrix = store.job_matrix()
+        assert store.job_matrix() is matrix
+
+        second = store.create_job({'work_type': 'Pruning', 'pay_rate': 20.0})
+        top = store.job_matrix().top(JobFilter({}), 5)
+        assert [job['job_id'] for job in top] == [second, first]
+
+        store.update_job_status(second, 'closed')
+        assert [job['job_id'] for job in store.job_matrix().top(JobFilter({}), 5)] == [first]
+
+    def test_matrix_only_when_kept(self, tmp_path):
+        """Test that stores which can't keep the matrix leave matching to the index path"""
+        assert DataStore(data_dir=str(tmp_path)).job_matrix() is None
+
+        store = DataStore(data_dir=str(tmp_path), cache=True)
+        store.create_job({'work_type': 'Pruning', 'pay_rate': 15.0})
+        matrix = store.job_matrix()
+        with store.transaction():
+            assert store.job_matrix() is matrix
+            store.create_job({'work_type': 'Pruning', 'pay_rate': 20.0})
+            assert store.job_matrix() is None
+        assert len(store.job_matrix().top(JobFilter({}), 5)) == 2
+
+    def test_sqlite_matrix_rebuilt_after_write(self, tmp_path):
+        """Test the SQLite store's matrix, including writes from another connection"""
+        db_path = os.path.join(str(tmp_path), 'farmconnect.db')
+        store = SQLiteDataStore(db_path)
+        first = store.create_job({'work_type': 'Pruning', 'pay_rate': 15.0})
+        matrix = store.job_matrix()
+        assert store.job_matrix() is matrix
+
+        other = SQLiteDataStore(db_path)
+        second = other.create_job({'work_type': 'Pruning', 'pay_rate': 20.0})
+        top = store.job_matrix().top(JobFilter({}), 5)
+        assert [job['job_id'] for job in top] == [second, first]
+
+        store.update_job_status(second, 'closed')
+        assert [job['job_id'] for job in store.job_matrix().top(JobFilter({}), 5)] == [first]
+        other.close()
+        store.close()
+
+    def test_same_as_index_path(self, tmp_path):
+        """Test that the matrix agrees with the store's filtered open jobs"""
+        rng = random.Random(11)
+        store = DataStore(data_dir=str(tmp_path), cache=True)
+        for _ in range(100):
+            random_job(rng, store)
+
+        for _ in range(50):
+            prefs = random_prefs(rng)
+            job_filter = JobFilter(prefs)
+            matched = store.iter_open_jobs(work_type=job_filter.work_type, min_rate=job_filter.min_rate,
+                                           hours=job_filter.hours, within=job_filter.within)
+            assert store.job_matrix().top(job_filter, 5) == heapq.nlargest(5, matched, key=hourly_rate)
@@ -0,0 +1,214 @@
+"""
+Unit tests for the rule-based matching helpers
+"""
+import heapq
+import time
+from datetime import datetime, timedelta
+
+import pytest
+from matching import (HoursFilter, JobFilter, RecommendationCache, WorkTypeFilter, distance_miles,
+                      effective_hourly_rate, hourly_rate, parse_work_types)
+
+
+def old_type_match(pref_types, job_type):
+    """The per-job check _rule_based_match used before the work-type index"""
+    pref_types = pref_types.lower()
+    job_type = job_type.lower()
+    if 'all types of work' in pref_types:
+        return True
+    if pref_types:
+        for pref_type in pref_types.split(','):
+            pref_type = pref_type.strip()
+            if pref_type in job_type or job_type in pref_type:
+                return True
+        return False
+    return True
+
+
+class TestWorkTypeFilter:
+    """Test that the work-type filter keeps the old matching rules"""
+
+    @pytest.mark.parametrize('pref_types', [
+        'Harvesting', 'harvest', 'Tomato Harvesting, Pruning', 'All types of work', 'All types of work, Pruning',
+        '', 'Harvesting,', 'Irrigation, Planting', 'Strawberry Picking',
+    ])
+    @pytest.mark.parametrize('job_type', [
+        'Tomato Harvesting', 'Harvest', 'Pruning', 'Irrigation', 'Strawberry Picking', 'General Farm Labor', '',
+    ])
+    def test_same_as_old_check(self, pref_types, job_type):
+        """Test every preference/job pair against the old loop"""
+        assert WorkTypeFilter(pref_types)(job_type) == old_type_match(pref_types, job_type)
+
+    def test_checks_each_value_once(self):
+        """Test that repeated work types are answered from the memo"""
+        work_type = WorkTypeFilter('Harvesting')
+        for job_type in ['Tomato Harvesting', 'Pruning', 'Tomato Harvesting', 'Pruning']:
+            work_type(job_type)
+
+        assert work_type._seen == {'Tomato Harvesting': True, 'Pruning': False}
+
+    def test_missing_work_type(self):
+        """Test that a job without a work type is treated as an empty one"""
+        assert WorkTypeFilter('Harvesting')(None) == old_type_match('Harvesting', '')
+
+    def test_parse_work_types(self):
+        """Test splitting a farmer's preferences"""
+        assert parse_work_types('Harvesting, Pruning') == ['harvesting', 'pruning']
+        assert parse_work_types('All types of work') is None
+        assert parse_work_types(None) is None
+
+
+class TestPayRates:
+    """Test normalizing job pay to an hourly rate"""
+
+    @pytest.mark.parametrize('job, expected', [
+        ({'payment_type': 'per day', 'payment_amount': 150.0}, 18.75),
+        ({'payment_type': 'per hour', 'payment_amount': 17.0}, 17.0),
+        ({'payment_type': 'per task', 'payment_amount': 2.0, 'pay_rate': 14.0}, 14.0),
+        ({'pay_rate': 15.5}, 15.5),
+        ({}, 0),
+    ])
+    def test_effective_hourly_rate(self, job, expected):
+        """Test each way an owner can give the pay"""
+        assert effective_hourly_rate(job) == expected
+
+    def test_stored_rate_preferred(self):
+        """Test that the rate saved with a job is used as is"""
+        assert hourly_rate({'pay_rate': 15.0, 'effective_hourly_rate': 20.0}) == 20.0
+        assert hourly_rate({'pay_rate': 15.0}) == 15.0
+
+
+class TestHoursFilter:
+    """Test matching job schedules to a worker's hours preference"""
+
+    @pytest.mark.parametrize('preference, hours, expected', [
+        ('full-time', 'full-time', True),
+        ('full-time', 'part-time', False),
+        ('full-time', 'seasonal', True),
+        ('part-time', 'full-time', False),
+        ('part-time', 'Flexible', True),
+        ('part-time', 'seasonal', False),
+        ('flexible', 'part-time', True),
+        ('full-time', '6:00 AM - 2:00 PM', True),
+        ('part-time', None, True),
+        (None, 'part-time', True),
+    ])
+    def test_hours(self, preference, hours, expected):
+        """Test each preference against each kind of schedule"""
+        assert HoursFilter(preference)(hours) == expected
+
+
+class TestJobFilter:
+    """Test the combined rule-based checks"""
+
+    def test_min_pay_rate(self):
+        """Test that jobs paying less than the minimum are dropped"""
+        job_filter = JobFilter({'min_pay_rate': 16.0})
+
+        assert job_filter({'pay_rate': 16.0})
+        assert not job_filter({'pay_rate': 15.0})
+        assert job_filter({'payment_type': 'per day', 'payment_amount': 160.0})
+
+    def test_distance(self):
+        """Test that distance applies only when both sides have coordinates"""
+        raleigh = {'latitude': 35.7796, 'longitude': -78.6382}
+        durham = {'latitude': 35.9940, 'longitude': -78.8986}
+        charlotte = {'latitude': 35.2271, 'longitude': -80.8431}
+        job_filter = JobFilter(dict(raleigh, max_distance=25))
+
+        assert job_filter(durham)
+        assert not job_filter(charlotte)
+        assert job_filter({'location': 'Somewhere, NC'})
+        assert JobFilter(dict(raleigh, max_distance=999))(charlotte)
+        assert JobFilter({'max_distance': 10})(charlotte)
+
+    def test_distance_miles(self):
+        """Test the great-circle distance"""
+        assert distance_miles((35.7796, -78.6382), (35.2271, -80.8431)) == pytest.approx(130, abs=3)
+
+    def test_everything_together(self):
+        """Test a full profile"""
+        job_filter = JobFilter({'work_types': 'Harvesting', 'min_pay_rate': 15, 'hours_preference': 'part-time'})
+
+        assert job_filter({'work_type': 'Tomato Harvesting', 'pay_rate': 16.0, 'hours': 'part-time'})
+        assert not job_filter({'work_type': 'Tomato Harvesting', 'pay_rate': 16.0, 'hours': 'full-time'})
+        assert not job_filter({'work_type': 'Pruning', 'pay_rate': 16.0, 'hours': 'part-time'})
+
+
+class TestRecommendationCache:
+    """Test the per-farmer cache of top matches"""
+
+    @pytest.fixture
+    def store(self, tmp_path):
+        from data_store import DataStore
+        return DataStore(data_dir=str(tmp_path), cache=True)
+
+    @staticmethod
+    def full_match(store):
+        """The uncached search: every open job through the filter"""
+        return lambda prefs: heapq.nlargest(5, filter(JobFilter(prefs), store.get_open_jobs()), key=hourly_rate)
+
+    def test_same_as_full_match(self, store):
+        """Test random posts, closes and preference changes against a fresh search"""
+        import random
+        rng = random.Random(5)
+        cache = RecommendationCache()
+        prefs = {'work_types': 'Harvesting', 'min_pay_rate': 12}
+        job_ids = []
+        for _ in range(200):
+            action = rng.random()
+            if action < 0.6:
+                job_ids.append(store.create_job({'work_type': rng.choice(['Tomato Harvesting', 'Pruning']),
+                                                 'pay_rate': float(rng.randint(10, 25))}))
+            elif action < 0.75 and job_ids:
+                store.update_job_status(rng.choice(job_ids), 'closed')
+            elif action < 0.85:
+                prefs = dict(prefs, min_pay_rate=rng.choice([None, 12, 15, 20]))
+            assert cache.top(store, 'whatsapp:+15555551234', prefs, self.full_match(store)) == \
+                self.full_match(store)(prefs)
+
+    def test_new_jobs_merged_without_full_search(self, store, mocker):
+        """Test that posting a job doesn't rerun the full search"""
+        cache = RecommendationCache()
+        prefs = {'work_types': 'Pruning'}
+        store.create_job({'work_type': 'Pruning', 'pay_rate': 15.0})
+        match = mocker.Mock(side_effect=self.full_match(store))
+        cache.top(store, 'whatsapp:+15555551234', prefs, match)
+
+        best = store.create_job({'work_type': 'Pruning', 'pay_rate': 20.0})
+        store.create_job({'work_type': 'Planting', 'pay_rate': 30.0})
+        top = cache.top(store, 'whatsapp:+15555551234', prefs, match)
+
+        assert match.call_count == 1
+        assert top[0]['job_id'] == best
+        assert len(top) == 2
+
+    def test_preference_changes(self, store, mocker):
+        """Test that only preference fields invalidate a farmer's entry"""
+        cache = RecommendationCache()
+        match = mocker.Mock(return_value=[])
+        cache.top(store, 'whatsapp:+15555551234', {'name': 'John', 'work_types': 'Pruning'}, match)
+
+        cache.top(store, 'whatsapp:+15555551234', {'name': 'Johnny', 'work_types': 'Pruning'}, match)
+        assert match.call_count == 1
+
+        cache.top(store, 'whatsapp:+15555551234', {'name': 'Johnny', 'work_types': 'Planting'}, match)
+        assert match.call_count == 2
+
+    def test_expired_match_rebuilds(self, store):
+        """Test that a cached job that has since expired is dropped"""
+        cache = RecommendationCache()
+        expires_at = (datetime.now() + timedelta(seconds=0.2)).isoformat()
+        store.create_job({'work_type': 'Pruning', 'pay_rate': 15.0, 'expires_at': expires_at})
+        assert len(cache.top(store, 'whatsapp:+15555551234', {}, self.full_match(store))) == 1
+
+        time.sleep(0.3)
+        assert cache.top(store, 'whatsapp:+15555551234', {}, self.full_match(store)) == []
+
+    def test_least_recently_used_evicted(self, store):
+        """Test the bound on cached farmers"""
+        cache = RecommendationCache(max_entries=2)
+        for phone in ['a', 'b', 'a', 'c']:
+            cache.top(store, phone, {}, lambda prefs: [])
+
+        assert list(cache._entries) == ['a', 'c']
@@ -0,0 +1,453 @@
+"""
+Unit tests for SQLiteDataStore
+Checks that the SQLite backend behaves like the JSON DataStore
+"""
+import pytest
+import tempfile
+import shutil
+import os
+import sqlite3
+import threading
+from datetime import datetime, timedelta
+from unittest.mock import MagicMock
+from chatbot_multilingual import MultilingualFarmConnectBot
+from matching import HoursFilter, WorkTypeFilter
+from sqlite_store import SQLiteDataStore
+
+
+@pytest.fixture
+def temp_data_dir():
+    """Create a temporary data directory for testing"""
+    temp_dir = tempfile.mkdtemp()
+    yield temp_dir
+    shutil.rmtree(temp_dir)
+
+
+@pytest.fixture
+def sqlite_store(temp_data_dir):
+    """Create a SQLiteDataStore in a temporary directory"""
+    store = SQLiteDataStore(os.path.join(temp_data_dir, 'farmconnect.db'))
+    yield store
+    store.close()
+
+
+def make_job(**overrides):
+    job_data = {
+        'work_type': 'Tomato Harvest',
+        'pay_rate': 18.00,
+        'location': 'Chapel Hill, NC',
+        'hours': 'full-time',
+        'workers_needed': 5,
+        'owner_phone': 'whatsapp:+15555550001'
+    }
+    job_data.update(overrides)
+    return job_data
+
+
+class TestSQLiteUsers:
+    """Test user management"""
+
+    def test_create_and_get_user(self, sqlite_store):
+        """Test creating and retrieving a user"""
+        phone = "whatsapp:+15555551234"
+        user = sqlite_store.create_user(phone, 'farmer')
+
+        assert user['registered'] == False
+        assert sqlite_store.get_user(phone)['type'] == 'farmer'
+        assert sqlite_store.get_user("whatsapp:+19999999999") is None
+
+    def test_update_user_and_profile(self, sqlite_store):
+        """Test updating user fields and profile"""
+        phone = "whatsapp:+15555551234"
+        sqlite_store.create_user(phone, 'farmer')
+
+        sqlite_store.update_user(phone, {'registered': True})
+        assert sqlite_store.update_user_profile(phone, {'name': 'John Doe'}) == True
+        assert sqlite_store.update_user_profile("whatsapp:+19999999999", {'name': 'X'}) == False
+
+        user = sqlite_store.get_user(phone)
+        assert user['registered'] == True
+        assert user['profile']['name'] == 'John Doe'
+
+
+class TestSQLiteJobsAndMatches:
+    """Test jobs and matches"""
+
+    def test_open_jobs_keep_creation_order(self, sqlite_store):
+        """Test that open jobs are listed in creation order, even after updates"""
+        first = sqlite_store.create_job(make_job(work_type='First'))
+        second = sqlite_store.create_job(make_job(work_type='Second'))
+        closed = sqlite_store.create_job(make_job(work_type='Closed'))
+
+        sqlite_store.update_job(first, {'workers_needed': 2})
+        sqlite_store.update_job_status(closed, 'filled')
+
+        open_jobs = sqlite_store.get_open_jobs()
+        assert [j['job_id'] for j in open_jobs] == [first, second]
+        assert open_jobs[0]['workers_needed'] == 2
+        assert [j['job_id'] for j in sqlite_store.iter_open_jobs()] == [first, second]
+        assert sqlite_store.get_job(closed)['status'] == 'filled'
+
+    def test_get_jobs_by_owner(self, sqlite_store):
+        """Test looking up jobs by owner"""
+        mine = sqlite_store.create_job(make_job())
+        sqlite_store.create_job(make_job(owner_phone='whatsapp:+15555550002'))
+
+        assert [j['job_id'] for j in sqlite_store.get_jobs_by_owner('whatsapp:+15555550001')] == [mine]
+
+    def test_matches_by_job_and_farmer(self, sqlite_store):
+        """Test retrieving matches for a job and for a farmer"""
+        job_id = sqlite_store.create_job(make_job())
+        farmer = 'whatsapp:+15555551234'
+        match_id = sqlite_store.create_match(job_id, farmer, 'accepted')
+        sqlite_store.create_match(job_id, 'whatsapp:+15555555678', 'accepted')
+
+        assert match_id.startswith('MATCH_')
+        assert len(sqlite_store.get_job_matches(job_id)) == 2
+        assert sqlite_store.count_job_matches(job_id) == 2
+        assert [m['match_id'] for m in sqlite_store.get_farmer_matches(farmer)] == [match_id]
+
+        sqlite_store.update_match(match_id, {'status': 'hired'})
+        assert sqlite_store.get_farmer_matches(farmer)[0]['status'] == 'hired'
+
+    def test_lookups_use_indexes(self, sqlite_store):
+        """Test that the hot lookups are served by an index"""
+        conn = sqlite3.connect(sqlite_store.db_path)
+        plans = [
+            "SELECT data FROM jobs WHERE status = 'open'",
+            "SELECT data FROM jobs WHERE owner_phone = 'x'",
+            "SELECT data FROM matches WHERE job_id = 'x'",
+            "SELECT data FROM matches WHERE farmer_phone = 'x'",
+        ]
+        for sql in plans:
+            plan = ' '.join(row[-1] for row in conn.execute('EXPLAIN QUERY PLAN ' + sql))
+            assert 'USING INDEX' in plan
+        conn.close()
+
+
+class TestSQLiteFieldProjection:
+    """Test loading only some fields of each job"""
+
+    def test_open_jobs_with_fields(self, sqlite_store):
+        """Test that projected jobs hold only the requested fields"""
+        job_id = sqlite_store.create_job(make_job(description='x' * 1000))
+        sqlite_store.create_job(make_job(expires_at='2020-01-01'))
+
+        assert list(sqlite_store.iter_open_jobs(fields=['work_type', 'pay_rate'])) == [
+            {'job_id': job_id, 'work_type': 'Tomato Harvest', 'pay_rate': 18.0}
+        ]
+
+    def test_jobs_by_owner_with_fields(self, sqlite_store):
+        """Test projecting an owner's jobs"""
+        job_id = sqlite_store.create_job(make_job())
+
+        assert sqlite_store.get_jobs_by_owner(make_job()['owner_phone'], fields=['status']) == [
+            {'job_id': job_id, 'status': 'open'}
+        ]
+
+
+class TestSQLiteWorkTypeFilter:
+    """Test filtering open jobs by work type"""
+
+    def test_filter_open_jobs(self, sqlite_store):
+        """Test that only matching work types come back, including jobs without one"""
+        tomato = sqlite_store.create_job(make_job(work_type='Tomato Harvesting'))
+        sqlite_store.create_job(make_job(work_type='Irrigation'))
+        untyped = sqlite_store.create_job({'pay_rate': 15.0})
+
+        jobs = sqlite_store.get_open_jobs(work_type=WorkTypeFilter('Harvesting'))
+
+        assert [job['job_id'] for job in jobs] == [tomato, untyped]
+        assert sqlite_store.get_open_jobs(work_type=WorkTypeFilter('Pruning')) == [sqlite_store.get_job(untyped)]
+
+
+class TestSQLiteEffectiveHourlyRate:
+    """Test the hourly rate stored with each job"""
+
+    def test_set_on_create_and_update(self, sqlite_store):
+        """Test that the rate follows the job's pay"""
+        job_id = sqlite_store.create_job(make_job(payment_type='per day', payment_amount=160.0))
+        assert sqlite_store.get_job(job_id)['effective_hourly_rate'] == 20.0
+
+        sqlite_store.update_job(job_id, {'payment_type': 'per hour', 'payment_amount': 21.0})
+        assert sqlite_store.get_job(job_id)['effective_hourly_rate'] == 21.0
+
+
+class TestSQLiteOpenJobFilters:
+    """Test filtering open jobs by pay and hours"""
+
+    def test_min_rate_and_hours(self, sqlite_store):
+        """Test the pay cutoff together with the hours filter"""
+        low = sqlite_store.create_job(make_job(pay_rate=14.0))
+        daily = sqlite_store.create_job(make_job(payment_type='per day', payment_amount=160.0))
+        sqlite_store.create_job(make_job(pay_rate=25.0, hours='part-time'))
+
+        jobs = sqlite_store.get_open_jobs(min_rate=16.0, hours=HoursFilter('full-time'))
+        assert [job['job_id'] for job in jobs] == [daily]
+
+        listed = sqlite_store.get_open_jobs(fields=['pay_rate'], min_rate=10.0, hours=HoursFilter('full-time'))
+        assert listed == [{'job_id': low, 'pay_rate': 14.0}, {'job_id': daily, 'pay_rate': 18.0}]
+
+
+class TestSQLiteLocation:
+    """Test geocoding at write time and distance filtering"""
+
+    def test_jobs_within(self, sqlite_store):
+        """Test that only nearby jobs and jobs without coordinates come back"""
+        durham = sqlite_store.create_job(make_job(location='Durham, NC'))
+        sqlite_store.create_job(make_job(location='Charlotte, NC'))
+        unknown = sqlite_store.create_job(make_job(location='Back forty'))
+
+        assert sqlite_store.get_job(durham)['latitude'] == pytest.approx(35.994)
+        jobs = sqlite_store.get_open_jobs(within=(35.9132, -79.0558, 25))
+        assert [job['job_id'] for job in jobs] == [durham, unknown]
+
+    def test_profile_coordinates(self, sqlite_store):
+        """Test that a farmer's location is geocoded when saved"""
+        sqlite_store.create_user('whatsapp:+15555551234', 'farmer')
+        sqlite_store.update_user_profile('whatsapp:+15555551234', {'location': 'Chapel Hill, NC'})
+
+        assert sqlite_store.get_user('whatsapp:+15555551234')['profile']['latitude'] == pytest.approx(35.9132)
+
+
+class TestSQLiteJobArchive:
+    """Test job expiry and archival"""
+
+    def test_archive_and_fall_through(self, sqlite_store):
+        """Test that archived jobs and matches are still found by ID"""
+        expired = sqlite_store.create_job(make_job(expires_at='2020-08-31'))
+        active = sqlite_store.create_job(make_job())
+        sqlite_store.create_match(expired, 'whatsapp:+15555551234')
+
+        assert [job['job_id'] for job in sqlite_store.get_open_jobs()] == [active]
+        assert sqlite_store.archive_jobs() == 1
+
+        assert sqlite_store.get_job(expired)['status'] == 'expired'
+        assert len(sqlite_store.get_job_matches(expired)) == 1
+        assert sqlite_store.get_farmer_matches('whatsapp:+15555551234') == []
+        assert len(sqlite_store.get_farmer_matches('whatsapp:+15555551234', include_archived=True)) == 1
+
+    def test_owner_history_includes_archive(self, sqlite_store):
+        """Test that an owner still sees archived jobs and their application counts"""
+        expired = sqlite_store.create_job(make_job(owner_phone='whatsapp:+15555550000', expires_at='2020-08-31'))
+        active = sqlite_store.create_job(make_job(owner_phone='whatsapp:+15555550000'))
+        sqlite_store.create_match(expired, 'whatsapp:+15555551234')
+        sqlite_store.archive_jobs()
+
+        assert [job['job_id'] for job in sqlite_store.get_jobs_by_owner('whatsapp:+15555550000')] == [active]
+        owner_jobs = sqlite_store.get_jobs_by_owner('whatsapp:+15555550000', include_archived=True)
+        assert [job['job_id'] for job in owner_jobs] == [active, expired]
+        assert sqlite_store.count_job_matches(expired) == 1
+
+
+class TestSQLiteConversationState:
+    """Test conversation state management"""
+
+    def test_set_get_clear(self, sqlite_store):
+        """Test the conversation state lifecycle"""
+        phone = "whatsapp:+15555551234"
+        sqlite_store.set_conversation_state(phone, 'job_posting', {'step': 1})
+
+        state = sqlite_store.get_conversation_state(phone)
+        assert state['state'] == 'job_posting'
+        assert state['data'] == {'step': 1}
+
+        sqlite_store.clear_conversation_state(phone)
+        assert sqlite_store.get_conversation_state(phone) is None
+
+    def test_sweep_expired_states(self, temp_data_dir):
+        """Test that the sweeper deletes only expired states"""
+        store = SQLiteDataStore(os.path.join(temp_data_dir, 'farmconnect.db'),
+                                conversation_ttl=3600, state_ttls={'main_menu': None})
+        store.set_conversation_state('whatsapp:+15555551234', 'chatting')
+        store.set_conversation_state('whatsapp:+15555555678', 'main_menu')
+
+        assert store.sweep_conversations() == 0
+        removed = store.sweep_conversations(now=datetime.now() + timedelta(hours=2))
+
+        assert removed == 1
+        assert store.get_conversation_state('whatsapp:+15555555678')['state'] == 'main_menu'
+        store.close()
+
+
+class TestSQLiteTransaction:
+    """Test grouping writes with transaction()"""
+
+    def test_commit_and_rollback(self, sqlite_store):
+        """Test that a block commits on success and rolls back on error"""
+        phone = "whatsapp:+15555551234"
+        with sqlite_store.transaction():
+            sqlite_store.create_user(phone, 'farmer')
+            with sqlite_store.transaction():
+                sqlite_store.set_conversation_state(phone, 'farmer_reg_name')
+
+        with pytest.raises(RuntimeError):
+            with sqlite_store.transaction():
+                sqlite_store.update_user(phone, {'registered': True})
+                raise RuntimeError("handler failed")
+
+        assert sqlite_store.get_user(phone)['registered'] == False
+        assert sqlite_store.get_conversation_state(phone)['state'] == 'farmer_reg_name'
+
+    def test_other_threads_write_until_first_write(self, sqlite_store):
+        """Test that a transaction takes the write lock at its first write, not on entry"""
+        phone = "whatsapp:+15555551234"
+        sqlite_store.create_user(phone, 'farmer')
+        read, written, resume, finish = (threading.Event() for _ in range(4))
+
+        def handle_message():
+            with sqlite_store.transaction():
+                sqlite_store.get_user(phone)
+                read.set()
+                resume.wait(5)
+                sqlite_store.update_user(phone, {'registered': True})
+                written.set()
+                finish.wait(5)
+
+        thread = threading.Thread(target=handle_message)
+        thread.start()
+        assert read.wait(5)
+        sqlite_store.set_conversation_state(phone, 'farmer_reg_name')
+        assert not written.is_set()
+        resume.set()
+
+        assert written.wait(5)
+        assert sqlite_store.get_user(phone)['registered'] == False
+        finish.set()
+        thread.join()
+
+        assert sqlite_store.get_user(phone)['registered'] == True
+        assert sqlite_store.get_conversation_state(phone)['state'] == 'farmer_reg_name'
+
+    def _lock_free(self, sqlite_store):
+        # True if another connection can take the write lock right now
+        conn = sqlite3.connect(sqlite_store.db_path, isolation_level=None, timeout=0.5)
+        try:
+            conn.execute('BEGIN IMMEDIATE')
+            conn.execute('ROLLBACK')
+            return True
+        except sqlite3.OperationalError:
+            return False
+        finally:
+            conn.close()
+
+    def test_bot_sends_after_commit(self, sqlite_store):
+        """Test that a handler's Twilio calls don't hold the write lock"""
+        bot = MultilingualFarmConnectBot(store=sqlite_store)
+        bot.ai_matcher = None
+        farmer = "whatsapp:+15555551234"
+        sqlite_store.create_user(farmer, 'farmer')
+        sqlite_store.update_user(farmer, {'registered': True})
+        job_id = sqlite_store.create_job(make_job())
+        sqlite_store.set_conversation_state(farmer, 'job_details_view', {'job_id': job_id, 'all_jobs': [job_id]})
+        sent = []
+        bot.twilio_client = MagicMock()
+        bot.twilio_client.messages.create.side_effect = lambda **kwargs: sent.append(self._lock_free(sqlite_store))
+
+        bot.handle_message(farmer, "1")
+
+        assert sent == [True]
+        assert len(sqlite_store.get_farmer_matches(farmer)) == 1
+
+    def test_bot_matches_before_writing(self, sqlite_store):
+        """Test that waiting on AI matching doesn't hold the write lock"""
+        bot = MultilingualFarmConnectBot(store=sqlite_store)
+        farmer = "whatsapp:+15555551234"
+        sqlite_store.create_user(farmer, 'farmer')
+        sqlite_store.update_user(farmer, {'registered': True})
+        sqlite_store.set_conversation_state(farmer, 'farmer_pref_hours')
+        matched = []
+        bot.ai_matcher = MagicMock()
+        bot.ai_matcher.match_jobs.side_effect = lambda jobs, prefs: matched.append(self._lock_free(sqlite_store)) or []
+
+        bot.handle_message(farmer, "1")
+
+        assert matched == [True]
+        assert sqlite_store.get_user(farmer)['profile']['hours_preference'] == 'full-time'
+
+
+class TestSQLitePersistence:
+    """Test data persistence across instances"""
+
+    def test_data_persists_across_instances(self, temp_data_dir):
+        """Test that data survives reopening the database"""
+        db_path = os.path.join(temp_data_dir, 'farmconnect.db')
+        store1 = SQLiteDataStore(db_path)
+        store1.create_user("whatsapp:+15555551234", 'farmer')
+        store1.close()
+
+        store2 = SQLiteDataStore(db_path)
+        assert store2.get_user("whatsapp:+15555551234") is not None
+        store2.close()
+
+
+class TestSQLiteReverseMatching:
+    """Test finding the farmers a new job matches"""
+
+    def test_matching_farmers(self, sqlite_store):
+        """Test each preference ruling farmers in or out"""
+        farmers = {
+            'whatsapp:+15555551001': {'work_types': 'Harvest'},
+            'whatsapp:+15555551002': {'work_types': 'Pruning'},
+            'whatsapp:+15555551003': {'min_pay_rate': 20},
+            'whatsapp:+15555551004': {'hours_preference': 'part-time'},
+            'whatsapp:+15555551005': {'location': 'Fresno, CA', 'max_distance': 50},
+            'whatsapp:+15555551006': {'location': 'Durham, NC', 'max_distance': 25},
+        }
+        for phone, profile in farmers.items():
+            sqlite_store.create_user(phone, 'farmer')
+            sqlite_store.update_user(phone, {'registered': True})
+            sqlite_store.update_user_profile(phone, profile)
+        sqlite_store.create_user('whatsapp:+15555551007', 'farmer')
+
+        job = sqlite_store.get_job(sqlite_store.create_job(make_job()))
+
+        assert sqlite_store.find_matching_farmers(job) == ['whatsapp:+15555551001', 'whatsapp:+15555551006']
+
+    def test_job_listener(self, sqlite_store):
+        """Test that listeners get each new job after it is saved"""
+        created = []
+        sqlite_store.add_job_listener(created.append)
+
+        job_id = sqlite_store.create_job(make_job())
+
+        assert [job['job_id'] for job in created] == [job_id]
+
+    def test_job_listener_waits_for_commit(self, sqlite_store):
+        """Test that jobs created in a transaction reach listeners after commit, or never"""
+        created = []
+        sqlite_store.add_job_listener(created.append)
+
+        with sqlite_store.transaction():
+            job_id = sqlite_store.create_job(make_job())
+            assert created == []
+        assert [job['job_id'] for job in created] == [job_id]
+
+        with pytest.raises(RuntimeError):
+            with sqlite_store.transaction():
+                sqlite_store.create_job(make_job())
+                raise RuntimeError('rolled back')
+        assert len(created) == 1
+
+
+class TestSQLiteJobChanges:
+    """Test the jobs version used by recommendation caches"""
+
+    def test_created_and_changed(self, sqlite_store):
+        """Test listing new jobs, and invalidating on other changes"""
+        version, _ = sqlite_store.job_changes()
+        job_id = sqlite_store.create_job(make_job())
+        version, created = sqlite_store.job_changes(version)
+        assert created == [job_id]
+
+        sqlite_store.update_job_status(job_id, 'closed')
+        assert sqlite_store.job_changes(version)[1] is None
+
+    def test_write_from_other_connection(self, sqlite_store):
+        """Test that commits by another connection invalidate"""
+        version, _ = sqlite_store.job_changes()
+        other = SQLiteDataStore(sqlite_store.db_path)
+        other.create_job(make_job())
+        other.close()
+
+        assert sqlite_store.job_changes(version)[1] is None
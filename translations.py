@@ -102,6 +102,7 @@ Reply with the number of your choice""",
         'profile_complete': '✅ *Profile Complete!*',
         'found_jobs': 'We found {count} job match(es) for you!\n(Sorted by highest pay)',
         'no_jobs': "No job matches found right now. We'll notify you when new jobs matching your preferences are posted.",
+        'new_job_alert': "🔔 *New job matching your preferences!*\n\n*{work_type}*\n🏡 {farm_name}\n💰 {pay}\n📍 {location}\n\nType 'menu' and choose 1 to browse jobs.",
         'select_job': '*Select a job to view details and apply:*\n\nReply with the job number (1-{max}) or type \'menu\' to return to main menu.',
 
         'application_submitted': '✅ *Application Submitted!*',
@@ -219,6 +220,7 @@ Responda con el número de su elección""",
         'profile_complete': '✅ *¡Perfil Completo!*',
         'found_jobs': '¡Encontramos {count} trabajo(s) que coinciden para usted!\n(Ordenados por mejor salario)',
         'no_jobs': "No se encontraron trabajos en este momento. Le notificaremos cuando haya nuevos trabajos que coincidan con sus preferencias.",
+        'new_job_alert': "🔔 *¡Nuevo trabajo que coincide con sus preferencias!*\n\n*{work_type}*\n🏡 {farm_name}\n💰 {pay}\n📍 {location}\n\nEscriba 'menu' y elija 1 para ver trabajos.",
         'select_job': '*Seleccione un trabajo para ver detalles y aplicar:*\n\nResponda con el número del trabajo (1-{max}) o escriba \'menu\' para volver al menú principal.',
 
         'application_submitted': '✅ *¡Solicitud Enviada!*',